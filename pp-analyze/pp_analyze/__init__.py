@@ -1,10 +1,27 @@
 from . import pp_analyze
-from .pp_analyze import analyze_pp, bulk_analyze_pp, QueryCategory, PARAM_OVERRIDE_CACHE
+from .pp_analyze import analyze_pp, bulk_analyze_pp, PipelineProfile, QueryCategory, ClassifierBackend, EntityAttachment, PARAM_OVERRIDE_CACHE
 from . import kg
 from .kg import convert_to_kg
+from . import kg_export
+from .kg_export import NQuadsWriter, export_nquads
 from . import dtou
-from .dtou import convert_to_app_policy
+from .dtou import convert_to_app_policy, convert_to_app_policy_from_kg
 from . import statistics
 from . import hierarchy_helper
+from . import lifting
+from .lifting import bulk_lift
+from . import columnar
+from .columnar import ColumnarResultSet
+from . import corpus
+from .corpus import PolicyCorpus, build_corpus, load_policy, load_policy_text
+from . import policy_text_utils
+from .policy_text_utils import Policy, get_policy
+from . import fingerprint
+from .fingerprint import FingerprintIndex
+from . import archive
+from .archive import save_results, load_results
 from . import utils
+from . import reasoner, reasoning_cache, scheduler
+from .scheduler import JobScheduler
 from . import user_preference_analyze, website_compliance_evaluation
+from . import benchmark
@@ -0,0 +1,216 @@
+'''
+Binary archive format for analysis results (`dict[WEBSITE, list[SegmentedDataPractice]]`, as from `bulk_analyze_pp`), based on msgpack.
+
+Layout:
+- header: MAGIC, format version (1 byte)
+- one msgpack block per website, holding the list of its segments
+- footer: a msgpack map with the schema (practice and entity classes, and the entity fields of each practice class) and the index from website to the (offset, length) of its block
+- trailer: offset of the footer (8 bytes, little endian), MAGIC
+
+The file is memory-mapped for reading, and only the blocks of the requested websites are decoded.
+Models are rebuilt with `model_construct` (without validation), and the round trip is lossless.
+'''
+
+import mmap
+import msgpack
+import os
+from pathlib import Path
+import struct
+from .data_model import SegmentedDataPractice, PartyEntity, Party, model_class_of
+from .columnar import PRACTICE_CLASSES, ENTITY_CLASSES, PRACTICE_ROLES
+
+
+MAGIC = b'PPAR'
+FORMAT_VERSION = 1
+
+_HEADER = MAGIC + bytes([FORMAT_VERSION])
+_TRAILER = struct.Struct('<Q4s')
+
+_PRACTICE_CLASS_CODES = {cls: code for code, cls in enumerate(PRACTICE_CLASSES)}
+_ENTITY_CLASS_CODES = {cls: code for code, cls in enumerate(ENTITY_CLASSES)}
+
+_PRACTICE_CLASSES_BY_NAME = {cls.__name__: cls for cls in PRACTICE_CLASSES}
+_ENTITY_CLASSES_BY_NAME = {cls.__name__: cls for cls in ENTITY_CLASSES}
+
+
+def _encode_entity(entity) -> list:
+    category = getattr(entity, 'category', None)
+    if isinstance(category, Party):
+        category = category.value
+    return [_ENTITY_CLASS_CODES[model_class_of(entity)], entity.text, category]
+
+
+def _encode_segments(segments: list[SegmentedDataPractice]) -> list:
+    return [
+        [
+            segment.segment,
+            [
+                [
+                    _PRACTICE_CLASS_CODES[model_class_of(practice)],
+                    practice.text,
+                    [[_encode_entity(entity) for entity in getattr(practice, role)] for role in PRACTICE_ROLES[model_class_of(practice)]],
+                ]
+                for practice in segment.practices
+            ],
+        ]
+        for segment in segments
+    ]
+
+
+class ResultArchiveWriter:
+    '''
+    Writer of a result archive. Websites are written one by one (e.g. from the `on_result` callback of `bulk_analyze_pp`), and the index is written when closing.
+    The archive is written to a temporary file next to path, which only replaces path when closed; if the `with` block raises (or `discard` is called), the temporary file is removed and path is left as it was.
+
+    Usage:
+    with ResultArchiveWriter(path) as writer:
+        writer.write(website, segments)
+    '''
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._tmp_path = Path(f"{path}.tmp")
+        self._f = open(self._tmp_path, 'wb')
+        self._f.write(_HEADER)
+        self._packer = msgpack.Packer(use_bin_type=True)
+        self._index: dict[str, tuple[int, int]] = {}
+
+    def write(self, website: str, segments: list[SegmentedDataPractice]):
+        if website in self._index:
+            raise ValueError(f"Website {website} is already in the archive")
+        block = self._packer.pack(_encode_segments(segments))
+        self._index[website] = (self._f.tell(), len(block))
+        self._f.write(block)
+
+    def write_all(self, results: dict[str, list[SegmentedDataPractice]]):
+        for website, segments in results.items():
+            self.write(website, segments)
+
+    def close(self):
+        if self._f.closed:
+            return
+        footer_offset = self._f.tell()
+        self._f.write(self._packer.pack({
+            'practice_classes': [cls.__name__ for cls in PRACTICE_CLASSES],
+            'entity_classes': [cls.__name__ for cls in ENTITY_CLASSES],
+            'roles': {cls.__name__: roles for cls, roles in PRACTICE_ROLES.items()},
+            'index': {website: list(location) for website, location in self._index.items()},
+        }))
+        self._f.write(_TRAILER.pack(footer_offset, MAGIC))
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        '''
+        Stop writing, and remove what is written so far.
+        '''
+        if self._f.closed:
+            return
+        self._f.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class ResultArchive:
+    '''
+    Reader of a result archive, with a read-only dictionary interface: `archive[website]` decodes and returns the list of `SegmentedDataPractice` of the website.
+    '''
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._f = open(self.path, 'rb')
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(_HEADER)] != _HEADER:
+            raise ValueError(f"{self.path} is not a result archive of version {FORMAT_VERSION}")
+        footer_offset, magic = _TRAILER.unpack(self._mm[-_TRAILER.size:])
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a complete result archive")
+        footer = msgpack.unpackb(self._mm[footer_offset:len(self._mm)-_TRAILER.size], raw=False)
+        self._practice_classes = [_PRACTICE_CLASSES_BY_NAME[name] for name in footer['practice_classes']]
+        self._entity_classes = [_ENTITY_CLASSES_BY_NAME[name] for name in footer['entity_classes']]
+        self._roles = {_PRACTICE_CLASSES_BY_NAME[name]: roles for name, roles in footer['roles'].items()}
+        self._index: dict[str, tuple[int, int]] = {website: tuple(location) for website, location in footer['index'].items()}
+
+    def _decode_entity(self, encoded: list):
+        class_code, text, category = encoded
+        cls = self._entity_classes[class_code]
+        if category is None:
+            return cls.model_construct(text=text)
+        if cls is PartyEntity:
+            category = Party(category)
+        return cls.model_construct(text=text, category=category)
+
+    def _decode_segments(self, encoded: list) -> list[SegmentedDataPractice]:
+        segments = []
+        for segment_text, encoded_practices in encoded:
+            practices = []
+            for class_code, text, encoded_roles in encoded_practices:
+                cls = self._practice_classes[class_code]
+                fields = {
+                    role: [self._decode_entity(entity) for entity in entities]
+                    for role, entities in zip(self._roles[cls], encoded_roles)
+                }
+                practices.append(cls.model_construct(text=text, **fields))
+            segments.append(SegmentedDataPractice.model_construct(segment=segment_text, practices=practices))
+        return segments
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, website: str) -> bool:
+        return website in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self) -> list[str]:
+        return list(self._index)
+
+    def __getitem__(self, website: str) -> list[SegmentedDataPractice]:
+        offset, length = self._index[website]
+        return self._decode_segments(msgpack.unpackb(self._mm[offset:offset+length], raw=False, use_list=True))
+
+    def get(self, website: str, default=None):
+        return self[website] if website in self else default
+
+    def load(self, websites: list[str] | None = None) -> dict[str, list[SegmentedDataPractice]]:
+        '''
+        Load the results of the given websites (all websites if None), skipping those not in the archive.
+        '''
+        if websites is None:
+            websites = self.keys()
+        return {website: self[website] for website in websites if website in self}
+
+    def close(self):
+        self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def save_results(results: dict[str, list[SegmentedDataPractice]], path: str | Path):
+    '''
+    Save the results (as from `bulk_analyze_pp`) into a result archive.
+    '''
+    with ResultArchiveWriter(path) as writer:
+        writer.write_all(results)
+
+
+def load_results(path: str | Path, websites: list[str] | None = None) -> dict[str, list[SegmentedDataPractice]]:
+    '''
+    Load the results of the given websites (all websites if None) from a result archive.
+    '''
+    with ResultArchive(path) as archive:
+        return archive.load(websites)
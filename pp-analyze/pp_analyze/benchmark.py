@@ -0,0 +1,302 @@
+'''
+Helpers for benchmarking alternative configurations of the analysis pipeline.
+They are meant to be called from notebooks, and mostly report numbers -- results are only compared where an implementation replaces a reference one.
+'''
+
+import asyncio
+import time
+from pydantic import ValidationError
+from tqdm.auto import tqdm
+from .data_model import SegmentedDataPractice, DataEntity, PurposeEntity, PartyEntity, DATA_PRACTICE_NAME_MAP, DATA_PRACTICE_CLASS_MAP
+from .dtou import AppPolicy, convert_to_app_policy, convert_to_app_policy_from_kg
+from .reasoner import EyeReasonerPool
+from .pp_analyze import analyze_pp, assemble_data_practices, PipelineProfile, PARAM_OVERRIDE_CACHE
+from .recognition import (
+    query_helper as qh,
+    group_data_practices_and_entities,
+    add_ids_into_grouped_practices,
+    convert_grouped_practices_to_query_data,
+    SWClassifiedDataEntities,
+    SWClassifiedPurposeEntities,
+    SWPartyEntities,
+    SWDataPractices,
+    SWGroupedDataPractice,
+    SWGroupedDataPracticeWithId,
+    Relation,
+    to_dict,
+)
+
+
+def _sum_usage(usage_stats: dict) -> dict:
+    total = {}
+    for usage in usage_stats.values():
+        for k, v in usage.items():
+            total[k] = total.get(k, 0) + v
+    return total
+
+
+async def benchmark_pipeline_profiles(pp_texts: list[str], profiles: list[PipelineProfile] = list(PipelineProfile), override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False) -> dict[PipelineProfile, dict]:
+    '''
+    Run `analyze_pp` over the same privacy policies with each of the pipeline profiles, and report latency and LLM usage for each profile.
+    Cached queries do not cost tokens (and are fast), so pass the relevant query categories in `override_cache` to measure cold runs; `cache_hits` in the result tells how many queries were served from cache.
+
+    @return: a dictionary from the profile to its statistics:
+    {
+        PROFILE: {
+            'wall_time': TOTAL_SECONDS,
+            'wall_time_per_policy': AVERAGE_SECONDS,
+            'num_practices': NUMBER_OF_IDENTIFIED_PRACTICES,
+            'num_errors': NUMBER_OF_REPORTED_ERRORS,
+            'queries': ..., 'cache_hits': ..., 'llm_calls': ..., 'prompt_tokens': ..., 'completion_tokens': ..., 'llm_time': ...,
+            'per_category': {QUERY_CATEGORY: USAGE},
+        }
+    }
+    '''
+    res = {}
+    for profile in profiles:
+        qh.reset_usage_stats()
+        num_practices = 0
+        num_errors = 0
+        start_time = time.perf_counter()
+        for pp_text in tqdm(pp_texts, leave=False, desc=f"Benchmarking profile {profile.value}"):
+            data_practices, errs = await analyze_pp(pp_text, override_cache=override_cache, batch=batch, profile=profile)
+            num_practices += sum(len(segment.practices) for segment in data_practices)
+            num_errors += len(errs)
+        wall_time = time.perf_counter() - start_time
+        usage_stats = {category: usage for category, usage in qh.get_usage_stats().items() if usage['queries']}
+        res[profile] = {
+            'wall_time': wall_time,
+            'wall_time_per_policy': wall_time / len(pp_texts) if pp_texts else 0.0,
+            'num_practices': num_practices,
+            'num_errors': num_errors,
+            **_sum_usage(usage_stats),
+            'per_category': usage_stats,
+        }
+    return res
+
+
+def _synthetic_stage_outputs(num_segments: int, num_practices: int, num_entities: int):
+    segments = [f"Segment {i}: we collect your data and share it with partners for advertising." for i in range(num_segments)]
+    practices = [SWDataPractices(segment=segment, practices=[
+        {'type': 'first-party-collection-use', 'text': f'collect {j}', 'span': (0, 7)} for j in range(num_practices)
+    ]) for segment in segments]
+    data_entities = [SWClassifiedDataEntities(segment=segment, entities=[
+        {'text': f'data {j}', 'span': (0, 4), 'category': 'Contact'} for j in range(num_entities)
+    ]) for segment in segments]
+    purpose_entities = [SWClassifiedPurposeEntities(segment=segment, entities=[
+        {'text': f'purpose {j}', 'span': (0, 7), 'category': 'Advertising'} for j in range(num_entities)
+    ]) for segment in segments]
+    parties = [SWPartyEntities(segment=segment, entities=[
+        {'text': 'we', 'party_type': 'First-party-entity'}
+    ]) for segment in segments]
+    return practices, data_entities, purpose_entities, parties
+
+
+# The steps between the LLM stages as they were before passing typed models between stages: each step dumps its input into dicts and re-validates its output; kept as the reference for `benchmark_stage_conversions`
+
+def _reference_group(data_practices, classified_data_entities, classified_purpose_entities, parties) -> list[SWGroupedDataPractice]:
+    indexed_data_entities = {segment["segment"]: segment.get("entities", []) for segment in to_dict(classified_data_entities)}
+    indexed_purpose_entities = {segment["segment"]: segment.get("entities", []) for segment in to_dict(classified_purpose_entities)}
+    indexed_parties = {segment["segment"]: segment.get("entities", []) for segment in to_dict(parties)}
+    res = []
+    for isegment in data_practices:
+        segment = to_dict(isegment)
+        segment_text = segment["segment"]
+        res.append(SWGroupedDataPractice(**{
+            "segment": segment_text,
+            "practices": [
+                {
+                    **practice,
+                    "parties": list(indexed_parties.get(segment_text, [])),
+                    "data": list(indexed_data_entities.get(segment_text, [])),
+                    "purpose": list(indexed_purpose_entities.get(segment_text, [])),
+                }
+                for practice in segment["practices"]
+            ],
+        }))
+    return res
+
+
+def _reference_add_ids(grouped_practices: list[SWGroupedDataPractice]) -> list[SWGroupedDataPracticeWithId]:
+    res = []
+    for segment in grouped_practices:
+        entity_counter = 0
+        practices_with_id = []
+        for practice_index, practice in enumerate(to_dict(segment.practices)):
+            practice_with_id = {"id": f"C{practice_index+1}", **practice}
+            for entity in practice_with_id["parties"] + practice_with_id["data"] + practice_with_id["purpose"]:
+                entity_counter += 1
+                entity["id"] = f"D{entity_counter}"
+            practices_with_id.append(practice_with_id)
+        res.append(SWGroupedDataPracticeWithId(**{"segment": segment.segment, "practices": practices_with_id}))
+    return res
+
+
+def _reference_query_data(grouped_practices_with_id: SWGroupedDataPracticeWithId) -> dict:
+    segment = to_dict(grouped_practices_with_id)
+    practices = segment["practices"]
+    action_contexts = [{"id": practice["id"], "action_type": practice["type"], "text": practice["text"]} for practice in practices]
+    entities = []
+    for practice in practices:
+        entities += [{"id": entity["id"], "text": entity["text"], "type": "Data"} for entity in practice["data"]]
+        entities += [{"id": entity["id"], "text": entity["text"], "type": "Purpose"} for entity in practice["purpose"]]
+        entities += [{"id": entity["id"], "text": entity["text"], "type": entity["party_type"]} for entity in practice["parties"]]
+    return {"segment": segment["segment"], "targets": {"action_contexts": action_contexts, "entities": entities}}
+
+
+def _reference_assemble(relations: list[Relation], grouped_practices_with_id: SWGroupedDataPracticeWithId) -> tuple[SegmentedDataPractice, list[str]]:
+    segment = to_dict(grouped_practices_with_id)
+    indexed_practices = {practice["id"]: practice for practice in segment["practices"]}
+    indexed_entity_objs = {}
+    for practice in segment["practices"]:
+        for entity in practice["data"]:
+            indexed_entity_objs[entity["id"]] = DataEntity(text=entity["text"], category=entity["category"])
+        for entity in practice["purpose"]:
+            indexed_entity_objs[entity["id"]] = PurposeEntity(text=entity["text"], category=entity["category"])
+        for entity in practice["parties"]:
+            indexed_entity_objs[entity["id"]] = PartyEntity(text=entity["text"], category=entity["party_type"])
+    indexed_relations = {}
+    for relation in relations:
+        indexed_relations.setdefault(relation.action_id, {}).setdefault(relation.relation, []).append(indexed_entity_objs[relation.entity_id])
+    res = []
+    errors = []
+    for action_id, my_relations in indexed_relations.items():
+        raw_action = indexed_practices[action_id]
+        if raw_action["type"] not in DATA_PRACTICE_NAME_MAP:
+            errors.append(f"Unexpected data practice type for {raw_action}")
+            continue
+        try:
+            res.append(DATA_PRACTICE_CLASS_MAP[DATA_PRACTICE_NAME_MAP[raw_action["type"]]](text=raw_action["text"], **my_relations))
+        except ValidationError as e:
+            errors.append(f"Validation error for {raw_action}: {e}")
+    return SegmentedDataPractice(segment=segment["segment"], practices=res), errors
+
+
+_STAGE_IMPLEMENTATIONS = {
+    'typed': (group_data_practices_and_entities, add_ids_into_grouped_practices, convert_grouped_practices_to_query_data, assemble_data_practices),
+    'dict': (_reference_group, _reference_add_ids, _reference_query_data, _reference_assemble),
+}
+
+
+def benchmark_stage_conversions(num_segments: int = 200, num_practices: int = 3, num_entities: int = 5, repeat: int = 5) -> dict[str, dict]:
+    '''
+    Micro-benchmark of the CPU cost of the steps between the LLM stages (grouping, adding IDs, composing relation queries, assembling), on synthetic stage outputs -- no LLM is queried.
+    Compares the current steps, which pass typed models between stages ('typed'), with the previous ones, which round-trip through dicts and re-validate at each step ('dict').
+    Each practice relates to its first data and purpose entity and the party.
+
+    @return: the average time per segment (in microseconds) of each step, and in total, for each implementation; the speedup of the total, and whether both give the same relation queries and data practices:
+    {
+        'typed': {'group': ..., 'add_ids': ..., 'query_data': ..., 'assemble': ..., 'total': ...},
+        'dict': {...},
+        'speedup': ...,
+        'equivalent': ...,
+    }
+    '''
+    practices, data_entities, purpose_entities, parties = _synthetic_stage_outputs(num_segments, num_practices, num_entities)
+    res = {}
+    outputs = {}
+    for name, (group, add_ids, query_data, assemble) in _STAGE_IMPLEMENTATIONS.items():
+        timings = {'group': 0.0, 'add_ids': 0.0, 'query_data': 0.0, 'assemble': 0.0}
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            grouped_practices = group(practices, data_entities, purpose_entities, parties)
+            timings['group'] += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            grouped_practices_with_id = add_ids(grouped_practices)
+            timings['add_ids'] += time.perf_counter() - start_time
+
+            start_time = time.perf_counter()
+            query_data_list = [query_data(segment) for segment in grouped_practices_with_id]
+            timings['query_data'] += time.perf_counter() - start_time
+
+            relations = [[
+                Relation(action_id=practice.id, entity_id=entity.id, relation=relation)
+                for practice in segment.practices
+                for entity, relation in [(practice.parties[0], 'Data-Collector'), (practice.data[0], 'Data-Collected'), (practice.purpose[0], 'Purpose-Argument')]
+            ] for segment in grouped_practices_with_id]
+            start_time = time.perf_counter()
+            assembled = [assemble(i_relations, segment) for i_relations, segment in zip(relations, grouped_practices_with_id)]
+            timings['assemble'] += time.perf_counter() - start_time
+
+        res[name] = {step: seconds / (repeat * num_segments) * 1e6 for step, seconds in timings.items()}
+        res[name]['total'] = sum(res[name].values())
+        outputs[name] = (query_data_list, [(segment.model_dump(), errors) for segment, errors in assembled])
+    res['speedup'] = res['dict']['total'] / res['typed']['total'] if res['typed']['total'] else float('inf')
+    res['equivalent'] = outputs['typed'] == outputs['dict']
+    return res
+
+
+def _normalize_app_policy(app_policy: AppPolicy) -> list:
+    def normalize_downstream(downstream):
+        return (downstream.text, downstream.user, downstream.app_name, tuple(sorted(map(str, downstream.purpose))))
+    return sorted(
+        (input_spec.text, str(input_spec.data), input_spec.user, input_spec.action, tuple(sorted(map(str, input_spec.purpose))), tuple(sorted(map(normalize_downstream, input_spec.downstream))))
+        for input_spec in app_policy.input_spec
+    )
+
+
+def benchmark_app_policy_construction(results: dict[str, list[SegmentedDataPractice]], num_policies: int = 10, repeat: int = 3) -> dict[str, dict]:
+    '''
+    Compare building app policies directly from the data practices (`dtou.convert_to_app_policy`) with building them through the knowledge graph (`dtou.convert_to_app_policy_from_kg`), on the largest policies (by number of practices) of the results.
+    The website is used as the first party name.
+
+    @param results: the analysis results, as from `bulk_analyze_pp` or `archive.load_results`
+    @return: a dictionary from the website to its statistics (times are averages in seconds):
+    {
+        WEBSITE: {
+            'num_practices': ..., 'from_kg': ..., 'direct': ..., 'speedup': ...,
+            'equivalent': WHETHER_THE_APP_POLICIES_ARE_THE_SAME,
+        }
+    }
+    '''
+    sizes = {website: sum(len(segment.practices) for segment in segments) for website, segments in results.items()}
+    largest = sorted(sizes, key=sizes.get, reverse=True)[:num_policies]
+    res = {}
+    for website in tqdm(largest, leave=False, desc="Benchmarking app policy construction"):
+        data_practices = results[website]
+        timings = {}
+        app_policies = {}
+        for name, convert in [('from_kg', convert_to_app_policy_from_kg), ('direct', convert_to_app_policy)]:
+            start_time = time.perf_counter()
+            for _ in range(repeat):
+                app_policies[name] = convert(data_practices, website, website)
+            timings[name] = (time.perf_counter() - start_time) / repeat
+        res[website] = {
+            'num_practices': sizes[website],
+            **timings,
+            'speedup': timings['from_kg'] / timings['direct'] if timings['direct'] else float('inf'),
+            'equivalent': _normalize_app_policy(app_policies['from_kg']) == _normalize_app_policy(app_policies['direct']),
+        }
+    return res
+
+
+async def benchmark_reasoner_pool(jobs: list[list[str]], rule_files: list[str], query_file: str, max_workers: int | None = None) -> dict[str, dict]:
+    '''
+    Compare the throughput of running reasoning jobs with the rules precompiled into an EYE image (the default of `reasoner.EyeReasonerPool`) against running `eye` with the rules for each job (the behaviour without a pool), with the same concurrency.
+    The reasoning cache is not involved.
+
+    @param jobs: the data documents of each job, e.g. [user_persona, app_policy, context] as in `user_preference_analyze.run_reasoning`
+    @param rule_files: the rule files, e.g. from `user_preference_analyze.get_reasoning_files`
+    @return: a dictionary from the mode ('per_job' and 'image') to its statistics:
+    {
+        MODE: {
+            'wall_time': ..., 'jobs_per_second': ..., 'image_time': ..., 'uses_image': ...,
+        }
+    }
+    '''
+    res = {}
+    for mode, use_image in [('per_job', False), ('image', True)]:
+        async with EyeReasonerPool(rule_files, query_file, max_workers=max_workers, use_image=use_image) as pool:
+            start_time = time.perf_counter()
+            for f in tqdm(asyncio.as_completed([pool.run(job) for job in jobs]), total=len(jobs), leave=False, desc=f"Benchmarking reasoner ({mode})"):
+                await f
+            wall_time = time.perf_counter() - start_time
+            stats = pool.get_stats()
+        res[mode] = {
+            'wall_time': wall_time,
+            'jobs_per_second': len(jobs) / wall_time if wall_time else 0.0,
+            'image_time': stats['image_time'],
+            'uses_image': stats['uses_image'],
+        }
+    return res
@@ -0,0 +1,343 @@
+'''
+Columnar in-memory store for analysis results (`dict[WEBSITE, list[SegmentedDataPractice]]`, as from `bulk_analyze_pp`).
+
+All strings (segment texts, practice and entity texts, categories) are interned into one string pool, and the results are kept in flat NumPy tables linked by offset arrays:
+- websites: name, and offsets into the segment table
+- segments: text, and offsets into the practice table
+- practices: class code, text, and offsets into the role table
+- roles: one row per entity field of the practice class (in `model_fields` order), and offsets into the entity table
+- entities: class code, text, and category (or party) code
+
+The views (`SegmentView`, `PracticeView`, `EntityView`) read from the tables without copying, and expose the same read API as the pydantic models (attribute access, `model_fields`). They are not instances of the model classes: their `model_class` tells the class of the model (see `data_model.model_class_of`, on which the read-only code of statistics, `dtou` and `archive` branches), and `to_model` converts them into models (e.g. for `kg`, or for changing them as `lifting` does).
+'''
+
+from collections.abc import Iterator
+import numpy as np
+from .data_model import (
+    SegmentedDataPractice,
+    DataPractice,
+    DATA_PRACTICE_CLASS_MAP,
+    DataEntity,
+    PurposeEntity,
+    PartyEntity,
+    Party,
+    Location,
+    Duration,
+    SecurityThreat,
+    ProtectionMethod,
+    model_class_of,
+)
+
+
+PRACTICE_CLASSES: list[type[DataPractice]] = list(DATA_PRACTICE_CLASS_MAP.values())
+ENTITY_CLASSES = [DataEntity, PurposeEntity, PartyEntity, Location, Duration, SecurityThreat, ProtectionMethod]
+
+_PRACTICE_CLASS_CODES = {cls: code for code, cls in enumerate(PRACTICE_CLASSES)}
+_ENTITY_CLASS_CODES = {cls: code for code, cls in enumerate(ENTITY_CLASSES)}
+_CATEGORIZED_ENTITY_CLASSES = (DataEntity, PurposeEntity, PartyEntity)
+
+# Entity fields (roles) of each practice class, in `model_fields` order
+PRACTICE_ROLES: dict[type[DataPractice], list[str]] = {
+    cls: [field for field in cls.model_fields if field != 'text']
+    for cls in PRACTICE_CLASSES
+}
+_PRACTICE_ROLE_POSITIONS: dict[type[DataPractice], dict[str, int]] = {
+    cls: {field: i for i, field in enumerate(roles)}
+    for cls, roles in PRACTICE_ROLES.items()
+}
+
+NO_CATEGORY = -1
+
+
+class StringPool:
+    '''
+    Interned strings, addressed by integer IDs.
+    '''
+
+    def __init__(self):
+        self.strings: list[str] = []
+        self._ids: dict[str, int] = {}
+
+    def intern(self, s: str) -> int:
+        string_id = self._ids.get(s)
+        if string_id is None:
+            string_id = len(self.strings)
+            self._ids[s] = string_id
+            self.strings.append(s)
+        return string_id
+
+    def __getitem__(self, string_id: int) -> str:
+        return self.strings[string_id]
+
+    def __len__(self):
+        return len(self.strings)
+
+
+class EntityView:
+    '''
+    Read-only view of an entity (`DataEntity`, `PurposeEntity`, `PartyEntity`, `Location`, ...) in a `ColumnarResultSet`.
+    '''
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: 'ColumnarResultSet', index: int):
+        self._store = store
+        self._index = index
+
+    @property
+    def model_class(self) -> type:
+        return ENTITY_CLASSES[self._store.entity_class_codes[self._index]]
+
+    @property
+    def text(self) -> str:
+        return self._store.strings[self._store.entity_texts[self._index]]
+
+    @property
+    def category(self):
+        cls = self.model_class
+        if cls not in _CATEGORIZED_ENTITY_CLASSES:
+            raise AttributeError(f"'{cls.__name__}' object has no attribute 'category'")
+        category = self._store.strings[self._store.entity_categories[self._index]]
+        return Party(category) if cls is PartyEntity else category
+
+    def to_model(self):
+        '''
+        Convert the view into the corresponding pydantic model (without validation).
+        '''
+        cls = self.model_class
+        if cls in _CATEGORIZED_ENTITY_CLASSES:
+            return cls.model_construct(text=self.text, category=self.category)
+        return cls.model_construct(text=self.text)
+
+    def __repr__(self):
+        return f"{self.model_class.__name__}View({self.to_model()!r})"
+
+
+class PracticeView:
+    '''
+    Read-only view of a data practice (`DataCollectionUse`, `DataSharingDisclosure`, ...) in a `ColumnarResultSet`.
+    The entity fields (e.g. `data_collected`) are lists of `EntityView`.
+    '''
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: 'ColumnarResultSet', index: int):
+        self._store = store
+        self._index = index
+
+    @property
+    def model_class(self) -> type[DataPractice]:
+        return PRACTICE_CLASSES[self._store.practice_class_codes[self._index]]
+
+    @property
+    def model_fields(self):
+        return self.model_class.model_fields
+
+    @property
+    def text(self) -> str:
+        return self._store.strings[self._store.practice_texts[self._index]]
+
+    def _role_entities(self, position: int) -> list[EntityView]:
+        role = self._store.role_offsets[self._index] + position
+        start, end = self._store.entity_offsets[role], self._store.entity_offsets[role+1]
+        return [EntityView(self._store, i) for i in range(start, end)]
+
+    def __getattr__(self, name: str) -> list[EntityView]:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        position = _PRACTICE_ROLE_POSITIONS[self.model_class].get(name)
+        if position is None:
+            raise AttributeError(f"'{self.model_class.__name__}' object has no attribute '{name}'")
+        return self._role_entities(position)
+
+    def to_model(self) -> DataPractice:
+        '''
+        Convert the view into the corresponding pydantic model (without validation).
+        '''
+        cls = self.model_class
+        fields = {
+            role: [entity.to_model() for entity in self._role_entities(position)]
+            for role, position in _PRACTICE_ROLE_POSITIONS[cls].items()
+        }
+        return cls.model_construct(text=self.text, **fields)
+
+    def __repr__(self):
+        return f"{self.model_class.__name__}View({self.to_model()!r})"
+
+
+class SegmentView:
+    '''
+    Read-only view of a `SegmentedDataPractice` in a `ColumnarResultSet`.
+    '''
+    __slots__ = ('_store', '_index')
+
+    def __init__(self, store: 'ColumnarResultSet', index: int):
+        self._store = store
+        self._index = index
+
+    @property
+    def model_class(self) -> type[SegmentedDataPractice]:
+        return SegmentedDataPractice
+
+    @property
+    def segment(self) -> str:
+        return self._store.strings[self._store.segment_texts[self._index]]
+
+    @property
+    def practices(self) -> list[PracticeView]:
+        start, end = self._store.practice_offsets[self._index], self._store.practice_offsets[self._index+1]
+        return [PracticeView(self._store, i) for i in range(start, end)]
+
+    def to_model(self) -> SegmentedDataPractice:
+        '''
+        Convert the view into a `SegmentedDataPractice` (without validation).
+        '''
+        return SegmentedDataPractice.model_construct(segment=self.segment, practices=[practice.to_model() for practice in self.practices])
+
+    def __repr__(self):
+        return f"SegmentedDataPracticeView({self.to_model()!r})"
+
+
+class ColumnarResultSet:
+    '''
+    Columnar store of analysis results of multiple websites, with a read-only dictionary interface: `result_set[website]` is the list of `SegmentView` of the website.
+    Use `from_results` / `to_results` to convert from / to `dict[WEBSITE, list[SegmentedDataPractice]]`.
+    '''
+
+    def __init__(self):
+        self.strings = StringPool()
+        self.website_names: list[str] = []
+        self._website_indices: dict[str, int] = {}
+        self.segment_offsets = np.zeros(1, dtype=np.int64)
+        self.segment_texts = np.zeros(0, dtype=np.int32)
+        self.practice_offsets = np.zeros(1, dtype=np.int64)
+        self.practice_class_codes = np.zeros(0, dtype=np.int8)
+        self.practice_texts = np.zeros(0, dtype=np.int32)
+        self.role_offsets = np.zeros(1, dtype=np.int64)
+        self.entity_offsets = np.zeros(1, dtype=np.int64)
+        self.entity_class_codes = np.zeros(0, dtype=np.int8)
+        self.entity_texts = np.zeros(0, dtype=np.int32)
+        self.entity_categories = np.zeros(0, dtype=np.int32)
+
+    @classmethod
+    def from_results(cls, results: dict[str, list[SegmentedDataPractice]]) -> 'ColumnarResultSet':
+        store = cls()
+        store.extend(results)
+        return store
+
+    def extend(self, results: dict[str, list[SegmentedDataPractice]]):
+        '''
+        Append the results of more websites. Websites already in the store are not allowed.
+        The store is only changed once all the results are converted, so it is left as it was if they cannot be (only the string pool may keep strings interned on the way, which are unused).
+        '''
+        for website in results:
+            if website in self._website_indices:
+                raise ValueError(f"Website {website} is already in the result set")
+
+        intern = self.strings.intern
+        segment_counts = []
+        segment_texts = []
+        practice_counts = []
+        practice_class_codes = []
+        practice_texts = []
+        role_counts = []
+        entity_counts = []
+        entity_class_codes = []
+        entity_texts = []
+        entity_categories = []
+        for segments in results.values():
+            segment_counts.append(len(segments))
+            for segment in segments:
+                segment_texts.append(intern(segment.segment))
+                practice_counts.append(len(segment.practices))
+                for practice in segment.practices:
+                    practice_cls = model_class_of(practice)
+                    roles = PRACTICE_ROLES[practice_cls]
+                    practice_class_codes.append(_PRACTICE_CLASS_CODES[practice_cls])
+                    practice_texts.append(intern(practice.text))
+                    role_counts.append(len(roles))
+                    for role in roles:
+                        entities = getattr(practice, role)
+                        entity_counts.append(len(entities))
+                        for entity in entities:
+                            entity_cls = model_class_of(entity)
+                            entity_class_codes.append(_ENTITY_CLASS_CODES[entity_cls])
+                            entity_texts.append(intern(entity.text))
+                            if entity_cls is PartyEntity:
+                                entity_categories.append(intern(entity.category.value))
+                            elif entity_cls in (DataEntity, PurposeEntity):
+                                entity_categories.append(intern(entity.category))
+                            else:
+                                entity_categories.append(NO_CATEGORY)
+
+        def extend_offsets(offsets: np.ndarray, counts: list[int]) -> np.ndarray:
+            return np.concatenate([offsets, offsets[-1] + np.cumsum(np.array(counts, dtype=np.int64))])
+
+        tables = {
+            'segment_offsets': extend_offsets(self.segment_offsets, segment_counts),
+            'practice_offsets': extend_offsets(self.practice_offsets, practice_counts),
+            'role_offsets': extend_offsets(self.role_offsets, role_counts),
+            'entity_offsets': extend_offsets(self.entity_offsets, entity_counts),
+            'segment_texts': np.concatenate([self.segment_texts, np.array(segment_texts, dtype=np.int32)]),
+            'practice_class_codes': np.concatenate([self.practice_class_codes, np.array(practice_class_codes, dtype=np.int8)]),
+            'practice_texts': np.concatenate([self.practice_texts, np.array(practice_texts, dtype=np.int32)]),
+            'entity_class_codes': np.concatenate([self.entity_class_codes, np.array(entity_class_codes, dtype=np.int8)]),
+            'entity_texts': np.concatenate([self.entity_texts, np.array(entity_texts, dtype=np.int32)]),
+            'entity_categories': np.concatenate([self.entity_categories, np.array(entity_categories, dtype=np.int32)]),
+        }
+        for name, table in tables.items():
+            setattr(self, name, table)
+        for website in results:
+            self._website_indices[website] = len(self.website_names)
+            self.website_names.append(website)
+
+    def __len__(self):
+        return len(self.website_names)
+
+    def __contains__(self, website: str) -> bool:
+        return website in self._website_indices
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.website_names)
+
+    def keys(self) -> list[str]:
+        return list(self.website_names)
+
+    def __getitem__(self, website: str) -> list[SegmentView]:
+        i = self._website_indices[website]
+        return [SegmentView(self, j) for j in range(self.segment_offsets[i], self.segment_offsets[i+1])]
+
+    def get(self, website: str, default=None):
+        return self[website] if website in self else default
+
+    def values(self) -> Iterator[list[SegmentView]]:
+        for website in self.website_names:
+            yield self[website]
+
+    def items(self) -> Iterator[tuple[str, list[SegmentView]]]:
+        for website in self.website_names:
+            yield website, self[website]
+
+    def to_results(self) -> dict[str, list[SegmentedDataPractice]]:
+        '''
+        Convert the store back into `dict[WEBSITE, list[SegmentedDataPractice]]` (without validation).
+        '''
+        return {website: [segment.to_model() for segment in segments] for website, segments in self.items()}
+
+    def nbytes(self) -> int:
+        '''
+        Approximate memory use of the tables and the string pool, in bytes.
+        '''
+        arrays = [
+            self.segment_offsets, self.segment_texts,
+            self.practice_offsets, self.practice_class_codes, self.practice_texts,
+            self.role_offsets,
+            self.entity_offsets, self.entity_class_codes, self.entity_texts, self.entity_categories,
+        ]
+        return sum(array.nbytes for array in arrays) + sum(len(s.encode('utf-8')) for s in self.strings.strings)
+
+
+def to_columnar(results: dict[str, list[SegmentedDataPractice]]) -> ColumnarResultSet:
+    return ColumnarResultSet.from_results(results)
+
+
+def from_columnar(result_set: ColumnarResultSet) -> dict[str, list[SegmentedDataPractice]]:
+    return result_set.to_results()
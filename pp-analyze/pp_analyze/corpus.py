@@ -0,0 +1,305 @@
+'''
+Access to the privacy policies, either as files under PP_POLICY_DIR (`PP_POLICY_DIR/a/ab/abc/abc....md`, following https://github.com/citp/privacy-policy-historical), or from a packed policy corpus at PP_POLICY_CORPUS, which is used instead if set.
+
+Packed corpus layout:
+- header: MAGIC, format version (1 byte)
+- one block per policy: its text (UTF-8), padding to 4 bytes, and the spans of its segments (as `policy_text_utils.convert_into_segments`), as pairs of uint32 (start, end) byte offsets into the text
+- footer: a msgpack map with the index from domain to the (text offset, text length, spans offset, number of segments, SHA-256 of the text) of its policy
+- trailer: offset of the footer (8 bytes, little endian), MAGIC
+
+The corpus is memory-mapped for reading; the text and segment spans of a policy are returned as views into the file (see `PolicyCorpus.get_bytes` and `PolicyCorpus.get_segment_spans`), without reading other policies.
+A corpus is built from the directory layout with `build_corpus`.
+'''
+
+from dotenv import load_dotenv
+import hashlib
+import mmap
+import msgpack
+import os
+from pathlib import Path
+import struct
+from . import policy_text_utils as ptu
+
+
+load_dotenv()
+
+MAGIC = b'PPCO'
+FORMAT_VERSION = 1
+
+_HEADER = MAGIC + bytes([FORMAT_VERSION])
+_TRAILER = struct.Struct('<Q4s')
+_SPAN = struct.Struct('<II')
+
+
+def get_relative_file_path_for_pp(website_name: str) -> Path:
+    policy_dir = os.getenv("PP_POLICY_DIR")
+    if policy_dir is None:
+        raise ValueError("PP_POLICY_DIR environment variable is not set.")
+    policy_dir = Path(policy_dir)
+    return policy_dir / website_name[:1] / website_name[:2] / website_name[:3] / f"{website_name}.md"
+
+
+def _segment_spans(text: str) -> list[tuple[int, int]]:
+    '''
+    The (start, end) byte offsets (in the UTF-8 encoded text) of the segments of the text, as `policy_text_utils.convert_into_segments`.
+    '''
+    spans = []
+    offset = 0
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if stripped:
+            start = offset + len(line[:len(line) - len(line.lstrip())].encode('utf-8'))
+            spans.append((start, start + len(stripped.encode('utf-8'))))
+        offset += len(line.encode('utf-8')) + 1
+    return spans
+
+
+class PolicyCorpusWriter:
+    '''
+    Writer of a packed policy corpus. Policies are written one by one, and the index is written when closing.
+    The corpus is written to a temporary file next to path, which only replaces path when closed; if the `with` block raises (or `discard` is called), the temporary file is removed and path is left as it was.
+
+    Usage:
+    with PolicyCorpusWriter(path) as writer:
+        writer.write(domain, pp_text)
+    '''
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._tmp_path = Path(f"{path}.tmp")
+        self._f = open(self._tmp_path, 'wb')
+        self._f.write(_HEADER)
+        self._index: dict[str, tuple[int, int, int, int, str]] = {}
+
+    def write(self, domain: str, pp_text: str):
+        if domain in self._index:
+            raise ValueError(f"Policy of {domain} is already in the corpus")
+        data = pp_text.encode('utf-8')
+        spans = _segment_spans(pp_text)
+        text_offset = self._f.tell()
+        self._f.write(data)
+        self._f.write(b'\0' * (-self._f.tell() % 4))
+        spans_offset = self._f.tell()
+        self._f.write(b''.join(_SPAN.pack(start, end) for start, end in spans))
+        self._index[domain] = (text_offset, len(data), spans_offset, len(spans), hashlib.sha256(data).hexdigest())
+
+    def close(self):
+        if self._f.closed:
+            return
+        footer_offset = self._f.tell()
+        self._f.write(msgpack.packb({'index': {domain: list(entry) for domain, entry in self._index.items()}}, use_bin_type=True))
+        self._f.write(_TRAILER.pack(footer_offset, MAGIC))
+        self._f.close()
+        os.replace(self._tmp_path, self.path)
+
+    def discard(self):
+        '''
+        Stop writing, and remove what is written so far.
+        '''
+        if self._f.closed:
+            return
+        self._f.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class PolicyCorpus:
+    '''
+    Reader of a packed policy corpus, with a read-only dictionary interface: `corpus[domain]` returns the text of the policy of the domain.
+    The views returned by `get_bytes` and `get_segment_spans` must be released before closing the corpus.
+    '''
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        self._f = open(self.path, 'rb')
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(_HEADER)] != _HEADER:
+            raise ValueError(f"{self.path} is not a policy corpus of version {FORMAT_VERSION}")
+        footer_offset, magic = _TRAILER.unpack(self._mm[-_TRAILER.size:])
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a complete policy corpus")
+        footer = msgpack.unpackb(self._mm[footer_offset:len(self._mm)-_TRAILER.size], raw=False)
+        self._index: dict[str, list] = footer['index']
+        self._view = memoryview(self._mm)
+        self.mtime_ns = os.stat(self.path).st_mtime_ns
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, domain: str) -> bool:
+        return domain in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def keys(self) -> list[str]:
+        return list(self._index)
+
+    def get_bytes(self, domain: str) -> memoryview:
+        '''
+        The text of the policy (UTF-8 encoded), as a view into the corpus file.
+        '''
+        text_offset, text_length, _, _, _ = self._index[domain]
+        return self._view[text_offset:text_offset+text_length]
+
+    def __getitem__(self, domain: str) -> str:
+        return str(self.get_bytes(domain), 'utf-8')
+
+    def get(self, domain: str, default=None):
+        return self[domain] if domain in self else default
+
+    def get_digest(self, domain: str) -> str:
+        '''
+        The SHA-256 of the text of the policy.
+        '''
+        return self._index[domain][4]
+
+    def get_text_length(self, domain: str) -> int:
+        return self._index[domain][1]
+
+    def get_segment_count(self, domain: str) -> int:
+        return self._index[domain][3]
+
+    def get_segment_spans(self, domain: str) -> memoryview:
+        '''
+        The (start, end) byte offsets into `get_bytes(domain)` of the segments of the policy, as a flat view of uint32 (start0, end0, start1, end1, ...) into the corpus file.
+        '''
+        _, _, spans_offset, n_segments, _ = self._index[domain]
+        return self._view[spans_offset:spans_offset+n_segments*_SPAN.size].cast('I')
+
+    def get_segments(self, domain: str) -> list[str]:
+        '''
+        The segments of the policy, as `policy_text_utils.convert_into_segments` of its text.
+        '''
+        data = self.get_bytes(domain)
+        spans = self.get_segment_spans(domain)
+        return [str(data[spans[i]:spans[i+1]], 'utf-8') for i in range(0, len(spans), 2)]
+
+    def close(self):
+        self._view.release()
+        self._mm.close()
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def build_corpus(path: str | Path, policy_dir: str | Path | None = None, domains: list[str] | None = None) -> int:
+    '''
+    Build a packed policy corpus at path from the policy files under policy_dir (PP_POLICY_DIR if None), in the directory layout of `get_relative_file_path_for_pp`.
+
+    @param domains: the domains to include (those without a policy file are skipped); all policy files if None
+    @return: the number of policies in the corpus
+    '''
+    policy_dir = policy_dir or os.getenv("PP_POLICY_DIR")
+    if policy_dir is None:
+        raise ValueError("PP_POLICY_DIR environment variable is not set.")
+    policy_dir = Path(policy_dir)
+    if not policy_dir.is_dir():
+        raise ValueError(f"Policy directory {policy_dir} does not exist.")
+    if domains is None:
+        pp_files = sorted(policy_dir.glob('*/*/*/*.md'))
+    else:
+        pp_files = [policy_dir / domain[:1] / domain[:2] / domain[:3] / f"{domain}.md" for domain in domains]
+    num = 0
+    # The corpus at path is only replaced if all policies are written (see `PolicyCorpusWriter`)
+    with PolicyCorpusWriter(path) as writer:
+        for pp_file in pp_files:
+            if not pp_file.exists():
+                continue
+            writer.write(pp_file.stem, pp_file.read_text())
+            num += 1
+    return num
+
+
+_policy_corpus = None
+
+
+def get_policy_corpus() -> PolicyCorpus | None:
+    '''
+    The packed policy corpus at PP_POLICY_CORPUS; None if PP_POLICY_CORPUS is not set.
+    '''
+    global _policy_corpus
+    if _policy_corpus is None:
+        corpus_path = os.getenv("PP_POLICY_CORPUS")
+        if not corpus_path:
+            return None
+        _policy_corpus = PolicyCorpus(corpus_path)
+    return _policy_corpus
+
+
+def policy_exists(domain: str) -> bool:
+    corpus = get_policy_corpus()
+    if corpus is not None:
+        return domain in corpus
+    return get_relative_file_path_for_pp(domain).exists()
+
+
+def load_policy_text(domain: str) -> str | None:
+    '''
+    The text of the privacy policy of the domain, from the packed corpus if PP_POLICY_CORPUS is set, or else from its file under PP_POLICY_DIR; None if there is none.
+    '''
+    corpus = get_policy_corpus()
+    if corpus is not None:
+        return corpus.get(domain)
+    pp_file = get_relative_file_path_for_pp(domain)
+    if not pp_file.exists():
+        return None
+    return pp_file.read_text()
+
+
+def load_policy(domain: str) -> ptu.Policy | None:
+    '''
+    The privacy policy of the domain, split into segments (see `policy_text_utils.get_policy`); None if there is none.
+    With a packed corpus, the digest in its index is used, so a cached policy is returned without reading its text.
+    '''
+    corpus = get_policy_corpus()
+    if corpus is not None:
+        if domain not in corpus:
+            return None
+        digest = corpus.get_digest(domain)
+        return ptu.get_cached_policy(digest) or ptu.get_policy(corpus[domain], digest=digest)
+    pp_text = load_policy_text(domain)
+    if pp_text is None:
+        return None
+    return ptu.get_policy(pp_text)
+
+
+def count_policy_segments(domain: str) -> int | None:
+    '''
+    The number of segments of the privacy policy of the domain (from the index of the packed corpus if PP_POLICY_CORPUS is set); None if there is no policy.
+    '''
+    corpus = get_policy_corpus()
+    if corpus is not None:
+        return corpus.get_segment_count(domain) if domain in corpus else None
+    policy = load_policy(domain)
+    if policy is None:
+        return None
+    return len(policy)
+
+
+def get_policy_version(domain: str) -> tuple[int, int] | None:
+    '''
+    A version of the policy of the domain, which changes when the policy changes: the (modification time, size) of the corpus (and the policy length), or of the policy file; None if there is no policy.
+    '''
+    corpus = get_policy_corpus()
+    if corpus is not None:
+        if domain not in corpus:
+            return None
+        return (corpus.mtime_ns, corpus.get_text_length(domain))
+    pp_file = get_relative_file_path_for_pp(domain)
+    if not pp_file.exists():
+        return None
+    stat = pp_file.stat()
+    return (stat.st_mtime_ns, stat.st_size)
@@ -173,3 +173,11 @@ DATA_PRACTICE_CLASS_MAP = {
     K_DATA_PRACTICE_DATA_STORAGE_RETENTION: DataStorageRetention,
     K_DATA_PRACTICE_DATA_SECURITY_PROTECTION: DataSecurityProtection,
 }
+
+
+def model_class_of(obj) -> type[BaseModel]:
+    '''
+    The model class of a model, or of a read-only view of a model (e.g. `columnar.PracticeView`), which tells it by its `model_class`.
+    Code that reads practices and entities (rather than changing them) branches on this instead of `isinstance`, so it accepts views as well.
+    '''
+    return getattr(obj, 'model_class', None) or obj.__class__
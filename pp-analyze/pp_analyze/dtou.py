@@ -3,13 +3,16 @@ from pydantic import BaseModel
 from rdflib import IdentifiedNode, Graph, URIRef, BNode, Namespace, Literal
 from .data_model import (
     SegmentedDataPractice,
+    DataPractice,
     DataCollectionUse,
     DataSharingDisclosure,
     DataStorageRetention,
     DataSecurityProtection,
     Party,
+    PartyEntity,
+    model_class_of,
 )
-from .kg import convert_to_kg, one, A, NS, NS_DPV
+from .kg import convert_to_kg, one, A, NS, NS_DPV, N_DATA_GENERAL, to_data_category_uri, to_purpose_category_uri
 from .recognition import UnexpectedEntryError
 
 
@@ -49,25 +52,27 @@ class AppPolicy(BaseModel):
     app_name: str
     input_spec: list[InputSpec] = []
 
-    def to_rdf(self):
+    def to_rdf(self, node_prefix: str = ''):
         '''
         Convert the AppPolicy to RDF app policy document.
+        Blank node labels are derived from the position of the node in the app policy, so the same app policy always gives the same document (and the same serialization).
+        The node_prefix is prepended to the name of the policy node and to the blank node labels, to keep the nodes of multiple app policies apart in the same reasoning run.
         '''
         g = Graph()
         g.bind('dtou', NS_DTOU)
         g.bind('dpv', NS_DPV)
         g.bind('ex', NS_EX)
-        n_policy = NS_EX['policy1']
+        n_policy = NS_EX[f'{node_prefix}policy1']
         g.add((n_policy, A, NS_DTOU['AppPolicy']))
         g.add((n_policy, NS_DTOU['app_name'], URIRef(self.app_name)))
         for i, input_spec in enumerate(self.input_spec):
-            n_input_spec = BNode()
+            n_input_spec = BNode(f"{node_prefix}inputSpec{i}")
             g.add((n_policy, NS_DTOU['input_spec'], n_input_spec))
             g.add((n_input_spec, A, NS_DTOU['InputSpec']))
             g.add((n_input_spec, NS['text'], Literal(input_spec.text)))
 
             port_name = f"inputPort{i}"
-            n_port = BNode()
+            n_port = BNode(f"{node_prefix}inputSpec{i}port")
             g.add((n_input_spec, NS_DTOU['port'], n_port))
             g.add((n_port, A, NS_DTOU['Port']))
             g.add((n_port, NS_DTOU['name'], Literal(port_name)))
@@ -77,22 +82,22 @@ class AppPolicy(BaseModel):
                 g.add((n_input_spec, NS_DTOU['user'], Literal(input_spec.user)))
             if input_spec.action:
                 g.add((n_input_spec, NS_DTOU['action'], Literal(input_spec.action)))
-            for purpose in input_spec.purpose:
-                n_pe = BNode()
+            for j, purpose in enumerate(input_spec.purpose):
+                n_pe = BNode(f"{node_prefix}inputSpec{i}purpose{j}")
                 g.add((n_input_spec, NS_DTOU['purpose'], n_pe))
                 g.add((n_pe, A, NS_DTOU['Expectation']))
                 g.add((n_pe, NS_DTOU['category'], NS_DTOU['PurposeCategory']))
                 g.add((n_pe, NS_DTOU['descriptor'], purpose))
-            for downstream in input_spec.downstream:
-                n_downstream = BNode()
+            for k, downstream in enumerate(input_spec.downstream):
+                n_downstream = BNode(f"{node_prefix}inputSpec{i}downstream{k}")
                 g.add((n_input_spec, NS_DTOU['downstream'], n_downstream))
                 g.add((n_downstream, NS['text'], Literal(downstream.text)))
                 if downstream.user:
                     g.add((n_downstream, NS_DTOU['user'], Literal(downstream.user)))
                 if downstream.app_name:
                     g.add((n_downstream, NS_DTOU['app_name'], Literal(downstream.app_name)))
-                for purpose in downstream.purpose:
-                    n_pe = BNode()
+                for j, purpose in enumerate(downstream.purpose):
+                    n_pe = BNode(f"{node_prefix}inputSpec{i}downstream{k}purpose{j}")
                     g.add((n_downstream, NS_DTOU['purpose'], n_pe))
                     g.add((n_pe, A, NS_DPV['Expectation']))
                     g.add((n_pe, NS_DTOU['category'], NS_DTOU['PurposeCategory']))
@@ -100,10 +105,150 @@ class AppPolicy(BaseModel):
         return g
 
 
+def _practice_data(practice: DataPractice) -> list[URIRef]:
+    '''
+    The (distinct) data category nodes of a data collection or sharing practice, as linked in the knowledge graph (see `kg.build_kg_triples`), including the general data assumed for practices without data.
+    '''
+    if issubclass(model_class_of(practice), DataCollectionUse):
+        data_list = [to_data_category_uri(data.category) for data in practice.data_collected]
+        if not practice.data_collected and practice.data_collector and practice.purpose:
+            data_list.append(N_DATA_GENERAL)
+    elif issubclass(model_class_of(practice), DataSharingDisclosure):
+        data_list = [to_data_category_uri(data.category) for data in practice.data_shared]
+        if not practice.data_shared and practice.purpose:
+            data_list.append(N_DATA_GENERAL)
+    else:
+        data_list = []
+    return list(dict.fromkeys(data_list))
+
+
+def _party_key(party: PartyEntity) -> tuple[Party, str | None]:
+    '''
+    The identity of the party node of the knowledge graph (see `kg.build_kg_triples`): third parties are identified by name, and the first party and the user are single nodes.
+    '''
+    if party.category == Party.FIRST_PARTY or party.category == Party.USER:
+        return (party.category, None)
+    elif party.category == Party.THIRD_PARTY:
+        return (party.category, party.text)
+    else:
+        raise ValueError(f"Unknown party type: {party}")
+
+
 def convert_to_app_policy(data_practices: list[SegmentedDataPractice], app_name: str, first_party: str) -> AppPolicy:
     """
     Convert the data practices to *app policy* as in Perennial DToU policy language.
     Assume the passed in data_practices belong to the same privacy policy, e.g. output from `pp_analyze.analyze_pp`.
+    The app policy is built directly from the data practices, with an index from data category to the data sharing practices about it, in linear time. It is the same as the one from `convert_to_app_policy_from_kg` (which goes through the knowledge graph), up to the order of input specs and their lists.
+    """
+    # Parties present in the policy, for the fallback of a collection without a collector (see `to_user_field`)
+    party_keys = {}
+    for segment in data_practices:
+        for practice in segment.practices:
+            if issubclass(model_class_of(practice), DataCollectionUse):
+                parties = practice.data_collector + practice.data_provider
+            elif issubclass(model_class_of(practice), DataSharingDisclosure):
+                parties = practice.data_sharer + practice.data_receiver + practice.data_provider
+            elif issubclass(model_class_of(practice), DataSecurityProtection):
+                parties = practice.data_protector + practice.data_provider
+            else:
+                parties = []
+            for party in parties:
+                party_keys.setdefault(_party_key(party), None)
+    has_first_party = any(category == Party.FIRST_PARTY for category, _ in party_keys)
+    third_party_names = [name for category, name in party_keys if category == Party.THIRD_PARTY]
+
+    def to_user_field(party_key: tuple[Party, str | None] | None) -> str:
+        if party_key is None:
+            # Same as the knowledge graph lookup with an unbound party: any first party, or else any third party
+            if has_first_party:
+                return first_party
+            elif third_party_names:
+                return third_party_names[0]
+            raise UnexpectedEntryError("`User` should not appear in this context")
+        category, name = party_key
+        if category == Party.FIRST_PARTY:
+            return first_party
+        elif category == Party.THIRD_PARTY:
+            return name
+        else:
+            raise UnexpectedEntryError("`User` should not appear in this context")
+
+    def construct_downstream_from_data_sharing(segment_text: str, practice: DataSharingDisclosure) -> list[Downstream]:
+        receiver_list = list(dict.fromkeys(_party_key(receiver) for receiver in practice.data_receiver))
+        purpose_list = list(dict.fromkeys(to_purpose_category_uri(purpose.category) for purpose in practice.purpose))
+        if not receiver_list:
+            return [Downstream(
+                text=segment_text,
+                user=None,
+                purpose=purpose_list
+            )]
+        res = []
+        for user in receiver_list:
+            try:
+                res.append(Downstream(
+                    text=segment_text,
+                    user=to_user_field(user),
+                    purpose=purpose_list
+                ))
+            except UnexpectedEntryError:
+                pass
+        return res
+
+    collections = []
+    sharings = []
+    collected_data = set()
+    downstreams_by_data = defaultdict(list)
+    for segment in data_practices:
+        for practice in segment.practices:
+            if issubclass(model_class_of(practice), DataCollectionUse):
+                data_list = _practice_data(practice)
+                collections.append((segment.segment, practice, data_list))
+                collected_data.update(data_list)
+            elif issubclass(model_class_of(practice), DataSharingDisclosure):
+                data_list = _practice_data(practice)
+                downstreams = construct_downstream_from_data_sharing(segment.segment, practice)
+                sharings.append((segment.segment, data_list, downstreams))
+                for data in data_list:
+                    downstreams_by_data[data].extend(downstreams)
+
+    app_policy = AppPolicy(app_name=app_name)
+
+    for text, practice, data_list in collections:
+        purpose_list = list(dict.fromkeys(to_purpose_category_uri(purpose.category) for purpose in practice.purpose))
+        user_list = list(dict.fromkeys(_party_key(party) for party in practice.data_collector))
+        user = user_list[0] if user_list else None
+        for data in data_list:
+            try:
+                input_spec = InputSpec(
+                    data=data,
+                    text=text,
+                    user=to_user_field(user),
+                    purpose=purpose_list,
+                    downstream=list(downstreams_by_data[data])
+                )
+                app_policy.input_spec.append(input_spec)
+            except UnexpectedEntryError:
+                pass
+
+    for text, data_list, downstreams in sharings:
+        for data in data_list:
+            if data in collected_data:
+                continue
+            input_spec = InputSpec(
+                text=text,
+                data=data,
+                downstream=list(downstreams)
+            )
+            app_policy.input_spec.append(input_spec)
+
+    return app_policy
+
+
+def convert_to_app_policy_from_kg(data_practices: list[SegmentedDataPractice], app_name: str, first_party: str) -> AppPolicy:
+    """
+    Convert the data practices to *app policy* as in Perennial DToU policy language, through their knowledge graph representation (see `convert_to_kg`).
+    Assume the passed in data_practices belong to the same privacy policy, e.g. output from `pp_analyze.analyze_pp`.
+    This is the reference implementation of `convert_to_app_policy`, which is quadratic in the number of practices.
     """
     kg = convert_to_kg(data_practices, app_name, first_party)
 
@@ -0,0 +1,232 @@
+'''
+Fingerprints of privacy policies (by domain, see `corpus.load_policy_text`), for finding duplicate policies across a corpus.
+
+Each policy (without its first line, the header of the policy file) gets:
+- a content digest (SHA-256), identical for exactly duplicated policies;
+- a MinHash signature over its (normalised) segments, whose agreement estimates the Jaccard similarity of the segment sets of two policies, for finding near duplicates. Candidate pairs are found by locality-sensitive hashing (LSH) over bands of the signatures, and kept if their estimated similarity reaches the threshold. With the default banding (LSH_BANDS bands of NUM_PERM / LSH_BANDS rows), pairs of similarity above about 0.7 are found with high probability; lower thresholds miss pairs.
+
+Fingerprints are stored in a SQLite database next to PP_POLICY_CORPUS or PP_POLICY_DIR (`PP_POLICY_DIR.fingerprints.sqlite`, or PP_FINGERPRINT_DB), and only recomputed for policies that changed (see `corpus.get_policy_version`).
+'''
+
+from dotenv import load_dotenv
+import hashlib
+import numpy as np
+import os
+from pathlib import Path
+import re
+from sqlalchemy import delete
+from sqlmodel import Field, Session, SQLModel, create_engine, select
+from typing import Optional
+from . import policy_text_utils as ptu
+from .corpus import get_policy_version, load_policy_text
+
+
+load_dotenv()
+
+NUM_PERM = 128
+LSH_BANDS = 16
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_rng = np.random.RandomState(1)
+_PERM_A = _rng.randint(1, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+_PERM_B = _rng.randint(0, (1 << 61) - 1, size=NUM_PERM, dtype=np.uint64)
+
+_RE_WHITESPACE = re.compile(r'\s+')
+
+# Keys per statement in bulk operations (below the SQLite limit of variables)
+_BULK_SIZE = 500
+
+
+class PolicyFingerprint(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    policy: str = Field(index=True, unique=True)
+    mtime_ns: int
+    size: int
+    digest: str = Field(index=True)
+    signature: bytes
+
+
+def _policy_body(pp_text: str) -> str:
+    parts = pp_text.strip().split('\n', 1)
+    return parts[1] if len(parts) > 1 else ''
+
+
+def _shingle_hashes(body: str) -> np.ndarray:
+    shingles = {_RE_WHITESPACE.sub(' ', segment.lower()) for segment in ptu.convert_into_segments(body)}
+    return np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest(), 'little') for s in shingles], dtype=np.uint64)
+
+
+def minhash_signature(body: str) -> np.ndarray:
+    '''
+    The MinHash signature (NUM_PERM values) of the segments of the policy text.
+    '''
+    hashes = _shingle_hashes(body)
+    if len(hashes) == 0:
+        return np.full(NUM_PERM, _MAX_HASH, dtype=np.uint32)
+    # Universal hashing (a * x + b) mod p, truncated to 32 bits; the product wraps around in uint64, as in common MinHash implementations
+    permuted = np.bitwise_and((np.outer(_PERM_A, hashes) + _PERM_B[:, None]) % _MERSENNE_PRIME, _MAX_HASH)
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def compute_fingerprint(pp_text: str) -> tuple[str, np.ndarray]:
+    '''
+    @return: the content digest and the MinHash signature of the policy text
+    '''
+    body = _policy_body(pp_text)
+    return hashlib.sha256(body.encode('utf-8')).hexdigest(), minhash_signature(body)
+
+
+def estimate_similarity(signature1: np.ndarray, signature2: np.ndarray) -> float:
+    '''
+    Estimated Jaccard similarity of the segment sets of two policies, from their signatures.
+    '''
+    return float(np.mean(signature1 == signature2))
+
+
+class _UnionFind:
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i: int, j: int):
+        i, j = self.find(i), self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+
+class FingerprintIndex:
+    '''
+    Usage:
+    index = get_fingerprint_index()
+    clusters = index.find_duplicates(domains, threshold=0.8)
+    '''
+
+    def __init__(self, db_file: str | Path):
+        self.db_file = Path(db_file)
+        self.engine = create_engine(f'sqlite:///{self.db_file.absolute()}')
+        PolicyFingerprint.__table__.create(self.engine, checkfirst=True)
+
+    def update(self, policies: list[str]) -> int:
+        '''
+        Compute the fingerprints of the policies (by domain) that are new or changed since they were last fingerprinted.
+        @return: the number of fingerprints computed
+        '''
+        versions = {}
+        for policy in policies:
+            version = get_policy_version(policy)
+            if version is None:
+                raise FileNotFoundError(f"No privacy policy for {policy}")
+            versions[policy] = version
+        known = {}
+        keys = list(versions)
+        with Session(self.engine) as session:
+            for i in range(0, len(keys), _BULK_SIZE):
+                chunk = keys[i:i+_BULK_SIZE]
+                for policy, mtime_ns, size in session.exec(select(PolicyFingerprint.policy, PolicyFingerprint.mtime_ns, PolicyFingerprint.size).where(PolicyFingerprint.policy.in_(chunk))):
+                    known[policy] = (mtime_ns, size)
+            changed = [policy for policy, version in versions.items() if known.get(policy) != version]
+            for i in range(0, len(changed), _BULK_SIZE):
+                chunk = changed[i:i+_BULK_SIZE]
+                records = []
+                for policy in chunk:
+                    digest, signature = compute_fingerprint(load_policy_text(policy))
+                    records.append(PolicyFingerprint(policy=policy, mtime_ns=versions[policy][0], size=versions[policy][1], digest=digest, signature=signature.tobytes()))
+                session.execute(delete(PolicyFingerprint).where(PolicyFingerprint.policy.in_(chunk)))
+                session.add_all(records)
+                session.commit()
+        return len(changed)
+
+    def get_many(self, policies: list[str]) -> dict[str, tuple[str, np.ndarray]]:
+        '''
+        @return: the (digest, signature) of each fingerprinted policy
+        '''
+        keys = list(policies)
+        res = {}
+        with Session(self.engine) as session:
+            for i in range(0, len(keys), _BULK_SIZE):
+                chunk = keys[i:i+_BULK_SIZE]
+                for policy, digest, signature in session.exec(select(PolicyFingerprint.policy, PolicyFingerprint.digest, PolicyFingerprint.signature).where(PolicyFingerprint.policy.in_(chunk))):
+                    res[policy] = (digest, np.frombuffer(signature, dtype=np.uint32))
+        return res
+
+    def find_duplicates(self, policies: list[str], threshold: float | None = None, update: bool = True) -> list[list[str]]:
+        '''
+        Cluster the policies (by domain) into (near) duplicates.
+
+        @param threshold: the estimated similarity from which policies are near duplicates; only exact duplicates (same digest) if None
+        @param update: fingerprint new or changed policies first (see `update`)
+        @return: the clusters of more than one policy, in the order of the policies
+        '''
+        if update:
+            self.update(policies)
+        fingerprints = self.get_many(policies)
+        keys = list(dict.fromkeys(policy for policy in policies if policy in fingerprints))
+        uf = _UnionFind(len(keys))
+
+        first_by_digest = {}
+        for i, key in enumerate(keys):
+            j = first_by_digest.setdefault(fingerprints[key][0], i)
+            uf.union(i, j)
+
+        if threshold is not None and first_by_digest:
+            # Only one policy per digest takes part in LSH
+            representatives = np.array(list(first_by_digest.values()))
+            signatures = np.stack([fingerprints[keys[i]][1] for i in representatives])
+            rows = NUM_PERM // LSH_BANDS
+            for band in range(LSH_BANDS):
+                band_keys = np.ascontiguousarray(signatures[:, band*rows:(band+1)*rows]).view(np.dtype((np.void, rows * 4))).ravel()
+                _, bucket = np.unique(band_keys, return_inverse=True)
+                order = np.argsort(bucket, kind='stable')
+                sorted_bucket = bucket[order]
+                starts = np.flatnonzero(np.r_[True, sorted_bucket[1:] != sorted_bucket[:-1]])
+                # Compare all pairs of policies in each bucket
+                for members in np.split(order, starts[1:]):
+                    member_signatures = signatures[members]
+                    for k in range(len(members) - 1):
+                        similar = (member_signatures[k+1:] == member_signatures[k]).mean(axis=1) >= threshold
+                        for j in members[k+1:][similar]:
+                            uf.union(int(representatives[members[k]]), int(representatives[j]))
+
+        clusters = {}
+        for i, key in enumerate(keys):
+            clusters.setdefault(uf.find(i), []).append(key)
+        return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+    def invalidate(self, policies: list[str] | None = None) -> int:
+        '''
+        Remove the fingerprints of the policies (all if None).
+        @return: the number of removed fingerprints
+        '''
+        statement = delete(PolicyFingerprint)
+        if policies is not None:
+            statement = statement.where(PolicyFingerprint.policy.in_(list(policies)))
+        with Session(self.engine) as session:
+            removed = session.execute(statement).rowcount
+            session.commit()
+        return removed
+
+
+_fingerprint_index = None
+
+
+def get_fingerprint_index() -> FingerprintIndex:
+    '''
+    The fingerprint index at PP_FINGERPRINT_DB, or next to the policies (as `PP_POLICY_CORPUS.fingerprints.sqlite` or `PP_POLICY_DIR.fingerprints.sqlite`).
+    '''
+    global _fingerprint_index
+    if _fingerprint_index is None:
+        db_file = os.getenv("PP_FINGERPRINT_DB")
+        if not db_file:
+            policy_source = os.getenv("PP_POLICY_CORPUS") or os.getenv("PP_POLICY_DIR")
+            if policy_source is None:
+                raise ValueError("PP_POLICY_DIR environment variable is not set.")
+            policy_source = Path(policy_source).absolute()
+            db_file = policy_source.parent / f"{policy_source.name}.fingerprints.sqlite"
+        _fingerprint_index = FingerprintIndex(db_file)
+    return _fingerprint_index
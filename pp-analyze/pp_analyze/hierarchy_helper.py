@@ -2,7 +2,7 @@ from dotenv import load_dotenv
 import json
 import os
 from rdflib import URIRef
-from ppa_commons import get_entity_category_hierarchy
+from ppa_commons import get_entity_category_hierarchy, compile_hierarchy, CompiledHierarchy
 
 
 load_dotenv()
@@ -20,9 +20,18 @@ def get_data_category_hierarchy():
     return data_category_hierarchy
 
 
+def get_compiled_purpose_hierarchy() -> CompiledHierarchy:
+    return compile_hierarchy(get_purpose_hierarchy())
+
+
+def get_compiled_data_category_hierarchy() -> CompiledHierarchy:
+    return compile_hierarchy(get_data_category_hierarchy())
+
+
 def get_path_to_node(node: str, hierarchy: dict, level: int = 0, allow_non_exist: bool = True) -> list[str]:
     """
-    Get the path(s) to a node in the hierarchy.
+    Get the path(s) to a node in the hierarchy, by walking the hierarchy.
+    For repeated queries, use the compiled hierarchy (`compile_hierarchy(hierarchy).paths(node)`), which gives the same paths.
     """
     paths = []
     for parent, children in hierarchy.items():
@@ -45,19 +54,7 @@ def map_entity_category_to_level(category: str, hierarchy: dict, level: int = 1)
     If the category is not found in the hierarchy, return the category itself.
     The `category` must be the key type of the hierarchy.
     """
-    if level == -1:
-        return category
-    paths = get_path_to_node(category, hierarchy)
-    if not paths:
-        return category
-    longest_path = []
-    for path in paths:
-        if len(path) > len(longest_path):
-            longest_path = path
-    if len(longest_path) > level:
-        return longest_path[level]
-    else:
-        return longest_path[-1]
+    return compile_hierarchy(hierarchy).map_to_level(category, level)
 
 
 def map_category_uri_to_level(category_uri: URIRef, hierarchy: dict, level: int = 1):
@@ -93,10 +90,10 @@ def map_data_category_to_level(data_category: str, level: int = 1):
 
 
 def get_path_to_purpose(purpose: URIRef):
-    return get_path_to_node(purpose, get_purpose_hierarchy(), allow_non_exist=True)
+    return get_compiled_purpose_hierarchy().paths(purpose, allow_non_exist=True)
 
 def get_path_to_data_category(data_category: str):
-    return get_path_to_node(data_category, get_data_category_hierarchy(), allow_non_exist=True)
+    return get_compiled_data_category_hierarchy().paths(data_category, allow_non_exist=True)
 
 
 def lift_category_to_target(category: str, targets: list[str], hierarchy: dict) -> str:
@@ -105,17 +102,7 @@ def lift_category_to_target(category: str, targets: list[str], hierarchy: dict)
     If the category is not a subclass of any of the target categories, return the category itself. Thus it's safe to apply this function without checking the subclass relationship.
     Assumes that the category is in the hierarchy.
     """
-    paths = get_path_to_node(category, hierarchy)
-    if not paths:
-        return category
-    longest_path = []
-    for path in paths:
-        if len(path) > len(longest_path):
-            longest_path = path
-    for elem in reversed(longest_path):
-        if elem in targets:
-            return elem
-    return category
+    return compile_hierarchy(hierarchy).lift(category, targets)
 
 
 def lift_purpose_to_target(purpose: str, targets: list[str]):
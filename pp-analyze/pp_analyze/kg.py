@@ -1,6 +1,8 @@
+from collections import defaultdict
+import hashlib
 from rdflib import Graph, Literal, Namespace, URIRef, BNode
+from rdflib.term import Node
 from rdflib.namespace import RDF
-import uuid
 from .data_model import (
     SegmentedDataPractice,
     DataCollectionUse,
@@ -59,118 +61,152 @@ def to_protection_method_uri(protection_method: ProtectionMethod) -> URIRef:
     return NS[protection_method.text]
 
 
-def convert_to_kg(data_practices: list[SegmentedDataPractice], app_name: str, first_party: str) -> Graph:
-    f'''
-    Convert the data practices to knowledge graph representation.
-    Assume the passed in data_practices belong to the same privacy policy, e.g. output from `pp_analyze.analyze_pp`.
-    Result knowledge graph will always have the following node:
-    (?p a {NS["PrivacyPolicy"]})
+def _digest(*parts: str) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+def policy_content(data_practices: list[SegmentedDataPractice], app_name: str, first_party: str) -> tuple[str, ...]:
     '''
-    g = Graph()
-    g.namespace_manager.bind('dpv', NS_DPV)
-    g.namespace_manager.bind('pr2g', NS)
-    g.namespace_manager.bind('pol', NS_POLICY)
-    n_first_party = None
-    n_user = None
-    n_data_general = None
+    The content of the privacy policy (its data practices, app name and first party), as a tuple of strings that is equal for equal policies.
+    Each practice is serialised on its own (as its subclass of `DataPractice`), as serialising the segments would only keep the fields of `DataPractice`.
+    '''
+    parts = [app_name, first_party]
+    for data_practice in data_practices:
+        parts.append(data_practice.segment)
+        parts.append(str(len(data_practice.practices)))
+        for practice in data_practice.practices:
+            parts.append(practice.__class__.__name__)
+            parts.append(practice.model_dump_json())
+    return tuple(parts)
+
+
+def policy_digest(data_practices: list[SegmentedDataPractice], app_name: str, first_party: str) -> str:
+    '''
+    Digest of the content of the privacy policy (see `policy_content`), from which the node identifiers of its knowledge graph are derived.
+    '''
+    return _digest(*policy_content(data_practices, app_name, first_party))
+
+
+def build_kg_triples(data_practices: list[SegmentedDataPractice], app_name: str, first_party: str, n_site: URIRef | None = None, bnode_prefix: str | None = None) -> list[tuple[Node, Node, Node]]:
+    '''
+    Build the triples of the knowledge graph representation of the data practices (see `convert_to_kg`), without putting them into a graph.
+    Each distinct segment text, party (third parties by name) and category has a single node.
+    Node identifiers are derived from the content: the privacy policy node from `policy_digest`, and the label of each blank node from the prefix and the digest of what the node stands for (the segment text, the party, or the practice with its segment and its occurrence), so the same practices always give the same triples.
+
+    @param n_site: the node of the privacy policy; derived from `policy_digest` if None
+    @param bnode_prefix: the prefix of the blank node labels; the policy digest if None, keeping the labels of different policies apart
+    '''
+    digest = policy_digest(data_practices, app_name, first_party)
+    if n_site is None:
+        n_site = URIRef(NS_POLICY[digest])
+    if bnode_prefix is None:
+        bnode_prefix = f"p{digest}"
+    def new_bnode(kind: str, *content: str) -> BNode:
+        return BNode(f"{bnode_prefix}{kind}{_digest(*content)}")
+    practice_occurrences: dict[tuple[str, str, str], int] = defaultdict(int)
+    triples = []
+    text_nodes: dict[str, BNode] = {}
+    party_nodes: dict[tuple[Party, str | None], BNode] = {}
+    typed_nodes: set[tuple[URIRef, URIRef]] = set()
+    def typed(node: URIRef, cls: URIRef) -> URIRef:
+        if (node, cls) not in typed_nodes:
+            typed_nodes.add((node, cls))
+            triples.append((node, A, cls))
+        return node
     def get_data_general():
-        nonlocal n_data_general
-        global N_DATA_GENERAL
-        if n_data_general is None:
-            n_data_general = N_DATA_GENERAL
-            g.add((n_data_general, A, NS_DPV["Data"]))
-        return n_data_general
-    def to_party_uri(party: PartyEntity) -> URIRef:
-        nonlocal n_first_party, n_user
+        return typed(N_DATA_GENERAL, NS_DPV["Data"])
+    def to_party_uri(party: PartyEntity) -> BNode:
         if party.category == Party.FIRST_PARTY:
-            if n_first_party is None:
-                n_first_party = BNode()
-                g.add((n_first_party, A, NS["FirstParty"]))
-                g.add((n_first_party, NS["name"], Literal(first_party)))
-            party_node = n_first_party
-            return party_node
+            key = (Party.FIRST_PARTY, None)
         elif party.category == Party.THIRD_PARTY:
-            party_node = BNode()
-            g.add((party_node, A, NS["ThirdParty"]))
-            g.add((party_node, NS["name"], Literal(party.text)))
-            return party_node
+            key = (Party.THIRD_PARTY, party.text)
         elif party.category == Party.USER:
-            if n_user is None:
-                n_user = BNode()
-                g.add((n_user, A, NS["User"]))
-            party_node = n_user
-            return party_node
+            key = (Party.USER, None)
         else:
             raise ValueError(f"Unknown party type: {party}")
+        party_node = party_nodes.get(key)
+        if party_node is None:
+            party_node = party_nodes[key] = new_bnode('party', key[0].value, key[1] or '')
+            if party.category == Party.FIRST_PARTY:
+                triples.append((party_node, A, NS["FirstParty"]))
+                triples.append((party_node, NS["name"], Literal(first_party)))
+            elif party.category == Party.THIRD_PARTY:
+                triples.append((party_node, A, NS["ThirdParty"]))
+                triples.append((party_node, NS["name"], Literal(party.text)))
+            else:
+                triples.append((party_node, A, NS["User"]))
+        return party_node
     def data_uri(data: DataEntity) -> URIRef:
-        n_data = to_data_category_uri(data.category)
-        g.add((n_data, A, NS["Data"]))
-        return n_data
+        return typed(to_data_category_uri(data.category), NS["Data"])
     def purpose_uri(purpose: PurposeEntity) -> URIRef:
-        n_purpose = to_purpose_category_uri(purpose.category)
-        g.add((n_purpose, A, NS["Purpose"]))
-        return n_purpose
-    n_site = URIRef(NS_POLICY[str(uuid.uuid4())])
-    g.add((n_site, A, NS['PrivacyPolicy']))
-    n_srv = BNode()
-    g.add((n_srv, A, NS['Website']))
-    g.add((n_srv, NS['hasDomain'], Literal(app_name)))
-    g.add((n_site, NS['for'], n_srv))
+        return typed(to_purpose_category_uri(purpose.category), NS["Purpose"])
+    def text_node(segment_text: str) -> BNode:
+        node_text = text_nodes.get(segment_text)
+        if node_text is None:
+            node_text = text_nodes[segment_text] = new_bnode('text', segment_text)
+            triples.append((node_text, A, NS['Text']))
+            triples.append((node_text, NS['value'], Literal(segment_text)))
+        return node_text
+    triples.append((n_site, A, NS['PrivacyPolicy']))
+    n_srv = new_bnode('website', app_name)
+    triples.append((n_srv, A, NS['Website']))
+    triples.append((n_srv, NS['hasDomain'], Literal(app_name)))
+    triples.append((n_site, NS['for'], n_srv))
     for data_practice in data_practices:
         for practice in data_practice.practices:
-            segment_text = data_practice.segment
-            node_text = None
-            for n_t in g.subjects(NS['value'], Literal(segment_text)):
-                assert node_text is None, "Multiple nodes with the same text"
-                node_text = n_t
-            if node_text is None:
-                node_text = BNode()
-                g.add((node_text, A, NS['Text']))
-                g.add((node_text, NS['value'], Literal(segment_text)))
-            n_practice = BNode()
-            g.add((n_site, NS['hasDataPractice'], n_practice))
-            g.add((n_practice, A, NS[practice.__class__.__name__]))
-            g.add((n_practice, NS['text'], node_text))
+            node_text = text_node(data_practice.segment)
+            practice_key = (data_practice.segment, practice.__class__.__name__, practice.model_dump_json())
+            practice_occurrences[practice_key] += 1
+            n_practice = new_bnode('practice', *practice_key, str(practice_occurrences[practice_key]))
+            triples.append((n_site, NS['hasDataPractice'], n_practice))
+            triples.append((n_practice, A, NS[practice.__class__.__name__]))
+            triples.append((n_practice, NS['text'], node_text))
             if isinstance(practice, DataCollectionUse):
-                for party in practice.data_collector:
-                    g.add((n_practice, NS["user"], to_party_uri(party)))
-                for data in practice.data_collected:
-                    g.add((n_practice, NS['data'], data_uri(data)))
-                for purpose in practice.purpose:
-                    g.add((n_practice, NS['purpose'], purpose_uri(purpose)))
-                for provider in practice.data_provider:
-                    g.add((n_practice, NS['provider'], to_party_uri(provider)))
+                triples.extend((n_practice, NS["user"], to_party_uri(party)) for party in practice.data_collector)
+                triples.extend((n_practice, NS['data'], data_uri(data)) for data in practice.data_collected)
+                triples.extend((n_practice, NS['purpose'], purpose_uri(purpose)) for purpose in practice.purpose)
+                triples.extend((n_practice, NS['provider'], to_party_uri(provider)) for provider in practice.data_provider)
 
                 # If no data collected, but data collector and purpose are present, then assume general data
                 if not practice.data_collected and practice.data_collector and practice.purpose:
-                    g.add((n_practice, NS['data'], get_data_general()))
+                    triples.append((n_practice, NS['data'], get_data_general()))
             elif isinstance(practice, DataSharingDisclosure):
-                for party in practice.data_sharer:
-                    g.add((n_practice, NS["sharer"], to_party_uri(party)))
-                for data in practice.data_shared:
-                    g.add((n_practice, NS['data'], data_uri(data)))
-                for purpose in practice.purpose:
-                    g.add((n_practice, NS['purpose'], purpose_uri(purpose)))
-                for receiver in practice.data_receiver:
-                    g.add((n_practice, NS['receiver'], to_party_uri(receiver)))
-                for provider in practice.data_provider:
-                    g.add((n_practice, NS['provider'], to_party_uri(provider)))
+                triples.extend((n_practice, NS["sharer"], to_party_uri(party)) for party in practice.data_sharer)
+                triples.extend((n_practice, NS['data'], data_uri(data)) for data in practice.data_shared)
+                triples.extend((n_practice, NS['purpose'], purpose_uri(purpose)) for purpose in practice.purpose)
+                triples.extend((n_practice, NS['receiver'], to_party_uri(receiver)) for receiver in practice.data_receiver)
+                triples.extend((n_practice, NS['provider'], to_party_uri(provider)) for provider in practice.data_provider)
 
                 # If no data shared, but data purpose are present, then assume general data
                 if not practice.data_shared and practice.purpose:
-                    g.add((n_practice, NS['data'], get_data_general()))
+                    triples.append((n_practice, NS['data'], get_data_general()))
             elif isinstance(practice, DataStorageRetention):
                 pass
             elif isinstance(practice, DataSecurityProtection):
-                for party in practice.data_protector:
-                    g.add((n_practice, NS["user"], to_party_uri(party)))
-                for data in practice.data_protected:
-                    g.add((n_practice, NS['data'], data_uri(data)))
-                for provider in practice.data_provider:
-                    g.add((n_practice, NS['provider'], to_party_uri(provider)))
-                for threat in practice.protect_against:
-                    g.add((n_practice, NS['protectAgainst'],to_threat_uri(threat)))
-                for method in practice.protection_method:
-                    g.add((n_practice, NS['method'], to_protection_method_uri(method)))
+                triples.extend((n_practice, NS["user"], to_party_uri(party)) for party in practice.data_protector)
+                triples.extend((n_practice, NS['data'], data_uri(data)) for data in practice.data_protected)
+                triples.extend((n_practice, NS['provider'], to_party_uri(provider)) for provider in practice.data_provider)
+                triples.extend((n_practice, NS['protectAgainst'], to_threat_uri(threat)) for threat in practice.protect_against)
+                triples.extend((n_practice, NS['method'], to_protection_method_uri(method)) for method in practice.protection_method)
 
+    return triples
+
+
+def convert_to_kg(data_practices: list[SegmentedDataPractice], app_name: str, first_party: str) -> Graph:
+    f'''
+    Convert the data practices to knowledge graph representation.
+    Assume the passed in data_practices belong to the same privacy policy, e.g. output from `pp_analyze.analyze_pp`.
+    Result knowledge graph will always have the following node:
+    (?p a {NS["PrivacyPolicy"]})
+    The triples (see `build_kg_triples`) are added to the graph in bulk. Node identifiers are derived from the content, so the same data practices always give the same graph.
+    '''
+    g = Graph()
+    g.namespace_manager.bind('dpv', NS_DPV)
+    g.namespace_manager.bind('pr2g', NS)
+    g.namespace_manager.bind('pol', NS_POLICY)
+    g.addN((s, p, o, g) for s, p, o in build_kg_triples(data_practices, app_name, first_party))
     return g
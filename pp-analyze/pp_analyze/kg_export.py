@@ -0,0 +1,129 @@
+'''
+Streaming export of the knowledge graph representation (see `kg.convert_to_kg`) of many privacy policies, as N-Quads.
+
+Each website goes into its own named graph (see `website_graph_uri`), and is written out as soon as its results arrive (e.g. from the `on_result` callback of `bulk_analyze_pp`), so no graph of the whole corpus is ever held in memory.
+Node labels are deterministic: they are derived from the content of each policy (see `kg.build_kg_triples`), so exporting the same results twice gives the same file.
+
+The export can be loaded into a disk-backed store (requires the `oxigraph` extra, i.e. `pyoxigraph`) with `load_into_store`, to be queried with SPARQL without loading the whole corpus into memory.
+'''
+
+from collections.abc import Iterator
+from pathlib import Path
+import sys
+from typing import TextIO
+from urllib.parse import quote
+from rdflib import BNode, Literal, URIRef
+from rdflib.term import Node
+from .data_model import SegmentedDataPractice
+from .kg import build_kg_triples
+
+try:
+    import pyoxigraph
+except ImportError:
+    # Will error out later if the store is used.
+    pyoxigraph = None
+
+
+NS_WEBSITE = 'urn:pp-analyze:website:'
+
+# Characters not allowed (unescaped) in an IRI in N-Triples / N-Quads
+_IRI_UNSAFE = {c: quote(c) for c in ' <>"{}|^`\\'} | {chr(i): quote(chr(i)) for i in range(0x21)}
+_IRI_ESCAPES = str.maketrans(_IRI_UNSAFE)
+_LITERAL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'})
+
+
+def website_graph_uri(website: str) -> URIRef:
+    '''
+    The named graph of the website.
+    '''
+    return URIRef(NS_WEBSITE + quote(website, safe=''))
+
+
+def _nt_term(term: Node) -> str:
+    if isinstance(term, BNode):
+        return f'_:{term}'
+    if isinstance(term, Literal):
+        res = f'"{str(term).translate(_LITERAL_ESCAPES)}"'
+        if term.language:
+            res += f'@{term.language}'
+        elif term.datatype:
+            res += f'^^<{str(term.datatype).translate(_IRI_ESCAPES)}>'
+        return res
+    return f'<{str(term).translate(_IRI_ESCAPES)}>'
+
+
+def website_quads(website: str, data_practices: list[SegmentedDataPractice], first_party: str | None = None) -> Iterator[str]:
+    '''
+    The N-Quads lines (with the line break) of the knowledge graph of the website, in its named graph.
+    The blank node labels are prefixed by the digest of the policy (which includes the website), so they are unique within a corpus.
+
+    @param first_party: the name of the first party; the website if None
+    '''
+    graph = _nt_term(website_graph_uri(website))
+    for s, p, o in build_kg_triples(data_practices, website, first_party or website):
+        yield f'{_nt_term(s)} {_nt_term(p)} {_nt_term(o)} {graph} .\n'
+
+
+class NQuadsWriter:
+    '''
+    Writer of the knowledge graphs of websites into an N-Quads stream, one named graph per website.
+
+    Usage:
+    with NQuadsWriter(path) as writer:
+        await bulk_analyze_pp(websites, discard_return=True, on_result=writer.write)
+    '''
+
+    def __init__(self, out: str | Path | TextIO | None = None):
+        '''
+        @param out: the file path or (text) stream to write to; stdout if None
+        '''
+        if out is None:
+            self._f, self._owned = sys.stdout, False
+        elif isinstance(out, (str, Path)):
+            self._f, self._owned = open(out, 'w', encoding='utf-8'), True
+        else:
+            self._f, self._owned = out, False
+        self._websites = set()
+
+    def write(self, website: str, data_practices: list[SegmentedDataPractice], first_party: str | None = None):
+        if website in self._websites:
+            raise ValueError(f"Website {website} is already written")
+        self._websites.add(website)
+        self._f.writelines(website_quads(website, data_practices, first_party))
+
+    def write_all(self, results: dict[str, list[SegmentedDataPractice]]):
+        for website, data_practices in results.items():
+            self.write(website, data_practices)
+
+    def close(self):
+        if self._owned:
+            self._f.close()
+        else:
+            self._f.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_nquads(results: dict[str, list[SegmentedDataPractice]], out: str | Path | TextIO | None = None):
+    '''
+    Export the knowledge graphs of the results (as from `bulk_analyze_pp`) as N-Quads, one named graph per website.
+    '''
+    with NQuadsWriter(out) as writer:
+        writer.write_all(results)
+
+
+def load_into_store(nquads_path: str | Path, store_path: str | Path):
+    '''
+    Bulk load an N-Quads export into a disk-backed (RocksDB) Oxigraph store at store_path, and return the store.
+    The named graph of a website can then be queried with `GRAPH <website_graph_uri(website)> { ... }`.
+    '''
+    if pyoxigraph is None:
+        raise ImportError("Loading into a store requires `pyoxigraph` to be installed.")
+    store = pyoxigraph.Store(str(store_path))
+    store.bulk_load(path=str(nquads_path), format=pyoxigraph.RdfFormat.N_QUADS)
+    store.flush()
+    return store
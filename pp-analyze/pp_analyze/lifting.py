@@ -0,0 +1,90 @@
+'''
+Lifting of data and purpose categories (see `SegmentedDataPractice.lift`) over whole result sets at once.
+
+All entity categories of the result set are collected into NumPy arrays, each distinct category is lifted once (through the compiled hierarchy) into a lookup table, and the table is applied to all entities in one vectorised pass.
+'''
+
+import numpy as np
+from .data_model import SegmentedDataPractice, DataEntity, PurposeEntity
+from .hierarchy_helper import get_compiled_data_category_hierarchy, get_compiled_purpose_hierarchy
+
+
+type LiftChange = tuple[str, str] | bool
+type ResultSet = list[SegmentedDataPractice] | dict[str, list[SegmentedDataPractice]]
+
+
+def _collect_entities(segments: list[SegmentedDataPractice]) -> tuple[list[DataEntity | PurposeEntity], np.ndarray, np.ndarray]:
+    '''
+    Collect the liftable entities of the segments, in the order `SegmentedDataPractice.lift` visits them.
+
+    @return: the entities, whether each entity is a purpose entity, and the index of the segment of each entity
+    '''
+    entities = []
+    is_purpose = []
+    segment_indices = []
+    for i, segment in enumerate(segments):
+        for practice in segment.practices:
+            for field in practice.model_fields:
+                value = getattr(practice, field, None)
+                if not isinstance(value, list):
+                    value = [value]
+                for item in value:
+                    if isinstance(item, (DataEntity, PurposeEntity)):
+                        entities.append(item)
+                        is_purpose.append(isinstance(item, PurposeEntity))
+                        segment_indices.append(i)
+    return entities, np.array(is_purpose, dtype=bool), np.array(segment_indices, dtype=np.int64)
+
+
+def _lift_categories(categories: np.ndarray, targets: list[str], hierarchy) -> np.ndarray:
+    '''
+    Lift the categories through a lookup table over the distinct categories.
+    '''
+    if len(categories) == 0:
+        return categories
+    unique_categories, inverse = np.unique(categories, return_inverse=True)
+    lookup_table = np.array([hierarchy.lift(category, targets) for category in unique_categories], dtype=object)
+    return lookup_table[inverse]
+
+
+def lift_segments(segments: list[SegmentedDataPractice], targets: list[str]) -> list[LiftChange]:
+    '''
+    Lift the data practices of all segments to the target categories, with the same result as calling `lift` on each segment.
+
+    @return: for each segment, the first change made to it as (OLD_CATEGORY, NEW_CATEGORY), or False if nothing is changed
+    '''
+    entities, is_purpose, segment_indices = _collect_entities(segments)
+    categories = np.array([entity.category for entity in entities], dtype=object)
+    lifted = categories.copy()
+    lifted[~is_purpose] = _lift_categories(categories[~is_purpose], targets, get_compiled_data_category_hierarchy())
+    lifted[is_purpose] = _lift_categories(categories[is_purpose], targets, get_compiled_purpose_hierarchy())
+
+    changed = np.flatnonzero(lifted != categories)
+    for i in changed:
+        entities[i].category = lifted[i]
+
+    res: list[LiftChange] = [False] * len(segments)
+    changed_segments, first_changes = np.unique(segment_indices[changed], return_index=True)
+    for segment_index, i in zip(changed_segments, changed[first_changes]):
+        res[segment_index] = (categories[i], lifted[i])
+    return res
+
+
+def bulk_lift(result_set: ResultSet, targets: list[str]) -> list[LiftChange] | dict[str, list[LiftChange]]:
+    '''
+    Lift a whole result set to the target categories in place; see `lift_segments`.
+
+    @param result_set: a list of segments, or a dictionary from the website to its segments (as from `bulk_analyze_pp`)
+    @return: the changes for each segment, in the same shape as `result_set`
+    '''
+    if isinstance(result_set, dict):
+        websites = list(result_set.keys())
+        segments = [segment for website in websites for segment in result_set[website]]
+        changes = lift_segments(segments, targets)
+        res = {}
+        offset = 0
+        for website in websites:
+            res[website] = changes[offset:offset+len(result_set[website])]
+            offset += len(result_set[website])
+        return res
+    return lift_segments(result_set, targets)
@@ -1,3 +1,99 @@
+from collections import OrderedDict
+from functools import lru_cache
+import hashlib
+
 
 def convert_into_segments(pp_text: str) -> list[str]:
     return [s for s in (s.strip() for s in pp_text.split('\n')) if s]
+
+
+def text_digest(pp_text: str) -> str:
+    '''
+    SHA-256 of the (UTF-8 encoded) policy text; the same as the digest of the policy in a packed policy corpus (see `corpus`).
+    '''
+    return hashlib.sha256(pp_text.encode('utf-8')).hexdigest()
+
+
+@lru_cache(maxsize=1 << 16)
+def segment_hash(segment: str) -> str:
+    '''
+    Short hash of the segment text, for identifying segments without comparing their texts.
+    '''
+    return hashlib.blake2b(segment.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class Policy:
+    '''
+    A privacy policy text, split into segments (as `convert_into_segments`), with the (start, end) character offsets of each segment in the text and its hash (see `segment_hash`).
+    A segment is identified by its index in the policy (its segment ID), which is stable for the same text; `segment_key` identifies it across policies.
+    Get policies with `get_policy`, which caches them by the digest of their text.
+    '''
+
+    def __init__(self, pp_text: str, digest: str | None = None):
+        self.text = pp_text
+        self.digest = digest or text_digest(pp_text)
+        segments = []
+        offsets = []
+        pos = 0
+        for line in pp_text.split('\n'):
+            stripped = line.strip()
+            if stripped:
+                start = pos + len(line) - len(line.lstrip())
+                segments.append(stripped)
+                offsets.append((start, start + len(stripped)))
+            pos += len(line) + 1
+        self.segments: tuple[str, ...] = tuple(segments)
+        self.offsets: tuple[tuple[int, int], ...] = tuple(offsets)
+        self.segment_hashes: tuple[str, ...] = tuple(segment_hash(segment) for segment in segments)
+        self._ids_by_hash: dict[str, int] = {}
+        for segment_id, h in enumerate(self.segment_hashes):
+            self._ids_by_hash.setdefault(h, segment_id)
+
+    def __len__(self):
+        return len(self.segments)
+
+    @property
+    def segment_ids(self) -> range:
+        return range(len(self.segments))
+
+    def segment_key(self, segment_id: int) -> str:
+        return f"{self.digest[:16]}:{segment_id}"
+
+    def find_segment(self, segment: str) -> int | None:
+        '''
+        The ID of the (first) segment with the text, or None if the policy has no such segment.
+        '''
+        segment_id = self._ids_by_hash.get(segment_hash(segment))
+        if segment_id is not None and self.segments[segment_id] == segment:
+            return segment_id
+        return None
+
+
+POLICY_CACHE_SIZE = 1024
+_policy_cache: OrderedDict[str, Policy] = OrderedDict()
+
+
+def get_cached_policy(digest: str) -> Policy | None:
+    '''
+    The policy of the digest (see `text_digest`), if it is in the cache.
+    '''
+    policy = _policy_cache.get(digest)
+    if policy is not None:
+        _policy_cache.move_to_end(digest)
+    return policy
+
+
+def get_policy(pp_text: str, digest: str | None = None) -> Policy:
+    '''
+    The policy of the text, split into segments once, and memoised by the digest of the text.
+
+    @param digest: the digest of the text (see `text_digest`), if known
+    '''
+    digest = digest or text_digest(pp_text)
+    policy = get_cached_policy(digest)
+    if policy is None:
+        policy = Policy(pp_text, digest)
+        _policy_cache[digest] = policy
+        if len(_policy_cache) > POLICY_CACHE_SIZE:
+            _policy_cache.popitem(last=False)
+    return policy
@@ -5,14 +5,16 @@ By default, we assume all segments share the same segmentation method, which is
 """
 
 import asyncio
+from collections.abc import Callable
+import copy
 from dotenv import load_dotenv
 from enum import Enum
-import os
-from pathlib import Path
 from pydantic import BaseModel, ValidationError
 import re
 from tqdm.auto import tqdm
 from . import policy_text_utils as ptu
+from .corpus import get_relative_file_path_for_pp, load_policy, policy_exists
+from .fingerprint import get_fingerprint_index
 from .data_model import (
     DataEntity,
     PurposeEntity,
@@ -26,18 +28,25 @@ from .recognition import (
     classify_data_categories,
     identity_purpose_entities,
     classify_purpose_categories,
+    identify_classified_data_entities,
+    identify_classified_purpose_entities,
     identify_parties,
     identify_data_practices,
     group_data_practices_and_entities,
     add_ids_into_grouped_practices,
     convert_grouped_practices_to_query_data,
+    with_placeholder_categories,
     identify_relations,
+    RELATION_QUERY_MAX_TOKENS,
+    get_classifier,
+    get_phrase_memo,
 
-    to_dict,
     SWGroupedDataPracticeWithId,
     Relation,
 
     QueryCategory,
+    ClassifierBackend,
+    EntityAttachment,
     PARAM_OVERRIDE_CACHE,
 )
 
@@ -53,24 +62,24 @@ def assemble_data_practices(relations: list[Relation], grouped_practices_with_id
     @param grouped_practices_with_id: list of grouped data practices with IDs, obtained from add_ids_into_grouped_practices, but only the segment relevant to the relations
     @return: SegmentedDataPractice object, which contains the segment text and the assembled data practices
     """
-    grouped_practices_with_id = to_dict(grouped_practices_with_id)
-    segment_text = grouped_practices_with_id["segment"]
-    practices = grouped_practices_with_id["practices"]
+    segment_text = grouped_practices_with_id.segment
+    practices = grouped_practices_with_id.practices
     indexed_practices = {}
     indexed_entity_objs = {}
     for practice in practices:
-        indexed_practices[practice["id"]] = practice
+        indexed_practices[practice.id] = practice
 
     for practice in practices:
-        for entity in practice["data"]:
-            obj = DataEntity(text=entity["text"], category=entity["category"])
-            indexed_entity_objs[entity["id"]] = obj
-        for entity in practice["purpose"]:
-            obj = PurposeEntity(text=entity["text"], category=entity["category"])
-            indexed_entity_objs[entity["id"]] = obj
-        for entity in practice["parties"]:
-            obj = PartyEntity(text=entity["text"], category=entity["party_type"])
-            indexed_entity_objs[entity["id"]] = obj
+        # Data and purpose entities are already validated; party entities go through validation to convert the party type
+        for entity in practice.data:
+            obj = DataEntity.model_construct(text=entity.text, category=entity.category)
+            indexed_entity_objs[entity.id] = obj
+        for entity in practice.purpose:
+            obj = PurposeEntity.model_construct(text=entity.text, category=entity.category)
+            indexed_entity_objs[entity.id] = obj
+        for entity in practice.parties:
+            obj = PartyEntity(text=entity.text, category=entity.party_type)
+            indexed_entity_objs[entity.id] = obj
 
     indexed_relations = {}
     for relation in relations:
@@ -87,12 +96,12 @@ def assemble_data_practices(relations: list[Relation], grouped_practices_with_id
     errors = []
     for action_id, my_relations in indexed_relations.items():
         raw_action = indexed_practices[action_id]
-        if raw_action["type"] not in DATA_PRACTICE_NAME_MAP:
+        if raw_action.type not in DATA_PRACTICE_NAME_MAP:
             errors.append(f"Unexpected data practice type for {raw_action}")
             continue
-        cls = DATA_PRACTICE_CLASS_MAP[DATA_PRACTICE_NAME_MAP[raw_action["type"]]]
+        cls = DATA_PRACTICE_CLASS_MAP[DATA_PRACTICE_NAME_MAP[raw_action.type]]
         try:
-            obj = cls(text=raw_action["text"], **my_relations)
+            obj = cls(text=raw_action.text, **my_relations)
         except ValidationError as e:
             errors.append(f"Validation error for {raw_action}: {e}")
             continue
@@ -106,6 +115,8 @@ class PPAnalyzeStep(Enum):
     CLASSIFY_DATA_ENTITIES = "Classify data entities"
     IDENTIFY_PURPOSE_ENTITIES = "Identify purpose entities"
     CLASSIFY_PURPOSE_ENTITIES = "Classify purpose entities"
+    IDENTIFY_CLASSIFIED_DATA_ENTITIES = "Identify classified data entities"
+    IDENTIFY_CLASSIFIED_PURPOSE_ENTITIES = "Identify classified purpose entities"
     IDENTIFY_PARTIES = "Identify parties"
     IDENTIFY_DATA_PRACTICES = "Identify data practices"
     GROUP_DATA_PRACTICES = "Group data practices"
@@ -114,16 +125,60 @@ class PPAnalyzeStep(Enum):
     ASSEMBLE_DATA_PRACTICES = "Assemble data practices"
 
 
-async def analyze_pp(pp_text: str, override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False) -> tuple[list[SegmentedDataPractice], list[BaseModel|str]]:
+class PipelineProfile(Enum):
+    '''
+    How data and purpose entities are obtained:
+    - TWO_STEP: recognize the entities, then classify them in a separate query (the fine-tuned models)
+    - COMBINED: recognize and classify the entities in the same query, saving one round-trip per segment for each entity type
+    '''
+    TWO_STEP = "two_step"
+    COMBINED = "combined"
+
+
+_COMMON_STEPS = [
+    PPAnalyzeStep.IDENTIFY_PARTIES,
+    PPAnalyzeStep.IDENTIFY_DATA_PRACTICES,
+    PPAnalyzeStep.GROUP_DATA_PRACTICES,
+    PPAnalyzeStep.ADD_IDS,
+    PPAnalyzeStep.IDENTIFY_RELATIONS,
+    PPAnalyzeStep.ASSEMBLE_DATA_PRACTICES,
+]
+
+PROFILE_STEPS = {
+    PipelineProfile.TWO_STEP: [
+        PPAnalyzeStep.IDENTIFY_DATA_ENTITIES,
+        PPAnalyzeStep.CLASSIFY_DATA_ENTITIES,
+        PPAnalyzeStep.IDENTIFY_PURPOSE_ENTITIES,
+        PPAnalyzeStep.CLASSIFY_PURPOSE_ENTITIES,
+        *_COMMON_STEPS,
+    ],
+    PipelineProfile.COMBINED: [
+        PPAnalyzeStep.IDENTIFY_CLASSIFIED_DATA_ENTITIES,
+        PPAnalyzeStep.IDENTIFY_CLASSIFIED_PURPOSE_ENTITIES,
+        *_COMMON_STEPS,
+    ],
+}
+
+
+async def analyze_pp(pp_text: str | ptu.Policy, override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False, profile: PipelineProfile = PipelineProfile.TWO_STEP, speculative_relations: bool = False, classifier_backend: ClassifierBackend = ClassifierBackend.LLM, phrase_memo: bool = False, entity_attachment: EntityAttachment = EntityAttachment.ALL, dedupe_entities: bool = False, max_relation_query_tokens: int | None = RELATION_QUERY_MAX_TOKENS) -> tuple[list[SegmentedDataPractice], list[BaseModel|str]]:
     """
     Main entry point for pp_analyze.
     Call the relevant LLM tools to analyze the privacy policy.
     This function returns a list of DataPractice objects.
+
+    @param pp_text: the privacy policy text, or the policy already split into segments (see `policy_text_utils.get_policy`)
+    @param profile: the pipeline profile to use, see PipelineProfile
+    @param speculative_relations: start identifying relations as soon as the (unclassified) entities, parties and practices are available, concurrently with the classification of entities. Relation recognition does not depend on the entity categories, so this removes the classification round-trip from the critical path. Only effective for PipelineProfile.TWO_STEP
+    @param classifier_backend: the backend for classifying data and purpose entities, see ClassifierBackend. Only effective for PipelineProfile.TWO_STEP
+    @param phrase_memo: look up entity phrases classified before (in any policy) in the phrase-level classification memo, and only classify unseen phrases. Only effective for PipelineProfile.TWO_STEP
+    @param entity_attachment: which data and purpose entities of a segment are attached to each practice when identifying relations, see EntityAttachment
+    @param dedupe_entities: list an entity attached to multiple practices of a segment only once in the relation query
+    @param max_relation_query_tokens: the bound of the estimated number of tokens of a relation query, above which it is split into sub-queries; None to never split
     """
     assembled_data_practice_list: list[SegmentedDataPractice] = []
     failed_tasks = []
     pending_steps = []
-    with tqdm(total=len(PPAnalyzeStep.__members__), leave=False, desc="Analyzing privacy policy") as pbar:
+    with tqdm(total=len(PROFILE_STEPS[profile]), leave=False, desc="Analyzing privacy policy") as pbar:
         def add_step(step):
             pending_steps.append(step)
             pbar.set_postfix_str(str(pending_steps))
@@ -132,37 +187,67 @@ async def analyze_pp(pp_text: str, override_cache: PARAM_OVERRIDE_CACHE = None,
             pbar.update(1)
             pbar.set_postfix_str(str(pending_steps))
 
-        segments = ptu.convert_into_segments(pp_text)
+        policy = pp_text if isinstance(pp_text, ptu.Policy) else ptu.get_policy(pp_text)
+        pp_text = policy.text
+        segments = list(policy.segments)
 
-        async def get_classified_data_entities():
+        async def get_raw_data_entities():
             add_step(PPAnalyzeStep.IDENTIFY_DATA_ENTITIES)
             raw_data_entities = await identify_data_entities(pp_text, segments, override_cache, batch=batch)
             resolve_step(PPAnalyzeStep.IDENTIFY_DATA_ENTITIES)
+            return raw_data_entities
+
+        async def classify_data_entities(raw_data_entities):
             add_step(PPAnalyzeStep.CLASSIFY_DATA_ENTITIES)
             classified_data_entities, errs = await classify_data_categories(
-                pp_text, segments, raw_data_entities, override_cache, batch=batch
+                pp_text, segments, raw_data_entities, override_cache, batch=batch,
+                classifier=get_classifier(QueryCategory.DATA_CLASSIFICATION, classifier_backend),
+                phrase_memo=get_phrase_memo(QueryCategory.DATA_CLASSIFICATION) if phrase_memo else None,
             )
             if errs:
                 failed_tasks.append(errs)
             resolve_step(PPAnalyzeStep.CLASSIFY_DATA_ENTITIES)
             return classified_data_entities
 
-        t_classified_data_entities = get_classified_data_entities()
-
-        async def get_classified_purpose_entities():
+        async def get_classified_data_entities():
+            if profile == PipelineProfile.COMBINED:
+                add_step(PPAnalyzeStep.IDENTIFY_CLASSIFIED_DATA_ENTITIES)
+                classified_data_entities, errs = await identify_classified_data_entities(pp_text, segments, override_cache, batch=batch)
+                if errs:
+                    failed_tasks.append(errs)
+                resolve_step(PPAnalyzeStep.IDENTIFY_CLASSIFIED_DATA_ENTITIES)
+                return classified_data_entities
+            raw_data_entities = await get_raw_data_entities()
+            return await classify_data_entities(raw_data_entities)
+
+        async def get_raw_purpose_entities():
             add_step(PPAnalyzeStep.IDENTIFY_PURPOSE_ENTITIES)
             raw_purpose_entities = await identity_purpose_entities(pp_text, segments, override_cache, batch=batch)
             resolve_step(PPAnalyzeStep.IDENTIFY_PURPOSE_ENTITIES)
+            return raw_purpose_entities
+
+        async def classify_purpose_entities(raw_purpose_entities):
             add_step(PPAnalyzeStep.CLASSIFY_PURPOSE_ENTITIES)
             classified_purpose_entities, errs = await classify_purpose_categories(
-                pp_text, segments, raw_purpose_entities, override_cache, batch=batch
+                pp_text, segments, raw_purpose_entities, override_cache, batch=batch,
+                classifier=get_classifier(QueryCategory.PURPOSE_CLASSIFICATION, classifier_backend),
+                phrase_memo=get_phrase_memo(QueryCategory.PURPOSE_CLASSIFICATION) if phrase_memo else None,
             )
             if errs:
                 failed_tasks.append(errs)
             resolve_step(PPAnalyzeStep.CLASSIFY_PURPOSE_ENTITIES)
             return classified_purpose_entities
 
-        t_classified_purpose_entities = get_classified_purpose_entities()
+        async def get_classified_purpose_entities():
+            if profile == PipelineProfile.COMBINED:
+                add_step(PPAnalyzeStep.IDENTIFY_CLASSIFIED_PURPOSE_ENTITIES)
+                classified_purpose_entities, errs = await identify_classified_purpose_entities(pp_text, segments, override_cache, batch=batch)
+                if errs:
+                    failed_tasks.append(errs)
+                resolve_step(PPAnalyzeStep.IDENTIFY_CLASSIFIED_PURPOSE_ENTITIES)
+                return classified_purpose_entities
+            raw_purpose_entities = await get_raw_purpose_entities()
+            return await classify_purpose_entities(raw_purpose_entities)
 
         async def get_parties():
             add_step(PPAnalyzeStep.IDENTIFY_PARTIES)
@@ -170,44 +255,74 @@ async def analyze_pp(pp_text: str, override_cache: PARAM_OVERRIDE_CACHE = None,
             resolve_step(PPAnalyzeStep.IDENTIFY_PARTIES)
             return parties
 
-        t_parties = get_parties()
-
         async def get_practices():
             add_step(PPAnalyzeStep.IDENTIFY_DATA_PRACTICES)
             practices = await identify_data_practices(pp_text, segments, override_cache, batch=batch)
             resolve_step(PPAnalyzeStep.IDENTIFY_DATA_PRACTICES)
             return practices
 
-        t_practices = get_practices()
-
-        classified_data_entities, classified_purpose_entities, parties, practices = await asyncio.gather(
-            t_classified_data_entities, t_classified_purpose_entities, t_parties, t_practices
-        )
-
-        add_step(PPAnalyzeStep.GROUP_DATA_PRACTICES)
-        grouped_practices = group_data_practices_and_entities(
-            practices, classified_data_entities, classified_purpose_entities, parties
-        )
-        resolve_step(PPAnalyzeStep.GROUP_DATA_PRACTICES)
-        add_step(PPAnalyzeStep.ADD_IDS)
-        grouped_practices_with_id = add_ids_into_grouped_practices(grouped_practices)
-        resolve_step(PPAnalyzeStep.ADD_IDS)
-
-        async def get_relations():
+        async def get_relations(grouped_practices_with_id):
             add_step(PPAnalyzeStep.IDENTIFY_RELATIONS)
             relation_queries = []
             for segment in tqdm(grouped_practices_with_id, desc='Combining data practices into relation queries', leave=False):
                 query_data = convert_grouped_practices_to_query_data(segment)
                 relation_queries.append(query_data)
 
-            ret = await identify_relations(relation_queries, override_cache, batch=batch)
+            ret = await identify_relations(relation_queries, override_cache, batch=batch, max_query_tokens=max_relation_query_tokens)
             relations, ierrors = ret
             if ierrors:
                 failed_tasks.append((ierrors))
             resolve_step(PPAnalyzeStep.IDENTIFY_RELATIONS)
-            return relations
+            return relation_queries, relations
+
+        def group_and_add_ids(practices, classified_data_entities, classified_purpose_entities, parties):
+            add_step(PPAnalyzeStep.GROUP_DATA_PRACTICES)
+            grouped_practices = group_data_practices_and_entities(
+                practices, classified_data_entities, classified_purpose_entities, parties, attachment=entity_attachment
+            )
+            resolve_step(PPAnalyzeStep.GROUP_DATA_PRACTICES)
+            add_step(PPAnalyzeStep.ADD_IDS)
+            grouped_practices_with_id = add_ids_into_grouped_practices(grouped_practices, dedupe_entities=dedupe_entities)
+            resolve_step(PPAnalyzeStep.ADD_IDS)
+            return grouped_practices_with_id
+
+        if speculative_relations and profile == PipelineProfile.TWO_STEP:
+            raw_data_entities, raw_purpose_entities, parties, practices = await asyncio.gather(
+                get_raw_data_entities(), get_raw_purpose_entities(), get_parties(), get_practices()
+            )
+
+            # The IDs only depend on the order of practices and entities, which classification preserves
+            speculative_grouped_practices_with_id = add_ids_into_grouped_practices(group_data_practices_and_entities(
+                practices, with_placeholder_categories(raw_data_entities), with_placeholder_categories(raw_purpose_entities), parties, attachment=entity_attachment
+            ), dedupe_entities=dedupe_entities)
+            (relation_queries, relations), classified_data_entities, classified_purpose_entities = await asyncio.gather(
+                get_relations(speculative_grouped_practices_with_id),
+                classify_data_entities(raw_data_entities),
+                classify_purpose_entities(raw_purpose_entities),
+            )
 
-        relations = await get_relations()
+            grouped_practices_with_id = group_and_add_ids(practices, classified_data_entities, classified_purpose_entities, parties)
+
+            # Join: re-identify relations for any segment whose relation query changed after classification (should not happen, but never assemble mismatched IDs)
+            mismatched_indices = [
+                i for i, segment in enumerate(grouped_practices_with_id)
+                if convert_grouped_practices_to_query_data(segment) != relation_queries[i]
+            ]
+            if mismatched_indices:
+                relation_queries = [convert_grouped_practices_to_query_data(grouped_practices_with_id[i]) for i in mismatched_indices]
+                rerun_relations, ierrors = await identify_relations(relation_queries, override_cache, batch=batch, max_query_tokens=max_relation_query_tokens)
+                if ierrors:
+                    failed_tasks.append((ierrors))
+                for i, i_relations in zip(mismatched_indices, rerun_relations):
+                    relations[i] = i_relations
+        else:
+            classified_data_entities, classified_purpose_entities, parties, practices = await asyncio.gather(
+                get_classified_data_entities(), get_classified_purpose_entities(), get_parties(), get_practices()
+            )
+
+            grouped_practices_with_id = group_and_add_ids(practices, classified_data_entities, classified_purpose_entities, parties)
+
+            _, relations = await get_relations(grouped_practices_with_id)
 
         add_step(PPAnalyzeStep.ASSEMBLE_DATA_PRACTICES)
         for i_relations, segment in tqdm(zip(relations, grouped_practices_with_id), desc='Assembling data practices', leave=False):
@@ -224,18 +339,7 @@ RE_DOMAIN_NAME = re.compile(r"(?:https?://)?([^/]+)")
 RE_KEY_DOMAIN_NAME = re.compile(r"(?:https?://)?www\.([^/]+)")
 
 
-def get_relative_file_path_for_pp(website_name: str) -> Path:
-    policy_dir = os.getenv("PP_POLICY_DIR")
-    if policy_dir is None:
-        raise ValueError("PP_POLICY_DIR environment variable is not set.")
-    policy_dir = Path(policy_dir)
-    return policy_dir / website_name[:1] / website_name[:2] / website_name[:3] / f"{website_name}.md"
-
-
-async def analyze_pp_from_website_name(website_name: str, override_cache: PARAM_OVERRIDE_CACHE = None, only_non_empty: bool = True, batch: bool = False):
-    data_practices = None
-    errs = []
-
+def get_possible_domain_names(website_name: str) -> list[str]:
     possbile_names = []
     if match := RE_KEY_DOMAIN_NAME.match(website_name):
         domain_name = match.group(1)
@@ -243,31 +347,67 @@ async def analyze_pp_from_website_name(website_name: str, override_cache: PARAM_
     if match := RE_DOMAIN_NAME.match(website_name):
         domain_name = match.group(1)
         possbile_names.append(domain_name)
+    return possbile_names
+
+
+def find_policy_domain(website_name: str) -> str | None:
+    '''
+    The domain name under which the privacy policy of the website is stored (trying the same domain names as `analyze_pp_from_website_name`), or None if there is none.
+    '''
+    for domain_name in get_possible_domain_names(website_name):
+        if policy_exists(domain_name):
+            return domain_name
+    return None
+
+
+async def analyze_pp_from_website_name(website_name: str, override_cache: PARAM_OVERRIDE_CACHE = None, only_non_empty: bool = True, batch: bool = False, profile: PipelineProfile = PipelineProfile.TWO_STEP, speculative_relations: bool = False, classifier_backend: ClassifierBackend = ClassifierBackend.LLM, phrase_memo: bool = False, entity_attachment: EntityAttachment = EntityAttachment.ALL, dedupe_entities: bool = False, max_relation_query_tokens: int | None = RELATION_QUERY_MAX_TOKENS):
+    data_practices = None
+    errs = []
+
+    possbile_names = get_possible_domain_names(website_name)
     for domain_name in (pbar := tqdm(possbile_names, leave=False, desc="Using domain name")):
         pbar.set_postfix_str(f"Trying {domain_name}")
-        pp_file = get_relative_file_path_for_pp(domain_name)
-        if not pp_file.exists():
+        policy = load_policy(domain_name)
+        if policy is None:
             continue
-        with open(pp_file, "r") as f:
-            pp_text = f.read()
-            data_practices, errs = await analyze_pp(pp_text, override_cache=override_cache, batch=batch)
-            if only_non_empty:
-                data_practices = filter_empty_data_practices(data_practices)
-            pbar.container.close()
-            break
+        data_practices, errs = await analyze_pp(policy, override_cache=override_cache, batch=batch, profile=profile, speculative_relations=speculative_relations, classifier_backend=classifier_backend, phrase_memo=phrase_memo, entity_attachment=entity_attachment, dedupe_entities=dedupe_entities, max_relation_query_tokens=max_relation_query_tokens)
+        if only_non_empty:
+            data_practices = filter_empty_data_practices(data_practices)
+        pbar.container.close()
+        break
     return data_practices, errs
 
 
-async def bulk_analyze_pp(website_names: list[str], override_cache: PARAM_OVERRIDE_CACHE = None, only_non_empty: bool = True, batch: bool = False, max_num: int|None = None, non_breaking: bool = False, discard_return: bool = False):
+async def bulk_analyze_pp(website_names: list[str], override_cache: PARAM_OVERRIDE_CACHE = None, only_non_empty: bool = True, batch: bool = False, max_num: int|None = None, non_breaking: bool = False, discard_return: bool = False, profile: PipelineProfile = PipelineProfile.TWO_STEP, speculative_relations: bool = False, classifier_backend: ClassifierBackend = ClassifierBackend.LLM, phrase_memo: bool = False, entity_attachment: EntityAttachment = EntityAttachment.ALL, dedupe_entities: bool = False, max_relation_query_tokens: int | None = RELATION_QUERY_MAX_TOKENS, on_result: Callable[[str, list[SegmentedDataPractice]], None] | None = None, dedupe_policies: bool = False, dedupe_threshold: float | None = None):
     """
     Analyze privacy policies from website names.
-    You need `PP_POLICY_DIR` environment variable to be set to the directory containing the privacy policies.
+    You need `PP_POLICY_DIR` environment variable to be set to the directory containing the privacy policies (or `PP_POLICY_CORPUS` to a packed policy corpus, see `corpus`).
 
+    @param on_result: called with the website name and its data practices as soon as a website is analyzed (e.g. `archive.ResultArchiveWriter.write`, to stream the results to disk); also called when `discard_return` is set
+    @param dedupe_policies: analyze only the first website of each cluster of duplicate policies (see `fingerprint.FingerprintIndex.find_duplicates`), and give a copy of its data practices to the other websites of the cluster; if its analysis fails, the next website of the cluster is analyzed instead
+    @param dedupe_threshold: with dedupe_policies, also cluster near duplicates of at least this estimated similarity (their data practices are then approximate); only exact duplicates if None
     @return: a dictionary of website names to the list of data practices, a list of failed tasks (websites without PPs, or websites with exception), and a list of errors
     """
     res: dict[str, list[SegmentedDataPractice]] = {}
     failed_tasks = []
     errs = []
+    # Website -> its cluster of duplicate policies (by its first website), and the data practices of the first website of each cluster whose analysis succeeded
+    clusters_of_websites: dict[str, str] = {}
+    cluster_results: dict[str, list[SegmentedDataPractice]] = {}
+    if dedupe_policies:
+        websites_by_domain = {}
+        for website_name in website_names:
+            if (domain_name := find_policy_domain(website_name)) is not None:
+                websites_by_domain.setdefault(domain_name, []).append(website_name)
+        clusters = get_fingerprint_index().find_duplicates(list(websites_by_domain), threshold=dedupe_threshold)
+        clustered_domains = {domain_name for cluster in clusters for domain_name in cluster}
+        # Websites resolving to the same policy are duplicates as well
+        clusters += [[domain_name] for domain_name, cluster_websites in websites_by_domain.items() if len(cluster_websites) > 1 and domain_name not in clustered_domains]
+        for cluster in clusters:
+            # The domains are in the order of their first website, so the first website of the cluster comes first
+            cluster_websites = [website_name for domain_name in cluster for website_name in websites_by_domain[domain_name]]
+            for website_name in cluster_websites:
+                clusters_of_websites[website_name] = cluster_websites[0]
     if max_num:
         desc_str = f"Running bulk privacy policy analysis (max: {max_num})"
     else:
@@ -275,13 +415,22 @@ async def bulk_analyze_pp(website_names: list[str], override_cache: PARAM_OVERRI
     for website_name in (pbar := tqdm(website_names, leave=False, desc=desc_str)):
         pbar.set_postfix_str(f"For {website_name}")
         try:
-            data_practices, ierrs = await analyze_pp_from_website_name(website_name, override_cache=override_cache, only_non_empty=only_non_empty, batch=batch)
+            cluster = clusters_of_websites.get(website_name)
+            if cluster in cluster_results:
+                # Each website gets its own copy, as the data practices may be changed in place (e.g. by `lifting`)
+                data_practices, ierrs = copy.deepcopy(cluster_results[cluster]), []
+            else:
+                data_practices, ierrs = await analyze_pp_from_website_name(website_name, override_cache=override_cache, only_non_empty=only_non_empty, batch=batch, profile=profile, speculative_relations=speculative_relations, classifier_backend=classifier_backend, phrase_memo=phrase_memo, entity_attachment=entity_attachment, dedupe_entities=dedupe_entities, max_relation_query_tokens=max_relation_query_tokens)
+                if data_practices is not None and cluster is not None:
+                    cluster_results[cluster] = copy.deepcopy(data_practices)
             if ierrs:
                 errs.append((website_name, ierrs))
             if data_practices is None:
                 if not ierrs:
                     failed_tasks.append(website_name)
             else:
+                if on_result is not None:
+                    on_result(website_name, data_practices)
                 if discard_return:
                     data_practices = None
                 res[website_name] = data_practices
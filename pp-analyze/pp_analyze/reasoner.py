@@ -0,0 +1,133 @@
+'''
+Pool of EYE reasoner workers, for running many reasoning jobs over the same rules.
+
+EYE has no server mode that accepts jobs over a pipe, so each job is still a process. The cost of a cold start is dominated by parsing the (large) rule base, so the pool compiles the rules once into an EYE image (`eye --image`, a SWI-Prolog saved state), and runs each job with `swipl -x IMAGE`, which only needs to load the job's own data.
+At most `max_workers` jobs run at the same time (by default as many as the CPU cores and available memory allow, see `scheduler.default_concurrency`).
+If the image cannot be built (e.g. an old EYE or no `swipl` available), the pool falls back to running `eye` with the rules for each job.
+'''
+
+import asyncio
+from asyncio.subprocess import PIPE
+import logging
+import os
+from pathlib import Path
+import shutil
+import tempfile
+import time
+from .scheduler import default_concurrency
+
+
+logger = logging.getLogger(__name__)
+
+IMAGE_NAME = 'rules.pvm'
+
+
+def get_reasoner_exec() -> str:
+    return os.getenv("EYE_REASONER_EXEC") or "eye"
+
+
+def get_swipl_exec() -> str:
+    return os.getenv("SWIPL_EXEC") or "swipl"
+
+
+async def run_process(*args: str) -> tuple[str, str, int]:
+    '''
+    Run the process, and return its output (stdout), errors (stderr) and return code.
+    If cancelled, the process is killed and waited for before the cancellation propagates, so that it does not outlive its input files.
+    '''
+    p = await asyncio.create_subprocess_exec(*args, stdout=PIPE, stderr=PIPE)
+    try:
+        out, err = await p.communicate()
+    finally:
+        if p.returncode is None:
+            p.kill()
+            await p.wait()
+    return out.decode('utf-8'), err.decode('utf-8'), p.returncode
+
+
+class EyeReasonerPool:
+    '''
+    Usage:
+    async with EyeReasonerPool(rule_files, query_file) as pool:
+        out, err = await pool.run([persona_turtle, app_policy_turtle, context_turtle])
+    '''
+
+    def __init__(self, rule_files: list[str], query_file: str, max_workers: int | None = None, use_image: bool = True, reasoner_exec: str | None = None, swipl_exec: str | None = None):
+        '''
+        @param rule_files: the rule files loaded for every job (e.g. the DToU rules and additional rules)
+        @param query_file: the query file of every job
+        @param max_workers: the maximum number of jobs running at the same time; sized from the CPU cores and available memory if None (see `scheduler.default_concurrency`)
+        @param use_image: precompile the rules into an EYE image (see module documentation)
+        '''
+        self.rule_files = list(rule_files)
+        self.query_file = str(query_file)
+        self.max_workers = max_workers or default_concurrency()
+        self.use_image = use_image
+        self.reasoner_exec = reasoner_exec or get_reasoner_exec()
+        self.swipl_exec = swipl_exec or get_swipl_exec()
+        self._sem = asyncio.Semaphore(self.max_workers)
+        self._start_lock = asyncio.Lock()
+        self._work_dir: Path | None = None
+        self._image: Path | None = None
+        self._stats = {'jobs': 0, 'job_time': 0.0, 'image_time': 0.0}
+
+    async def start(self):
+        '''
+        Build the image of the rules (if enabled). Called by the first job if not called explicitly.
+        '''
+        async with self._start_lock:
+            if self._work_dir is not None:
+                return
+            self._work_dir = Path(tempfile.mkdtemp(prefix='eye-pool-'))
+            if not self.use_image:
+                return
+            image = self._work_dir / IMAGE_NAME
+            start_time = time.perf_counter()
+            out, err, returncode = await run_process(self.reasoner_exec, '--quiet', '--nope', *self.rule_files, '--image', str(image))
+            self._stats['image_time'] = time.perf_counter() - start_time
+            if returncode != 0 or not image.exists() or shutil.which(self.swipl_exec) is None:
+                logger.warning(f"Cannot build or run the EYE image, running EYE with the rules for each job instead: {err}")
+                return
+            self._image = image
+
+    def _command(self, data_files: list[str]) -> list[str]:
+        if self._image is not None:
+            return [self.swipl_exec, '-x', str(self._image), '--', '--quiet', '--nope', *data_files, '--query', self.query_file]
+        return [self.reasoner_exec, '--quiet', '--nope', *self.rule_files, *data_files, '--query', self.query_file]
+
+    async def run(self, data: list[str]) -> tuple[str, str]:
+        '''
+        Run a reasoning job over the data documents (in Turtle / N3), and return the output (stdout) and errors (stderr) of the reasoner.
+        '''
+        await self.start()
+        async with self._sem:
+            start_time = time.perf_counter()
+            with tempfile.TemporaryDirectory(dir=self._work_dir) as job_dir:
+                data_files = []
+                for i, content in enumerate(data):
+                    data_file = Path(job_dir) / f"data{i}.ttl"
+                    data_file.write_text(content)
+                    data_files.append(str(data_file))
+                out, err, _ = await run_process(*self._command(data_files))
+            self._stats['jobs'] += 1
+            self._stats['job_time'] += time.perf_counter() - start_time
+        return out, err
+
+    def get_stats(self) -> dict:
+        '''
+        Statistics of the pool: number of jobs run, total time spent in jobs, time to build the image, and whether the image is used.
+        '''
+        return {**self._stats, 'uses_image': self._image is not None}
+
+    async def close(self):
+        if self._work_dir is not None:
+            shutil.rmtree(self._work_dir, ignore_errors=True)
+            self._work_dir = None
+            self._image = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
@@ -0,0 +1,175 @@
+'''
+Cache of reasoning results, stored in a single SQLite database (`reasoning_cache.sqlite` under QUERY_CACHE_DIR).
+
+Results are content-addressed: the key is a digest of everything the result depends on -- the user persona, the app policy, the contents of the rule and query files, and the reasoner version (see `get_reasoning_key`).
+The digest of the rule and query files with the reasoner version is the *rule set version*, stored with every record, so that results of previous rule sets can be dropped with `ReasoningCache.invalidate`.
+'''
+
+from datetime import datetime
+from dotenv import load_dotenv
+import hashlib
+import os
+from pathlib import Path
+import subprocess
+from sqlalchemy import delete
+from sqlmodel import Field, Session, SQLModel, create_engine, select
+from typing import Optional
+
+
+load_dotenv()
+
+_DB_FILE_NAME = 'reasoning_cache.sqlite'
+
+# Keys per statement in bulk operations (below the SQLite limit of variables)
+_BULK_SIZE = 500
+
+
+class ReasoningRecord(SQLModel, table=True):
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: str = Field(index=True, unique=True)
+    rule_set_version: str = Field(index=True)
+    website: str
+    reasoning_result: str
+    reasoning_errors: str
+    timestamp: str = Field(default_factory=lambda: datetime.now().isoformat())
+
+
+def _digest(*parts: str | bytes) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode('utf-8') if isinstance(part, str) else part)
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+_reasoner_versions = {}
+
+
+def get_reasoner_version(reasoner_exec: str) -> str:
+    '''
+    The version string of the EYE reasoner (as printed by `eye --version`); "unknown" if it cannot be run.
+    '''
+    if reasoner_exec not in _reasoner_versions:
+        try:
+            p = subprocess.run([reasoner_exec, '--version'], capture_output=True, text=True, timeout=60)
+            version = (p.stdout + p.stderr).strip().splitlines()
+            _reasoner_versions[reasoner_exec] = version[0] if version else 'unknown'
+        except (OSError, subprocess.SubprocessError):
+            _reasoner_versions[reasoner_exec] = 'unknown'
+    return _reasoner_versions[reasoner_exec]
+
+
+_rule_set_versions = {}
+
+
+def get_rule_set_version(rule_files: list[str], query_file: str, reasoner_exec: str) -> str:
+    '''
+    Digest of the contents of the rule files (in any order) and the query file, and the reasoner version.
+    The files are only re-read when they change (by modification time and size).
+    '''
+    files = sorted(map(str, rule_files)) + [str(query_file)]
+    stats = tuple((f, os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in files)
+    cache_key = (stats, reasoner_exec)
+    if cache_key not in _rule_set_versions:
+        _rule_set_versions[cache_key] = _digest(*(Path(f).read_bytes() for f in files), get_reasoner_version(reasoner_exec))
+    return _rule_set_versions[cache_key]
+
+
+def get_reasoning_key(user_persona: str, app_policy: str, rule_set_version: str, variant: str | None = None) -> str:
+    '''
+    The cache key of a reasoning job.
+    The variant keeps apart other kinds of results for the same inputs (e.g. only the conflicts, from a batched run).
+    '''
+    if variant is None:
+        return _digest(user_persona, app_policy, rule_set_version)
+    return _digest(user_persona, app_policy, rule_set_version, variant)
+
+
+class ReasoningCache:
+    '''
+    Reasoning results by key (see `get_reasoning_key`), with bulk lookup and insertion, and hit statistics.
+    '''
+
+    def __init__(self, db_file: str | Path):
+        self.db_file = Path(db_file)
+        self.engine = create_engine(f'sqlite:///{self.db_file.absolute()}')
+        ReasoningRecord.__table__.create(self.engine, checkfirst=True)
+        self._stats = {'lookups': 0, 'hits': 0, 'stored': 0}
+
+    def get_many(self, keys: list[str]) -> dict[str, tuple[str, str]]:
+        '''
+        Look up the results of the keys; missing keys are not in the returned dictionary.
+        @return: the (reasoning result, reasoning errors) of each key found
+        '''
+        res = {}
+        with Session(self.engine) as session:
+            for i in range(0, len(keys), _BULK_SIZE):
+                chunk = keys[i:i+_BULK_SIZE]
+                for record in session.exec(select(ReasoningRecord).where(ReasoningRecord.key.in_(chunk))):
+                    res[record.key] = (record.reasoning_result, record.reasoning_errors)
+        self._stats['lookups'] += len(keys)
+        self._stats['hits'] += len(res)
+        return res
+
+    def get(self, key: str) -> tuple[str, str] | None:
+        return self.get_many([key]).get(key)
+
+    def put_many(self, records: list[tuple[str, str, str, str, str]]):
+        '''
+        Store (or replace) results.
+        @param records: the (key, rule set version, website, reasoning result, reasoning errors) of each result
+        '''
+        if not records:
+            return
+        records = list({record[0]: record for record in records}.values())
+        with Session(self.engine) as session:
+            for i in range(0, len(records), _BULK_SIZE):
+                chunk = records[i:i+_BULK_SIZE]
+                session.execute(delete(ReasoningRecord).where(ReasoningRecord.key.in_([record[0] for record in chunk])))
+                session.add_all([
+                    ReasoningRecord(key=key, rule_set_version=rule_set_version, website=website, reasoning_result=reasoning_result, reasoning_errors=reasoning_errors)
+                    for key, rule_set_version, website, reasoning_result, reasoning_errors in chunk
+                ])
+            session.commit()
+        self._stats['stored'] += len(records)
+
+    def put(self, key: str, rule_set_version: str, website: str, reasoning_result: str, reasoning_errors: str):
+        self.put_many([(key, rule_set_version, website, reasoning_result, reasoning_errors)])
+
+    def invalidate(self, rule_set_version: str | None = None, keep: str | None = None) -> int:
+        '''
+        Remove the results of a rule set version (all results if None), or of all rule set versions but `keep`.
+        @return: the number of removed results
+        '''
+        statement = delete(ReasoningRecord)
+        if keep is not None:
+            statement = statement.where(ReasoningRecord.rule_set_version != keep)
+        elif rule_set_version is not None:
+            statement = statement.where(ReasoningRecord.rule_set_version == rule_set_version)
+        with Session(self.engine) as session:
+            removed = session.execute(statement).rowcount
+            session.commit()
+        return removed
+
+    def get_stats(self) -> dict:
+        return {**self._stats, 'hit_rate': self._stats['hits'] / self._stats['lookups'] if self._stats['lookups'] else 0.0}
+
+    def reset_stats(self):
+        self._stats = {'lookups': 0, 'hits': 0, 'stored': 0}
+
+
+_reasoning_cache = None
+
+
+def get_reasoning_cache() -> ReasoningCache | None:
+    '''
+    The reasoning cache under QUERY_CACHE_DIR; None if QUERY_CACHE_DIR is not set.
+    '''
+    global _reasoning_cache
+    if _reasoning_cache is None:
+        cache_dir = os.getenv("QUERY_CACHE_DIR")
+        if not cache_dir:
+            return None
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        _reasoning_cache = ReasoningCache(Path(cache_dir) / _DB_FILE_NAME)
+    return _reasoning_cache
@@ -17,13 +17,33 @@ from .query_llm import (
     classify_data_categories,
     identity_purpose_entities,
     classify_purpose_categories,
+    identify_classified_data_entities,
+    identify_classified_purpose_entities,
     identify_parties,
     identify_data_practices,
     identify_relations,
+    RELATION_QUERY_MAX_TOKENS,
+    RELATION_QUERY_MAX_SPLIT_DEPTH,
 )
 from .aux_utils import (
     group_data_practices_and_entities,
     add_ids_into_grouped_practices,
     convert_grouped_practices_to_query_data,
+    with_placeholder_categories,
+    estimate_query_tokens,
+    split_relation_query,
+)
+from .embedding_classifier import (
+    EmbeddingClassifier,
+    get_classifier,
+)
+from .phrase_memo import (
+    PhraseClassificationMemo,
+    get_phrase_memo,
+    get_phrase_memo_stats,
+)
+from .span_resolution import (
+    resolve_spans,
+    resolve_spans_batch,
 )
 from .types import *
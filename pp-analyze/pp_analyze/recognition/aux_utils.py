@@ -1,25 +1,105 @@
+import json
+from bisect import bisect_left
 from .data_model import (
-    to_dict,
+    ClassifiedEntity,
+    SWEntities,
+    IEntity,
     SWClassifiedDataEntities,
     SWClassifiedPurposeEntities,
     SWPartyEntities,
     SWDataPractices,
+    GroupedDataPractice,
     SWGroupedDataPractice,
+    ClassifiedDataEntityWithId,
+    ClassifiedPurposeEntityWithId,
+    PartyEntityWithId,
+    GroupedDataPracticeWithId,
     SWGroupedDataPracticeWithId,
 )
+from .span_resolution import UNRESOLVED_SPAN
+from .types import EntityAttachment
+
+
+S_CATEGORY_UNCLASSIFIED = 'Unclassified'
+
+# Window (in characters) around the practice span for EntityAttachment.NEARBY
+NEARBY_WINDOW = 100
+
+
+def with_placeholder_categories(entities: list[SWEntities[IEntity]]) -> list[SWEntities[ClassifiedEntity]]:
+    """
+    Attach a placeholder category (S_CATEGORY_UNCLASSIFIED) to not-yet-classified entities, so that they can be grouped (and relations can be identified) before the classification finishes.
+
+    @param entities: list of data or purpose entities, obtained from identify_data_entities or identity_purpose_entities
+    @return: the same entities, as classified entities with the placeholder category
+    """
+    return [
+        SWEntities[ClassifiedEntity].model_construct(
+            segment=segment.segment,
+            entities=[
+                ClassifiedEntity.model_construct(text=entity.text, span=entity.span, category=S_CATEGORY_UNCLASSIFIED)
+                for entity in segment.entities
+            ],
+        )
+        for segment in entities
+    ]
+
+
+class _SpanIndex:
+    """
+    Interval index over the spans of the entities of a segment, answering which entities overlap a range.
+    Entities are sorted by span start, with the running maximum of span ends, so that a query only scans the entities starting before the end of the range and stops at the first one that cannot reach its start.
+    Entities without a resolved span are returned by every query.
+    """
+
+    def __init__(self, entities: list[IEntity]):
+        self._unresolved = [i for i, entity in enumerate(entities) if tuple(entity.span) == UNRESOLVED_SPAN]
+        resolved = sorted((entity.span[0], entity.span[1], i) for i, entity in enumerate(entities) if tuple(entity.span) != UNRESOLVED_SPAN)
+        self._starts = [start for start, _, _ in resolved]
+        self._ends = [end for _, end, _ in resolved]
+        self._indices = [i for _, _, i in resolved]
+        self._max_ends = []
+        max_end = -1
+        for end in self._ends:
+            max_end = max(max_end, end)
+            self._max_ends.append(max_end)
+
+    def query(self, start: int, end: int) -> list[int]:
+        """
+        Get the indices (in the original order) of the entities overlapping [start, end).
+        """
+        res = list(self._unresolved)
+        i = bisect_left(self._starts, end) - 1
+        while i >= 0 and self._max_ends[i] > start:
+            if self._ends[i] > start:
+                res.append(self._indices[i])
+            i -= 1
+        return sorted(res)
+
+
+def _attached_entities(entities: list, span_index: _SpanIndex, practice_span: tuple[int, int], attachment: EntityAttachment, window: int) -> list:
+    if attachment == EntityAttachment.ALL or tuple(practice_span) == UNRESOLVED_SPAN:
+        return list(entities)
+    start, end = practice_span
+    if attachment == EntityAttachment.NEARBY:
+        start, end = start - window, end + window
+    return [entities[i] for i in span_index.query(start, end)]
 
 
 def group_data_practices_and_entities(
-    data_practices: list[SWDataPractices], classified_data_entities: list[SWClassifiedDataEntities], classified_purpose_entities: list[SWClassifiedPurposeEntities], parties: list[SWPartyEntities]
+    data_practices: list[SWDataPractices], classified_data_entities: list[SWClassifiedDataEntities], classified_purpose_entities: list[SWClassifiedPurposeEntities], parties: list[SWPartyEntities],
+    attachment: EntityAttachment = EntityAttachment.ALL, window: int = NEARBY_WINDOW,
 ) -> list[SWGroupedDataPractice]:
     """
     Group relevant information into the data practices.
-    All entities are grouped by segments.
+    All entities are grouped by segments. The inputs are matched by the index of the segment (they must all be obtained from the same list of segments), so repeated segments are kept apart.
 
     @param data_practices: list of data practices, obtained from identify_data_practices
     @param classified_data_entities: list of data entities with categories, obtained from classify_data_categories
     @param classified_purpose_entities: list of purpose entities with categories, obtained from classify_purpose_categories
     @param parties: list of parties, obtained from identify_parties
+    @param attachment: which data and purpose entities of the segment are attached to each practice, see EntityAttachment
+    @param window: the window (in characters) around the practice span, for EntityAttachment.NEARBY
     @return: list of data practices with relevant information, in the following form (as a list of SWGroupedDataPractice):
     [
         {
@@ -37,67 +117,41 @@ def group_data_practices_and_entities(
         }
     ]
     """
-    indexed_data_entities = {
-        segment["segment"]: segment["entities"] if "entities" in segment else []
-        for segment in to_dict(classified_data_entities)
-    }
-    indexed_purpose_entities = {
-        segment["segment"]: segment["entities"] if "entities" in segment else []
-        for segment in to_dict(classified_purpose_entities)
-    }
-    indexed_parties = {
-        segment["segment"]: segment["entities"] if "entities" in segment else []
-        for segment in to_dict(parties)
-    }
+    if not (len(data_practices) == len(classified_data_entities) == len(classified_purpose_entities) == len(parties)):
+        raise ValueError("The data practices and entities are not obtained from the same segments")
 
     res = []
 
-    for isegment in data_practices:
-        segment = to_dict(isegment)
-        segment_text = segment["segment"]
-        practices = segment["practices"]
-        practice_parties = indexed_parties[segment_text] if segment_text in indexed_parties else []
-        practice_data = indexed_data_entities[segment_text] if segment_text in indexed_data_entities else []
-        practice_purpose = indexed_purpose_entities[segment_text] if segment_text in indexed_purpose_entities else []
-        res.append(SWGroupedDataPractice(
-            **{
-                "segment": segment_text,
-                "practices": [
-                    {
-                        **practice,
-                        "parties": [
-                            party
-                            for party in practice_parties
-                            # if party["span"][0] >= practice["span"][0]
-                            # and party["span"][1] <= practice["span"][1]
-                        ],
-                        "data": [
-                            data
-                            for data in practice_data
-                            # if data["span"][0] >= practice["span"][0]
-                            # and data["span"][1] <= practice["span"][1]
-                        ],
-                        "purpose": [
-                            purpose
-                            for purpose in practice_purpose
-                            # if purpose["span"][0] >= practice["span"][0]
-                            # and purpose["span"][1] <= practice["span"][1]
-                        ],
-                    }
-                    for practice in practices
-                ],
-            })
-        )
+    for segment, segment_data, segment_purpose, segment_parties in zip(data_practices, classified_data_entities, classified_purpose_entities, parties):
+        if not (segment.segment == segment_data.segment == segment_purpose.segment == segment_parties.segment):
+            raise ValueError("The data practices and entities are not obtained from the same segments")
+        data_index = _SpanIndex(segment_data.entities) if attachment != EntityAttachment.ALL else None
+        purpose_index = _SpanIndex(segment_purpose.entities) if attachment != EntityAttachment.ALL else None
+        res.append(SWGroupedDataPractice.model_construct(
+            segment=segment.segment,
+            practices=[
+                GroupedDataPractice.model_construct(
+                    type=practice.type,
+                    text=practice.text,
+                    span=practice.span,
+                    parties=list(segment_parties.entities),
+                    data=_attached_entities(segment_data.entities, data_index, practice.span, attachment, window),
+                    purpose=_attached_entities(segment_purpose.entities, purpose_index, practice.span, attachment, window),
+                )
+                for practice in segment.practices
+            ],
+        ))
     return res
 
 
-def add_ids_into_grouped_practices(grouped_practices: list[SWGroupedDataPractice]) -> list[SWGroupedDataPracticeWithId]:
+def add_ids_into_grouped_practices(grouped_practices: list[SWGroupedDataPractice], dedupe_entities: bool = False) -> list[SWGroupedDataPracticeWithId]:
     """
     Add IDs into the grouped practices, for both practices and entities.
     The ID is simply the index of the data practice or entity in the list, and only serves the purpose of internal identification.
     Note that IDs are grouped by segments, so the same ID may appear in different segments.
 
     @param grouped_practices: list of grouped data practices, obtained from group_data_practices_and_entities
+    @param dedupe_entities: give an entity attached to multiple practices of the segment the same ID everywhere (so that it appears only once in the relation query), instead of a new ID per practice
     @return: list of grouped data practices with IDs, in the following form (as a list of SWGroupedDataPracticeWithId):
     [
         {
@@ -139,35 +193,48 @@ def add_ids_into_grouped_practices(grouped_practices: list[SWGroupedDataPractice
     """
     res = []
     for segment in grouped_practices:
-        segment_text = segment.segment
         entity_counter = 0
+        entities_with_id = {}
+        def with_id(kind: str, entity, construct):
+            nonlocal entity_counter
+            key = (kind, entity)
+            if dedupe_entities and key in entities_with_id:
+                return entities_with_id[key]
+            entity_counter += 1
+            entity_with_id = construct(f"D{entity_counter}")
+            entities_with_id[key] = entity_with_id
+            return entity_with_id
+
         practices_with_id = []
-        practices = to_dict(segment.practices)
-        for practice_index, practice in enumerate(practices):
-            practice_with_id = {
-                "id": f"C{practice_index+1}",
-                **practice
-            }
-            for party in practice_with_id["parties"]:
-                entity_counter += 1
-                party["id"] = f"D{entity_counter}"
-            for data in practice_with_id["data"]:
-                entity_counter += 1
-                data["id"] = f"D{entity_counter}"
-            for purpose in practice_with_id["purpose"]:
-                entity_counter += 1
-                purpose["id"] = f"D{entity_counter}"
-            practices_with_id.append(practice_with_id)
-        res.append(SWGroupedDataPracticeWithId(**{
-            "segment": segment_text,
-            "practices": practices_with_id
-            }))
+        for practice_index, practice in enumerate(segment.practices):
+            parties = [
+                with_id('party', party, lambda id: PartyEntityWithId.model_construct(id=id, text=party.text, party_type=party.party_type))
+                for party in practice.parties
+            ]
+            data = [
+                with_id('data', entity, lambda id: ClassifiedDataEntityWithId.model_construct(id=id, text=entity.text, span=entity.span, category=entity.category))
+                for entity in practice.data
+            ]
+            purpose = [
+                with_id('purpose', entity, lambda id: ClassifiedPurposeEntityWithId.model_construct(id=id, text=entity.text, span=entity.span, category=entity.category))
+                for entity in practice.purpose
+            ]
+            practices_with_id.append(GroupedDataPracticeWithId.model_construct(
+                id=f"C{practice_index+1}",
+                type=practice.type,
+                text=practice.text,
+                span=practice.span,
+                data=data,
+                purpose=purpose,
+                parties=parties,
+            ))
+        res.append(SWGroupedDataPracticeWithId.model_construct(segment=segment.segment, practices=practices_with_id))
     return res
 
 
 def convert_grouped_practices_to_query_data(grouped_practices_with_id: SWGroupedDataPracticeWithId):
     """
-    Convert grouped practices to query data for the LLM.
+    Convert grouped practices to query data for the LLM. Entities shared by multiple practices (see `add_ids_into_grouped_practices`) are listed once.
 
     @param grouped_practices_with_id: a grouped data practices, which is an element obtained from add_ids_into_grouped_practices
     @return: list of query data for the LLM, in the following form:
@@ -191,38 +258,119 @@ def convert_grouped_practices_to_query_data(grouped_practices_with_id: SWGrouped
         }
     }
     """
-    segment = to_dict(grouped_practices_with_id)
-    segment_text = segment["segment"]
-    practices = segment["practices"]
+    practices = grouped_practices_with_id.practices
     action_contexts = [
         {
-            "id": practice["id"],
-            "action_type": practice["type"],
-            "text": practice["text"],
+            "id": practice.id,
+            "action_type": practice.type,
+            "text": practice.text,
         }
         for practice in practices
     ]
     entities = []
+    seen_ids = set()
     for practice in practices:
-        for entity in practice["data"]:
-            entity_info = {"id": entity["id"], "text": entity["text"], "type": "Data"}
+        for entity in practice.data:
+            if entity.id in seen_ids:
+                continue
+            seen_ids.add(entity.id)
+            entity_info = {"id": entity.id, "text": entity.text, "type": "Data"}
             entities.append(entity_info)
-        for entity in practice["purpose"]:
+        for entity in practice.purpose:
+            if entity.id in seen_ids:
+                continue
+            seen_ids.add(entity.id)
             entity_info = {
-                "id": entity["id"],
-                "text": entity["text"],
+                "id": entity.id,
+                "text": entity.text,
                 "type": "Purpose",
             }
             entities.append(entity_info)
-        for entity in practice["parties"]:
+        for entity in practice.parties:
+            if entity.id in seen_ids:
+                continue
+            seen_ids.add(entity.id)
             entity_info = {
-                "id": entity["id"],
-                "text": entity["text"],
-                "type": entity["party_type"],
+                "id": entity.id,
+                "text": entity.text,
+                "type": entity.party_type,
             }
             entities.append(entity_info)
     res = {
-        "segment": segment_text,
+        "segment": grouped_practices_with_id.segment,
         "targets": {"action_contexts": action_contexts, "entities": entities},
     }
-    return res
\ No newline at end of file
+    return res
+
+
+# Rough number of characters per token, for estimating the size of a query
+CHARS_PER_TOKEN = 4
+
+
+def estimate_query_tokens(query_data: dict) -> int:
+    """
+    Estimate the number of tokens of the query data when sent to the LLM, from the length of its JSON form.
+    """
+    return len(json.dumps(query_data, ensure_ascii=False)) // CHARS_PER_TOKEN + 1
+
+
+def halve_relation_query(query_data: dict) -> list[dict]:
+    """
+    Split a relation query (obtained from convert_grouped_practices_to_query_data) into two, by halving the longer of its action contexts and entities. The other one is kept whole in both halves, so every (action, entity) pair of the original query is in exactly one of them.
+    IDs are kept unchanged.
+
+    @param query_data: a query data for the LLM
+    @return: the two halves, or an empty list if the query has only one action context and one entity (thus cannot be split)
+    """
+    action_contexts = query_data['targets']['action_contexts']
+    entities = query_data['targets']['entities']
+    if len(action_contexts) <= 1 and len(entities) <= 1:
+        return []
+    if len(action_contexts) >= len(entities):
+        mid = len(action_contexts) // 2
+        parts = [(action_contexts[:mid], entities), (action_contexts[mid:], entities)]
+    else:
+        mid = len(entities) // 2
+        parts = [(action_contexts, entities[:mid]), (action_contexts, entities[mid:])]
+    return [
+        {"segment": query_data['segment'], "targets": {"action_contexts": part_action_contexts, "entities": part_entities}}
+        for part_action_contexts, part_entities in parts
+    ]
+
+
+def split_relation_query(query_data: dict, max_tokens: int) -> list[dict]:
+    """
+    Split a relation query into sub-queries whose estimated size (see estimate_query_tokens) is within max_tokens, by repeatedly halving it (see halve_relation_query).
+    A query within the bound is returned as is (as the only element). A sub-query which cannot be split further is kept even if it exceeds the bound.
+
+    @param query_data: a query data for the LLM, obtained from convert_grouped_practices_to_query_data
+    @param max_tokens: the bound of the estimated number of tokens of each sub-query
+    @return: list of sub-queries, with the original IDs
+    """
+    if estimate_query_tokens(query_data) <= max_tokens:
+        return [query_data]
+    halves = halve_relation_query(query_data)
+    if not halves:
+        return [query_data]
+    return [sub_query for half in halves for sub_query in split_relation_query(half, max_tokens)]
+
+
+def renumber_relation_query(query_data: dict) -> tuple[dict, dict[str, str]]:
+    """
+    Renumber the IDs of a (sub-)query to the compact form used by add_ids_into_grouped_practices (C1, C2, ... for action contexts and D1, D2, ... for entities), so that a sub-query looks like any other query to the LLM.
+
+    @param query_data: a query data for the LLM, e.g. from split_relation_query
+    @return: the renumbered query data, and the mapping from the new IDs to the original IDs
+    """
+    id_map = {}
+    action_contexts = []
+    for i, action_context in enumerate(query_data['targets']['action_contexts']):
+        new_id = f"C{i+1}"
+        id_map[new_id] = action_context['id']
+        action_contexts.append({**action_context, "id": new_id})
+    entities = []
+    for i, entity in enumerate(query_data['targets']['entities']):
+        new_id = f"D{i+1}"
+        id_map[new_id] = entity['id']
+        entities.append({**entity, "id": new_id})
+    return {"segment": query_data['segment'], "targets": {"action_contexts": action_contexts, "entities": entities}}, id_map
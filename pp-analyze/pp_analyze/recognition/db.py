@@ -59,6 +59,20 @@ class BatchQueryRecord(SQLModel, table=True):
         return json.loads(self.query_params)
 
 
+class PhraseClassificationRecord(SQLModel, table=True):
+    '''
+    Category of a (normalised) entity phrase, independent of the segment it appears in.
+    `schema_key` identifies the classification task and the category schema (hierarchy and definitions) the category belongs to.
+    '''
+    id: Optional[int] = Field(default=None, primary_key=True)
+    schema_key: str = Field(index=True)
+    phrase: str = Field(index=True)
+    category: str
+    confidence: Optional[float] = None
+    provenance: str
+    timestamp: str = Field(default_factory=datetime.now().isoformat)
+
+
 def enable_zstd_extension(dbapi_conn, *args):
     dbapi_conn.enable_load_extension(True)
     sqlite_zstd.load(dbapi_conn)
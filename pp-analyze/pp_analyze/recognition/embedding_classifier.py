@@ -0,0 +1,268 @@
+'''
+Local classification of data and purpose entity phrases, by nearest-neighbour lookup of phrase embeddings.
+Similar to the Chroma-based similarity classification in `fine-tune`, but running in-process on CPU.
+
+The index is built from the category definitions (`DATA_CATEGORY_DEFINITION` / `PURPOSE_CATEGORY_DEFINITION`) and, optionally, annotated examples (`DATA_CATEGORY_EXAMPLES` / `PURPOSE_CATEGORY_EXAMPLES`; CSV files with two columns: phrase, category).
+Phrases whose best match is below the confidence threshold are classified by the fallback LLM query helper instead.
+
+Requires the optional `sentence-transformers` dependency.
+'''
+
+import csv
+from dotenv import load_dotenv
+import logging
+import numpy as np
+import os
+from ppa_commons import get_entity_category_definitions
+from . import query_helper as qh
+from .types import QueryCategory, ClassifierBackend, PARAM_OVERRIDE_CACHE
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    # Will error out later if the embedding classifier is used.
+    SentenceTransformer = None
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_CONFIDENCE_THRESHOLD = float(os.getenv("EMBEDDING_CONFIDENCE_THRESHOLD", "0.5"))
+
+F_DATA_CATEGORY_DEFINITION = os.getenv("DATA_CATEGORY_DEFINITION")
+F_PURPOSE_CATEGORY_DEFINITION = os.getenv("PURPOSE_CATEGORY_DEFINITION")
+F_DATA_CATEGORY_EXAMPLES = os.getenv("DATA_CATEGORY_EXAMPLES")
+F_PURPOSE_CATEGORY_EXAMPLES = os.getenv("PURPOSE_CATEGORY_EXAMPLES")
+
+
+def get_annotated_examples(examples_file: str | None) -> list[tuple[str, str]]:
+    '''
+    The annotated examples is a CSV file with two columns: phrase, category.
+    Returns a list of (phrase, category) tuples; empty if no file is given.
+    '''
+    if not examples_file:
+        return []
+    with open(examples_file) as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [(line[0], line[1]) for line in reader]
+
+
+_embedding_models = {}
+
+
+def get_embedding_model(model_name: str):
+    if SentenceTransformer is None:
+        raise ImportError("The embedding classifier requires `sentence-transformers` to be installed.")
+    if model_name not in _embedding_models:
+        _embedding_models[model_name] = SentenceTransformer(model_name, device='cpu')
+    return _embedding_models[model_name]
+
+
+def _empty_usage() -> dict:
+    return {
+        'queries': 0,
+        'phrases': 0,
+        'local_hits': 0,
+        'fallback_phrases': 0,
+        'fallback_queries': 0,
+    }
+
+
+class EmbeddingClassifier:
+    '''
+    Classifier for entity phrases, compatible with the `QueryHelper` interface used by the classification stages (`classify_data_categories` and `classify_purpose_categories`):
+    `run_query` / `arun_query` take `{'segment': ..., 'phrases': [...]}` and return the list of categories (in the same order as the phrases).
+
+    Embeddings are computed with NumPy over all phrases at once: either all phrases of a stage (via `prefetch`, or the batch query interface), or all phrases of a query.
+    The index, the memo and the embedding model are not thread-safe: `arun_query` classifies locally in the event loop, and only runs the fallback query in a worker thread.
+    '''
+
+    def __init__(self, cache_category: QueryCategory, definitions: dict[str, str], examples: list[tuple[str, str]] = [],
+                 fallback: qh.QueryHelper | None = None, model_name: str = EMBEDDING_MODEL, threshold: float = EMBEDDING_CONFIDENCE_THRESHOLD):
+        self.cache_category = cache_category
+        self.model_name = model_name
+        self.llm_model = f"embedding:{model_name}"
+        self.threshold = threshold
+        self.fallback = fallback
+        self._definitions = definitions
+        self._examples = examples
+        self._index = None
+        self._index_labels = None
+        self._memo: dict[str, tuple[str, float]] = {}
+        # Confidence and provenance of the category of each phrase, as last returned by `run_query`
+        self._sources: dict[str, tuple[float | None, str]] = {}
+        self._batch_query_queue: list[tuple[dict, PARAM_OVERRIDE_CACHE]] = []
+        self._usage = _empty_usage()
+
+    def get_usage(self) -> dict:
+        return dict(self._usage)
+
+    def reset_usage(self):
+        self._usage = _empty_usage()
+
+    def _embed(self, texts: list[str]) -> np.ndarray:
+        model = get_embedding_model(self.model_name)
+        embeddings = model.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True, show_progress_bar=False)
+        return np.asarray(embeddings, dtype=np.float32)
+
+    def _build_index(self):
+        texts = []
+        labels = []
+        for category, definition in self._definitions.items():
+            texts.append(f"{category.replace('-', ' ')}: {definition}")
+            labels.append(category)
+        for phrase, category in self._examples:
+            texts.append(phrase)
+            labels.append(category)
+        if not texts:
+            raise ValueError(f"No category definitions or examples to build the index for {self.cache_category}")
+        self._index = self._embed(texts)
+        self._index_labels = np.array(labels, dtype=object)
+
+    def classify_phrases(self, phrases: list[str]) -> tuple[list[str], np.ndarray]:
+        '''
+        Classify the phrases by their nearest neighbour in the index.
+        Returns the categories and the confidences (cosine similarity to the nearest neighbour), in the same order as the phrases.
+        '''
+        if self._index is None:
+            self._build_index()
+        unseen = list(dict.fromkeys(phrase for phrase in phrases if phrase not in self._memo))
+        if unseen:
+            similarities = self._embed(unseen) @ self._index.T
+            best = similarities.argmax(axis=1)
+            confidences = similarities[np.arange(len(unseen)), best]
+            for phrase, category, confidence in zip(unseen, self._index_labels[best], confidences):
+                self._memo[phrase] = (category, float(confidence))
+        categories = [self._memo[phrase][0] for phrase in phrases]
+        confidences = np.array([self._memo[phrase][1] for phrase in phrases], dtype=np.float32)
+        return categories, confidences
+
+    def prefetch(self, phrases: list[str]):
+        '''
+        Embed and classify all given phrases in one go (e.g. all phrases of a stage), so that later queries are served from memory.
+        '''
+        if phrases:
+            self.classify_phrases(phrases)
+
+    def _needs_fallback(self, confidences: np.ndarray) -> bool:
+        return self.fallback is not None and bool((confidences < self.threshold).any())
+
+    def get_confidences_and_provenances(self, phrases: list[str]) -> tuple[list[float | None], list[str]]:
+        '''
+        Get the confidence and the provenance (the classifier's `llm_model`) of the category of each phrase, as last returned by `run_query`.
+        Phrases classified by the fallback have no confidence.
+        '''
+        sources = [self._sources[phrase] for phrase in phrases]
+        return [confidence for confidence, _ in sources], [provenance for _, provenance in sources]
+
+    def enqueue_batch_query(self, data: dict, override_cache: PARAM_OVERRIDE_CACHE = None):
+        self._batch_query_queue.append((dict(data), override_cache))
+        return len(self._batch_query_queue)
+
+    def enqueue_batch_queries(self, data: list[dict], override_cache: PARAM_OVERRIDE_CACHE = None, execute_now: bool = False):
+        for d in data:
+            self.enqueue_batch_query(d, override_cache)
+        if execute_now:
+            return self.execute_batch_queries()
+
+    def execute_batch_queries(self):
+        '''
+        Classify all phrases of the queued queries at once, and submit the queries containing low-confidence phrases to the fallback's batch API.
+        '''
+        if not self._batch_query_queue:
+            return []
+        self.prefetch([phrase for data, _ in self._batch_query_queue for phrase in data['phrases']])
+        has_fallback_queries = False
+        for data, override_cache in self._batch_query_queue:
+            _, confidences = self.classify_phrases(data['phrases'])
+            if self._needs_fallback(confidences):
+                self.fallback.enqueue_batch_query(dict(data), override_cache=override_cache)
+                has_fallback_queries = True
+        self._batch_query_queue = []
+        if has_fallback_queries:
+            return self.fallback.execute_batch_queries()
+        return []
+
+    async def wait_and_handle_batch_queries(self, batch_job_id=None):
+        if self.fallback is not None:
+            await self.fallback.wait_and_handle_batch_queries(batch_job_id)
+
+    def _merge_fallback(self, phrases: list[str], categories: list[str], confidences: np.ndarray, fallback_categories: list[str] | None) -> list[str]:
+        '''
+        Use the fallback categories (if any, and if valid) for the phrases below the confidence threshold, and record the usage and the source of each category.
+        '''
+        low_confidence = np.zeros(len(phrases), dtype=bool)
+        if fallback_categories is not None:
+            self._usage['fallback_queries'] += 1
+            if len(fallback_categories) == len(phrases):
+                low_confidence = confidences < self.threshold
+                categories = [fallback_category if low else category for category, fallback_category, low in zip(categories, fallback_categories, low_confidence)]
+            else:
+                logger.warning(f"Fallback returned {len(fallback_categories)} categories for {len(phrases)} phrases; keeping local classification")
+        for phrase, confidence, low in zip(phrases, confidences.tolist(), low_confidence):
+            self._sources[phrase] = (None, self.fallback.llm_model) if low else (confidence, self.llm_model)
+        num_fallback_phrases = int(low_confidence.sum())
+        self._usage['queries'] += 1
+        self._usage['phrases'] += len(phrases)
+        self._usage['fallback_phrases'] += num_fallback_phrases
+        self._usage['local_hits'] += len(phrases) - num_fallback_phrases
+        return categories
+
+    def run_query(self, data: dict, override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False):
+        '''
+        Classify the phrases in `data['phrases']`, returning the list of categories.
+        If any phrase is below the confidence threshold, the whole query (the fallback needs the segment as context) is sent to the fallback, and its categories are used for those phrases.
+        '''
+        categories, confidences = self.classify_phrases(data['phrases'])
+        fallback_categories = None
+        if self._needs_fallback(confidences):
+            fallback_categories = self.fallback.run_query(dict(data), override_cache=override_cache, batch=batch)
+        return self._merge_fallback(data['phrases'], categories, confidences, fallback_categories)
+
+    async def arun_query(self, data: dict, override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False):
+        '''
+        Same as `run_query`, but the fallback query (if any) does not block the event loop.
+        '''
+        categories, confidences = self.classify_phrases(data['phrases'])
+        fallback_categories = None
+        if self._needs_fallback(confidences):
+            fallback_categories = await self.fallback.arun_query(dict(data), override_cache=override_cache, batch=batch)
+        return self._merge_fallback(data['phrases'], categories, confidences, fallback_categories)
+
+
+_classifiers: dict[QueryCategory, EmbeddingClassifier] = {}
+
+
+def get_embedding_classifier(category: QueryCategory) -> EmbeddingClassifier:
+    '''
+    Get the (shared) embedding classifier for QueryCategory.DATA_CLASSIFICATION or QueryCategory.PURPOSE_CLASSIFICATION, with the corresponding LLM query helper as fallback.
+    '''
+    if category not in _classifiers:
+        if category == QueryCategory.DATA_CLASSIFICATION:
+            definitions = get_entity_category_definitions(F_DATA_CATEGORY_DEFINITION) if F_DATA_CATEGORY_DEFINITION else {}
+            examples = get_annotated_examples(F_DATA_CATEGORY_EXAMPLES)
+            fallback = qh.Q_DATA_CLASSIFICATION
+        elif category == QueryCategory.PURPOSE_CLASSIFICATION:
+            definitions = get_entity_category_definitions(F_PURPOSE_CATEGORY_DEFINITION) if F_PURPOSE_CATEGORY_DEFINITION else {}
+            examples = get_annotated_examples(F_PURPOSE_CATEGORY_EXAMPLES)
+            fallback = qh.Q_PURPOSE_CLASSIFICATION
+        else:
+            raise ValueError(f"No embedding classifier for {category}")
+        _classifiers[category] = EmbeddingClassifier(category, definitions, examples, fallback=fallback)
+    return _classifiers[category]
+
+
+def get_classifier(category: QueryCategory, backend: ClassifierBackend = ClassifierBackend.LLM):
+    '''
+    Get the classifier (QueryHelper or compatible) to use for the classification stage `category` with the given backend.
+    '''
+    if backend == ClassifierBackend.EMBEDDING:
+        return get_embedding_classifier(category)
+    if category == QueryCategory.DATA_CLASSIFICATION:
+        return qh.Q_DATA_CLASSIFICATION
+    elif category == QueryCategory.PURPOSE_CLASSIFICATION:
+        return qh.Q_PURPOSE_CLASSIFICATION
+    raise ValueError(f"No classifier for {category}")
@@ -0,0 +1,135 @@
+'''
+Phrase-level memo of entity classification results.
+
+The LLM query cache is keyed by the full prompt (segment and phrase list), so the same phrase is classified again whenever it appears in a different segment.
+This memo maps a normalised phrase to its category (with confidence and provenance) per category schema, so that the classification stages only need to classify unseen phrases.
+It is stored in the query cache database if available, otherwise only in memory.
+'''
+
+import hashlib
+import re
+from sqlmodel import Session, select
+from . import db
+from .types import QueryCategory
+
+
+RE_WHITESPACE = re.compile(r"\s+")
+_STRIPPED_CHARS = ' .,;:!?"\'()[]{}'
+
+_MAX_QUERY_VARIABLES = 500
+
+
+def normalize_phrase(phrase: str) -> str:
+    '''
+    Normalise the phrase for lookup: lower case, collapsed whitespace, and no surrounding punctuation.
+    '''
+    return RE_WHITESPACE.sub(' ', phrase.lower()).strip(_STRIPPED_CHARS)
+
+
+def _empty_stats() -> dict:
+    return {
+        'lookups': 0,
+        'hits': 0,
+        'stored': 0,
+    }
+
+
+class PhraseClassificationMemo:
+    '''
+    Memo of phrase categories for one classification task (`cache_category`) and category schema (`schema`, e.g. a digest of the category hierarchy and definitions).
+    '''
+
+    def __init__(self, cache_category: QueryCategory, schema: str):
+        self.cache_category = cache_category
+        self.schema_key = f"{cache_category.value}:{schema}"
+        self._memo: dict[str, tuple[str, float | None, str]] = {}
+        self._stats = _empty_stats()
+
+    def get_stats(self) -> dict:
+        '''
+        Get the number of looked-up phrases, hits and newly stored phrases since creation (or the last `reset_stats`), and the hit rate.
+        '''
+        stats = dict(self._stats)
+        stats['hit_rate'] = stats['hits'] / stats['lookups'] if stats['lookups'] else 0.0
+        return stats
+
+    def reset_stats(self):
+        self._stats = _empty_stats()
+
+    def _load(self, normalized_phrases: list[str]):
+        missing = [phrase for phrase in dict.fromkeys(normalized_phrases) if phrase not in self._memo]
+        if not missing or db.engine is None:
+            return
+        with Session(db.engine) as session:
+            for i in range(0, len(missing), _MAX_QUERY_VARIABLES):
+                statement = select(db.PhraseClassificationRecord).where(
+                    db.PhraseClassificationRecord.schema_key == self.schema_key,
+                    db.PhraseClassificationRecord.phrase.in_(missing[i:i+_MAX_QUERY_VARIABLES]),
+                )
+                for record in session.exec(statement):
+                    self._memo[record.phrase] = (record.category, record.confidence, record.provenance)
+
+    def lookup(self, phrases: list[str]) -> list[str | None]:
+        '''
+        Look up the categories of the phrases. Returns the category for each phrase (in the same order), or None if the phrase has not been classified before.
+        '''
+        normalized_phrases = [normalize_phrase(phrase) for phrase in phrases]
+        self._load(normalized_phrases)
+        res = []
+        for phrase in normalized_phrases:
+            entry = self._memo.get(phrase)
+            res.append(entry[0] if entry else None)
+        self._stats['lookups'] += len(phrases)
+        self._stats['hits'] += sum(1 for category in res if category is not None)
+        return res
+
+    def store(self, phrases: list[str], categories: list[str], confidences: list[float | None], provenances: list[str]):
+        '''
+        Store the categories of newly classified phrases. Phrases already in the memo are kept as they are.
+        '''
+        records = []
+        for phrase, category, confidence, provenance in zip(phrases, categories, confidences, provenances):
+            phrase = normalize_phrase(phrase)
+            if phrase in self._memo:
+                continue
+            self._memo[phrase] = (category, confidence, provenance)
+            records.append(db.PhraseClassificationRecord(
+                schema_key=self.schema_key,
+                phrase=phrase,
+                category=category,
+                confidence=confidence,
+                provenance=provenance,
+            ))
+        self._stats['stored'] += len(records)
+        if records and db.engine is not None:
+            with Session(db.engine) as session:
+                session.add_all(records)
+                session.commit()
+
+
+_memos: dict[QueryCategory, PhraseClassificationMemo] = {}
+
+
+def get_phrase_memo(category: QueryCategory) -> PhraseClassificationMemo:
+    '''
+    Get the (shared) phrase memo for QueryCategory.DATA_CLASSIFICATION or QueryCategory.PURPOSE_CLASSIFICATION.
+    The category schema is identified by a digest of the classification system message, which contains the category hierarchy and definitions.
+    '''
+    if category not in _memos:
+        from . import query_helper as qh
+        if category == QueryCategory.DATA_CLASSIFICATION:
+            system_message = qh.Q_DATA_CLASSIFICATION.system_message
+        elif category == QueryCategory.PURPOSE_CLASSIFICATION:
+            system_message = qh.Q_PURPOSE_CLASSIFICATION.system_message
+        else:
+            raise ValueError(f"No phrase memo for {category}")
+        schema = hashlib.sha256(system_message.encode('utf-8')).hexdigest()[:16]
+        _memos[category] = PhraseClassificationMemo(category, schema)
+    return _memos[category]
+
+
+def get_phrase_memo_stats() -> dict[QueryCategory, dict]:
+    '''
+    Get the statistics (see `PhraseClassificationMemo.get_stats`) of all phrase memos in use.
+    '''
+    return {category: memo.get_stats() for category, memo in _memos.items()}
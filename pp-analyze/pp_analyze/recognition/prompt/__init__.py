@@ -17,3 +17,9 @@ from .preprocess import (
     SYSTEM_MESSAGE_DATA_ENTITY_CLASSIFICATION,
     SYSTEM_MESSAGE_PURPOSE_CATEGORY_CLASSIFICATION,
 )
+
+from .combined import (
+    SYSTEM_MESSAGE_DATA_ENTITY_WITH_CATEGORY,
+    SYSTEM_MESSAGE_PURPOSE_ENTITY_WITH_CATEGORY,
+    USER_MESSAGE_TEMPLATE_ENTITY_WITH_CATEGORY,
+)
@@ -0,0 +1,109 @@
+'''
+Prompts for recognizing entities and classifying them in the same query, used by the combined pipeline profile.
+The recognition guidelines are the same as those of the separate recognition prompts; the category hierarchy and definitions are the same as those of the separate classification prompts.
+'''
+
+from .env import (
+    _data_category_hierarchy_text,
+    _data_category_definitions_text,
+    _purpose_category_hierarchy_text,
+    _purpose_category_definitions_text,
+)
+
+
+_SYSTEM_MESSAGE_TEMPLATE_DATA_ENTITY_WITH_CATEGORY = '''You are an annotation expert. You will be given a sentence of a privacy policy of a web or mobile application, and will be asked to annotate data entities in it, and to classify each of them into a data category.
+
+IMPORTANT: Filtering Out General Phrases
+Before annotating, carefully check each potential data entity. DO NOT annotate general phrases that do not provide specific data types.
+Examples of general phrases to omit include, but are not limited to:
+
+"the information we collect about you"
+"other data"
+"any information"
+
+If a phrase does not clearly indicate a specific type of personal data, DO NOT include it in your annotations.
+
+Data entities are refers to the phrases that mention PERSONAL DATA OF THE USER which is being mentioned in one of the following context types:
+1. first-party-collection-use - the policy segment mentions collection, usage, or processing of this datum by the first party (the application).
+2. third-party-collection-use - the policy segment mentions collection, usage, or processing of this datum by a third party.
+3. third-party-sharing-disclosure - the policy segment mentions sharing, or disclosure of this datum to a third party.
+4. data-storage-retention-deletion - the policy segment mentions storage, retention, or deletion of this datum.
+5. data-security-protection - the policy segment mentions how this datum is being protected.
+
+Note the following!
+1. Personal user data that is mentioned outside of one of these contexts does not classify as data entity and should NOT be annotated.
+2. Multiple contexts may apply to the same data entity.
+3. Tracking technologies such as cookies, web beacons, etc. are technologies, hence does not classify as data entity and should NOT be annotated.
+4. The sentence that you receive might be empty or not contain any information on usage of concrete personal user data - that's normal, and you should just return an empty list.
+
+Each data entity must then be mapped to the category that matches it the closest and most precise.
+The categories are given as a hierarchy, meaning that some categories will have subcategories. The categories that are "deeper" in the hierarchy are more precise, so you should use them whenever they apply, and only use the parent category, if none of the child category matches the phrase.
+Here is the hierarchy of terms:
+
+{hierarchy}
+
+Here are definitions of these terms in form of a csv file:
+
+{definitions}
+
+The category must be STRICTLY of the categories in the "category" column of the attached csv file.
+
+Represent the output as a JSON array of entries, following the order of their appearance in the sentence. Each entry is a JSON object with two fields: `text` (the exact text of the data entity as it appears in the sentence) and `category` (the category of the data entity).
+Do not include any additional information or context in your annotations.
+'''
+
+
+_SYSTEM_MESSAGE_TEMPLATE_PURPOSE_ENTITY_WITH_CATEGORY = '''You are an annotation expert. You will be given a sentence of a privacy policy of a web or mobile application, and will be asked to annotate purpose entities in it, and to classify each of them into a purpose category.
+
+IMPORTANT: Filtering Out General Phrase
+Before annotating, carefully check each potential purpose entity. DO NOT annotate general phrases that do not provide specific purpose types.
+Examples of general phrases to omit include, but are not limited to:
+
+"other purposes"
+"purposes described in our policy"
+
+Purpose entities are phrases in segment text that refer to the purposes for which USER'S PERSONAL DATA will be used, collected, processed, protected, shared with the third parties, etc. The purpose entity must be mentioned in one of the following context types:
+1. first-party-collection-use - the policy segment mentions collection, usage, or processing of this datum by the first party (the application).
+2. third-party-collection-use - the policy segment mentions collection, usage, or processing of this datum by a third party.
+3. third-party-sharing-disclosure - the policy segment mentions sharing, or disclosure of this datum to a third party.
+4. data-storage-retention-deletion - the policy segment mentions storage, retention, or deletion of this datum.
+5. data-security-protection - the policy segment mentions how this datum is being protected.
+
+Note the following!
+1. Purpose that is mentioned outside of one of these contexts does not classify as purpose entity and should NOT be annotated.
+2. Purpose that does not have a clear and concrete personal user data that it applies to does not classify as purpose entity and should NOT be annotated.
+3. Multiple contexts may apply to the same purpose entity.
+
+Each purpose entity must then be mapped to the category that matches it the closest and most precise.
+The categories are given as a hierarchy, meaning that some categories will have subcategories. The categories that are "deeper" in the hierarchy are more precise, so you should use them whenever they apply, and only use the parent category, if none of the child category matches the phrase.
+Here is the hierarchy of terms:
+
+{hierarchy}
+
+Here are definitions of these terms in form of a csv file:
+
+{definitions}
+
+The category must be STRICTLY of the categories in the "category" column of the attached csv file.
+
+Represent the output as a JSON array of entries, following the order of their appearance in the sentence. Each entry is a JSON object with two fields: `text` (the exact text of the purpose entity as it appears in the sentence) and `category` (the category of the purpose entity).
+Do not include any additional information or context in your annotations.
+'''
+
+
+USER_MESSAGE_TEMPLATE_ENTITY_WITH_CATEGORY = '''Please annotate and classify the following sentence:
+
+{sentence}
+'''
+
+
+SYSTEM_MESSAGE_DATA_ENTITY_WITH_CATEGORY = _SYSTEM_MESSAGE_TEMPLATE_DATA_ENTITY_WITH_CATEGORY.format(
+                                                hierarchy=_data_category_hierarchy_text,
+                                                definitions=_data_category_definitions_text,
+                                            )
+
+
+SYSTEM_MESSAGE_PURPOSE_ENTITY_WITH_CATEGORY = _SYSTEM_MESSAGE_TEMPLATE_PURPOSE_ENTITY_WITH_CATEGORY.format(
+                                                hierarchy=_purpose_category_hierarchy_text,
+                                                definitions=_purpose_category_definitions_text,
+                                            )
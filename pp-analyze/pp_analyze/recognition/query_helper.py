@@ -10,6 +10,8 @@ from pydantic import BaseModel
 from sqlmodel import Field, Session, SQLModel, create_engine, select, DateTime
 from sqlalchemy import update
 import tempfile
+import threading
+import time
 from tqdm.auto import tqdm
 from typing import Optional, Callable
 from uuid import uuid4
@@ -30,6 +32,9 @@ logger.setLevel(logging.INFO)
 
 WAIT_INTERVAL = 30
 
+# The query cache of all helpers is in the same database (`db.engine`), written to from the worker threads of `QueryHelper.arun_query`
+_cache_write_lock = threading.Lock()
+
 
 QUERY_CATEGORY_TO_DATA_TYPE = {
     QueryCategory.DATA_ENTITY: DataType.ENTITY,
@@ -39,9 +44,22 @@ QUERY_CATEGORY_TO_DATA_TYPE = {
     QueryCategory.PARTY_RECOGNITION: DataType.PARTY,
     QueryCategory.DATA_PRACTICE: DataType.ACTION,
     QueryCategory.RELATION_RECOGNITION: DataType.RELATION,
+    QueryCategory.DATA_ENTITY_WITH_CATEGORY: DataType.CLASSIFIED_ENTITY,
+    QueryCategory.PURPOSE_ENTITY_WITH_CATEGORY: DataType.CLASSIFIED_ENTITY,
 }
 
 
+def _empty_usage() -> dict:
+    return {
+        'queries': 0,
+        'cache_hits': 0,
+        'llm_calls': 0,
+        'prompt_tokens': 0,
+        'completion_tokens': 0,
+        'llm_time': 0.0,
+    }
+
+
 def parse(model_output_text: str, data_type: DataType = None) -> dict | list | str:
     text, obj = json_parse.try_parse_json_object(model_output_text)
     if data_type is not None:
@@ -52,6 +70,7 @@ def parse(model_output_text: str, data_type: DataType = None) -> dict | list | s
 class SQLiteCacheManager:
     '''
     A cache manager that uses SQLite to store cache.
+    Writes are serialised (across all cache managers), as queries may be run from several threads at once.
     '''
     def __init__(self, cache_category: QueryCategory, llm_model: str):
         self.cache_category = cache_category
@@ -87,7 +106,7 @@ class SQLiteCacheManager:
         return res
 
     def save_to_cache(self, query_params: dict, result: dict):
-        with Session(db.engine) as session:
+        with _cache_write_lock, Session(db.engine) as session:
             record = db.QueryRecord(**{
                 'query_params': query_params,
                 'lm_response': result
@@ -96,7 +115,7 @@ class SQLiteCacheManager:
             session.commit()
 
     def save_batch_job_to_cache(self, query_params: dict, batch_job_id: str, batch_custom_id: str):
-        with Session(db.engine) as session:
+        with _cache_write_lock, Session(db.engine) as session:
             record = db.BatchQueryRecord(**{
                 'query_params': query_params,
                 'batch_id': batch_job_id,
@@ -106,7 +125,7 @@ class SQLiteCacheManager:
             session.commit()
 
     def update_cache(self, record: db.QueryRecord, result: str):
-        with Session(db.engine) as session:
+        with _cache_write_lock, Session(db.engine) as session:
             record.lm_response = result
             record.timestamp = datetime.now().isoformat()
             session.add(record)
@@ -116,7 +135,7 @@ class SQLiteCacheManager:
         '''
         Convert the batch job record to a query record, and fill the lm_response field with result. Remove the batch job record.
         '''
-        with Session(db.engine) as session:
+        with _cache_write_lock, Session(db.engine) as session:
             query_record = db.QueryRecord(**{
                 'query_params': batch_record.query_params,
                 'lm_response': result
@@ -181,10 +200,39 @@ class QueryHelper(BaseModel):
         self._batch_query_queue = []
         self._batch_jobs = []
         self._temp_batch_files = {}
+        self._usage = _empty_usage()
+        self._usage_lock = threading.Lock()
+
+    def get_usage(self) -> dict:
+        '''
+        Get the usage statistics of this helper since creation (or the last `reset_usage`):
+        number of queries, cache hits, actual LLM calls, consumed prompt/completion tokens, and wall time spent waiting for non-batch LLM calls.
+        '''
+        with self._usage_lock:
+            return dict(self._usage)
+
+    def reset_usage(self):
+        with self._usage_lock:
+            self._usage = _empty_usage()
+
+    def _add_usage(self, **counts):
+        '''
+        Add to the usage statistics; queries may be run from several threads at once (see `arun_query`).
+        '''
+        with self._usage_lock:
+            for key, count in counts.items():
+                self._usage[key] += count
+
+    def _record_usage(self, usage):
+        if usage is None:
+            return
+        if not isinstance(usage, dict):
+            usage = usage.model_dump()
+        self._add_usage(llm_calls=1, prompt_tokens=usage.get('prompt_tokens') or 0, completion_tokens=usage.get('completion_tokens') or 0)
 
     def _get_query_params(self, data: dict):
         if self.user_message_fn:
-            data.update(self.user_message_fn(data))
+            data = {**data, **self.user_message_fn(data)}
         user_message = self.user_message_template.format(**data)
         query_params = {
             "model": self.llm_model,
@@ -203,7 +251,10 @@ class QueryHelper(BaseModel):
         Execute the query and return the model output text.
         Not in batch mode.
         '''
+        start_time = time.perf_counter()
         completion = client.chat.completions.create(**query_params)
+        self._add_usage(llm_time=time.perf_counter() - start_time)
+        self._record_usage(completion.usage)
         model_output = completion.choices[0].message
         model_output_text = model_output.content
         return model_output_text
@@ -282,6 +333,7 @@ class QueryHelper(BaseModel):
             record_dict = {record.batch_custom_id: record for record in records}
             for data_item in tqdm(from_jsonl(res), desc="Handling results", leave=False):
                 record = record_dict[data_item['custom_id']]
+                self._record_usage(data_item['response']['body'].get('usage'))
                 self._cache_manager.fill_batch_job_cache(record, result=data_item['response']['body']['choices'][0]['message']['content'])
             finished_jobs.append(i_batch_job_id)
             if i_batch_job_id in self._temp_batch_files:
@@ -298,10 +350,12 @@ class QueryHelper(BaseModel):
         '''
         query_params = self._get_query_params(data)
         cache_out = self._cache_manager.get_record_from_cache(query_params)
+        self._add_usage(queries=1)
         if not cache_out and batch:
             raise RuntimeError("Batch job should be enqueued and executed using `enqueue_batch_queries` and `execute_batch_queries` before calling this function.")
         if cache_out is not None and (not override_cache or self.cache_category not in override_cache):
             model_output_text, _ = cache_out
+            self._add_usage(cache_hits=1)
         else:
             if not batch:
                 model_output_text = self._execute_query(query_params)
@@ -315,6 +369,13 @@ class QueryHelper(BaseModel):
         parsed_result = parse(model_output_text, QUERY_CATEGORY_TO_DATA_TYPE[self.cache_category] if self.parse_ambiguous_data else None)
         return parsed_result
 
+    async def arun_query(self, data: dict, override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False):
+        '''
+        Same as `run_query`, but runs in a worker thread so that it does not block the event loop.
+        This is what allows concurrent stages (e.g. those gathered in `analyze_pp`) to actually overlap their LLM calls; the usage statistics and the cache writes are therefore guarded by locks.
+        '''
+        return await asyncio.to_thread(self.run_query, data, override_cache, batch)
+
 
 Q_DATA_ENTITY = QueryHelper(
     cache_category=QueryCategory.DATA_ENTITY,
@@ -382,3 +443,50 @@ Q_RELATION_RECOGNITION = QueryHelper(
     user_message_template=prompt.USER_MESSAGE_TEMPLATE_RELATION_RECOGNITION,
     llm_model="ft:gpt-4o-2024-08-06:rui:relation-seg-v2:AAmgfsI1",
 )
+
+Q_DATA_ENTITY_WITH_CATEGORY = QueryHelper(
+    cache_category=QueryCategory.DATA_ENTITY_WITH_CATEGORY,
+    system_message=prompt.SYSTEM_MESSAGE_DATA_ENTITY_WITH_CATEGORY,
+    user_message_template=prompt.USER_MESSAGE_TEMPLATE_ENTITY_WITH_CATEGORY,
+    llm_model="gpt-4o-2024-08-06",
+    user_message_fn=lambda data: {
+        "sentence": data["segment"],
+    },
+    parse_ambiguous_data=True,
+)
+
+Q_PURPOSE_ENTITY_WITH_CATEGORY = QueryHelper(
+    cache_category=QueryCategory.PURPOSE_ENTITY_WITH_CATEGORY,
+    system_message=prompt.SYSTEM_MESSAGE_PURPOSE_ENTITY_WITH_CATEGORY,
+    user_message_template=prompt.USER_MESSAGE_TEMPLATE_ENTITY_WITH_CATEGORY,
+    llm_model="gpt-4o-2024-08-06",
+    user_message_fn=lambda data: {
+        "sentence": data["segment"],
+    },
+    parse_ambiguous_data=True,
+)
+
+
+QUERY_HELPERS = [
+    Q_DATA_ENTITY,
+    Q_DATA_CLASSIFICATION,
+    Q_PURPOSE_ENTITY,
+    Q_PURPOSE_CLASSIFICATION,
+    Q_ACTION_RECOGNITION,
+    Q_PARTY_RECOGNITION,
+    Q_RELATION_RECOGNITION,
+    Q_DATA_ENTITY_WITH_CATEGORY,
+    Q_PURPOSE_ENTITY_WITH_CATEGORY,
+]
+
+
+def get_usage_stats() -> dict[QueryCategory, dict]:
+    '''
+    Get the usage statistics of all query helpers, keyed by their query category.
+    '''
+    return {helper.cache_category: helper.get_usage() for helper in QUERY_HELPERS}
+
+
+def reset_usage_stats():
+    for helper in QUERY_HELPERS:
+        helper.reset_usage()
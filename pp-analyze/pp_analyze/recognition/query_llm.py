@@ -1,9 +1,11 @@
-from copy import deepcopy
+import asyncio
 from tqdm.auto import tqdm
 from . import query_helper as qh
 from .types import PARAM_OVERRIDE_CACHE
+from .phrase_memo import PhraseClassificationMemo, normalize_phrase
+from .span_resolution import resolve_spans_batch
+from .aux_utils import split_relation_query, halve_relation_query, renumber_relation_query
 from .data_model import (
-    to_dict,
     SWDataEntities,
     SWClassifiedDataEntities,
     SWPurposeEntities,
@@ -24,6 +26,56 @@ S_PURPOSE_CATEGORY_GENERAL = 'Purpose-general'
 PURPOSE_MAPPING_LEVEL = -1
 DATA_CATEGORY_MAPPING_LEVEL = -1
 
+# Bound of the estimated number of tokens of a relation query, above which it is split into sub-queries (see identify_relations)
+RELATION_QUERY_MAX_TOKENS = 3000
+# Number of times a relation query whose answer cannot be parsed is halved and retried (see identify_relations), so a query gives at most 2 ** RELATION_QUERY_MAX_SPLIT_DEPTH retried sub-queries
+RELATION_QUERY_MAX_SPLIT_DEPTH = 3
+
+
+def _compose_classification_queries(entities_list: list[SWDataEntities | SWPurposeEntities], phrase_memo: PhraseClassificationMemo | None) -> list[tuple[list[str | None], dict | None]]:
+    """
+    Compose the classification query of each segment. With a phrase memo, phrases classified before are looked up in it, and only the unseen phrases are queried, each once in the batch: a phrase occurring again (in the same or a later segment, after normalisation) is only queried where it first occurs, and its category is passed on to the other occurrences (see `_merge_classification_result`).
+
+    @return: for each segment, the categories known from the memo (None for unseen phrases), and the query data (None if there are no phrases to query in the segment)
+    """
+    res = []
+    queried = set()
+    for x in entities_list:
+        phrases = [entity.text for entity in x.entities]
+        if phrase_memo is None:
+            res.append(([None] * len(phrases), {'segment': x.segment, 'phrases': phrases}))
+            continue
+        known = phrase_memo.lookup(phrases)
+        unseen_phrases = []
+        for phrase, category in zip(phrases, known):
+            if category is None and (normalized := normalize_phrase(phrase)) not in queried:
+                queried.add(normalized)
+                unseen_phrases.append(phrase)
+        query = {'segment': x.segment, 'phrases': unseen_phrases} if unseen_phrases else None
+        res.append((known, query))
+    return res
+
+
+def _merge_classification_result(phrases: list[str], known: list[str | None], query: dict | None, categories: list[str] | None, classifier, phrase_memo: PhraseClassificationMemo | None, batch_categories: dict[str, str]) -> list[str | None] | None:
+    """
+    Fill the categories of the phrases of a segment which are not known from the memo: from the classifier output of the segment (if it has a query), or from that of an earlier segment in the batch, kept in batch_categories (by normalised phrase). The newly classified phrases are stored into the phrase memo and batch_categories.
+    The segments of a batch must be merged in order.
+
+    @return: the categories of all phrases (None for a phrase whose query failed in an earlier segment), or None if the classifier output is invalid (not a category for each queried phrase)
+    """
+    if query is not None:
+        if len(categories) != len(query['phrases']) or not all(isinstance(category, str) for category in categories):
+            return None
+        if phrase_memo is None:
+            return categories
+        if hasattr(classifier, 'get_confidences_and_provenances'):
+            confidences, provenances = classifier.get_confidences_and_provenances(query['phrases'])
+        else:
+            confidences, provenances = [None] * len(categories), [classifier.llm_model] * len(categories)
+        phrase_memo.store(query['phrases'], categories, confidences, provenances)
+        batch_categories.update(zip(map(normalize_phrase, query['phrases']), categories))
+    return [category if category is not None else batch_categories.get(normalize_phrase(phrase)) for phrase, category in zip(phrases, known)]
+
 
 async def identify_data_entities(pp_text: str, segments: list[str], override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False) -> list[SWDataEntities]:
     """
@@ -42,16 +94,8 @@ async def identify_data_entities(pp_text: str, segments: list[str], override_cac
         }
     ]
     """
-    def call_llm_for_segment(segment_text):
-        parsed_model_output = qh.Q_DATA_ENTITY.run_query({"segment": segment_text}, override_cache=override_cache, batch=batch)
-        res = []
-        for entity in parsed_model_output:
-            entity_text = entity
-            start_pos = segment_text.find(entity_text)
-            end_pos = start_pos + len(entity_text)
-            span = (start_pos, end_pos)
-            res.append({"text": entity_text, "span": span})
-        return res
+    async def call_llm_for_segment(segment_text):
+        return await qh.Q_DATA_ENTITY.arun_query({"segment": segment_text}, override_cache=override_cache, batch=batch)
 
     if batch:
         for segment in tqdm(segments, leave=False, desc="Composing batch jobs for identifying data entities"):
@@ -59,19 +103,26 @@ async def identify_data_entities(pp_text: str, segments: list[str], override_cac
         qh.Q_DATA_ENTITY.execute_batch_queries()
         await qh.Q_DATA_ENTITY.wait_and_handle_batch_queries()
 
-    res = []
+    entity_texts = []
     for segment in tqdm(segments, leave=False, desc="Identifying data entities"):
-        entities = call_llm_for_segment(segment)
+        entity_texts.append(await call_llm_for_segment(segment))
+    spans = resolve_spans_batch(segments, entity_texts)
+
+    res = []
+    for segment, segment_entity_texts, segment_spans in zip(segments, entity_texts, spans):
+        entities = [{"text": entity_text, "span": span} for entity_text, span in zip(segment_entity_texts, segment_spans)]
         res.append(SWDataEntities(**{"segment": segment, "entities": entities}))
     return res
 
 
-async def classify_data_categories(pp_text: str, segments: list[str], data_entities: list[SWDataEntities], override_cache: PARAM_OVERRIDE_CACHE = None, handle_incorrect_llm = True, batch: bool = False) -> list[SWClassifiedDataEntities]:
+async def classify_data_categories(pp_text: str, segments: list[str], data_entities: list[SWDataEntities], override_cache: PARAM_OVERRIDE_CACHE = None, handle_incorrect_llm = True, batch: bool = False, classifier: qh.QueryHelper | None = None, phrase_memo: PhraseClassificationMemo | None = None) -> list[SWClassifiedDataEntities]:
     """
     Identify the formal categories of data entities, as in DPV
 
     @param segments: list of pp segments, obtained from, e.g., convert_into_segments
     @param data_entities: list of data entities, obtained from identify_data_entities
+    @param classifier: the query helper (or a compatible classifier, e.g. from embedding_classifier.get_classifier) to classify the entities; defaults to Q_DATA_CLASSIFICATION
+    @param phrase_memo: if given, phrases classified before (in any segment) take their category from the memo, and only unseen phrases are sent to the classifier
     @return: list of data entities with categories, in the following form (of type SegmentWithClassifiedEntitiesList):
     [
         {
@@ -86,42 +137,38 @@ async def classify_data_categories(pp_text: str, segments: list[str], data_entit
         }
     ]
     """
-    def call_llm_for_data_point(data_point):
-        return qh.Q_DATA_CLASSIFICATION.run_query({
-            'segment': data_point['segment'],
-            'phrases': [entity['text'] for entity in data_point['entities']]
-        }, override_cache=override_cache)
+    if classifier is None:
+        classifier = qh.Q_DATA_CLASSIFICATION
+
+    queries = _compose_classification_queries(data_entities, phrase_memo)
 
     if batch:
-        for x in tqdm(deepcopy(data_entities), leave=False, desc="Composing batch jobs for classifying data entities"):
-            x_dict = to_dict(x)
-            qh.Q_DATA_CLASSIFICATION.enqueue_batch_query({
-                'segment': x_dict['segment'],
-                'phrases': [entity['text'] for entity in x_dict['entities']]
-            }, override_cache=override_cache)
-        qh.Q_DATA_CLASSIFICATION.execute_batch_queries()
-        await qh.Q_DATA_CLASSIFICATION.wait_and_handle_batch_queries()
+        for _, query in tqdm(queries, leave=False, desc="Composing batch jobs for classifying data entities"):
+            if query is not None:
+                classifier.enqueue_batch_query(query, override_cache=override_cache)
+        classifier.execute_batch_queries()
+        await classifier.wait_and_handle_batch_queries()
+    elif hasattr(classifier, 'prefetch'):
+        classifier.prefetch([phrase for _, query in queries if query is not None for phrase in query['phrases']])
 
     classified_data_entities = []
     errs = []
-    for x in tqdm(deepcopy(data_entities), leave=False, desc="Classifying data entities"):
-        x_dict = to_dict(x)
-        categories = call_llm_for_data_point(x_dict)
-        classified_entities = []
-        if len(categories) != len(x_dict["entities"]):
-            errs.append((x, categories))
-            if handle_incorrect_llm:
-                categories = [S_DATA_CATEGORY_GENERAL] * len(x_dict["entities"])
-            else:
+    batch_categories = {}
+    for x, (known, query) in tqdm(list(zip(data_entities, queries)), leave=False, desc="Classifying data entities"):
+        phrases = [entity.text for entity in x.entities]
+        llm_categories = await classifier.arun_query(query, override_cache=override_cache) if query is not None else None
+        categories = _merge_classification_result(phrases, known, query, llm_categories, classifier, phrase_memo, batch_categories)
+        if categories is None:
+            errs.append((x, llm_categories))
+            if not handle_incorrect_llm:
                 raise ValueError("The number of categories does not match the number of entities")
-        for i, entity in enumerate(x_dict["entities"]):
-            classified_entity = ClassifiedDataEntity(**{
-                "category": map_data_category_to_level(categories[i], level=DATA_CATEGORY_MAPPING_LEVEL),
-                **entity
-            })
-            classified_entities.append(classified_entity)
-        x_dict.update({"entities": classified_entities})
-        classified_data_entities.append(SWClassifiedDataEntities(**x_dict))
+            categories = _merge_classification_result(phrases, known, None, None, classifier, phrase_memo, batch_categories)
+        categories = [category if category is not None else S_DATA_CATEGORY_GENERAL for category in categories]
+        classified_entities = [
+            ClassifiedDataEntity.model_construct(text=entity.text, span=entity.span, category=map_data_category_to_level(category, level=DATA_CATEGORY_MAPPING_LEVEL))
+            for entity, category in zip(x.entities, categories)
+        ]
+        classified_data_entities.append(SWClassifiedDataEntities.model_construct(segment=x.segment, entities=classified_entities))
     return classified_data_entities, errs
 
 
@@ -143,16 +190,8 @@ async def identity_purpose_entities(pp_text: str, segments: list[str], override_
     ]
     """
 
-    def call_llm_for_segment(segment_text):
-        parsed_model_output = qh.Q_PURPOSE_ENTITY.run_query({"segment": segment_text}, override_cache=override_cache)
-        res = []
-        for entity in parsed_model_output:
-            entity_text = entity
-            start_pos = segment_text.find(entity_text)
-            end_pos = start_pos + len(entity_text)
-            span = (start_pos, end_pos)
-            res.append({"text": entity_text, "span": span})
-        return res
+    async def call_llm_for_segment(segment_text):
+        return await qh.Q_PURPOSE_ENTITY.arun_query({"segment": segment_text}, override_cache=override_cache)
 
     if batch:
         for segment in tqdm(segments, leave=False, desc="Composing batch jobs for identifying purpose entities"):
@@ -160,19 +199,26 @@ async def identity_purpose_entities(pp_text: str, segments: list[str], override_
         qh.Q_PURPOSE_ENTITY.execute_batch_queries()
         await qh.Q_PURPOSE_ENTITY.wait_and_handle_batch_queries()
 
-    res = []
+    entity_texts = []
     for segment in tqdm(segments, leave=False, desc="Identifying purpose entities"):
-        entities = call_llm_for_segment(segment)
+        entity_texts.append(await call_llm_for_segment(segment))
+    spans = resolve_spans_batch(segments, entity_texts)
+
+    res = []
+    for segment, segment_entity_texts, segment_spans in zip(segments, entity_texts, spans):
+        entities = [{"text": entity_text, "span": span} for entity_text, span in zip(segment_entity_texts, segment_spans)]
         res.append(SWPurposeEntities(**{"segment": segment, "entities": entities}))
     return res
 
 
-async def classify_purpose_categories(pp_text: str, segments: list[str], purpose_entities: list[SWPurposeEntities], override_cache: PARAM_OVERRIDE_CACHE = None, handle_incorrect_llm = True, batch: bool = False) -> list[SWClassifiedPurposeEntities]:
+async def classify_purpose_categories(pp_text: str, segments: list[str], purpose_entities: list[SWPurposeEntities], override_cache: PARAM_OVERRIDE_CACHE = None, handle_incorrect_llm = True, batch: bool = False, classifier: qh.QueryHelper | None = None, phrase_memo: PhraseClassificationMemo | None = None) -> list[SWClassifiedPurposeEntities]:
     """
     Identify the formal categories of purpose entities, as in DPV
 
     @param pp_text: privacy policy text
     @param purpose_entities: list of purpose entities, obtained from identify_purpose_entities
+    @param classifier: the query helper (or a compatible classifier, e.g. from embedding_classifier.get_classifier) to classify the entities; defaults to Q_PURPOSE_CLASSIFICATION
+    @param phrase_memo: if given, phrases classified before (in any segment) take their category from the memo, and only unseen phrases are sent to the classifier
     @return: list of purpose entities with categories, in the following form (as a list of SegmentWithClassifiedEntitiesList):
     [
         {
@@ -188,43 +234,121 @@ async def classify_purpose_categories(pp_text: str, segments: list[str], purpose
     ]
     """
 
-    def call_llm_for_data_point(data_point):
-        return qh.Q_PURPOSE_CLASSIFICATION.run_query({
-            'segment': data_point['segment'],
-            'phrases': [entity['text'] for entity in data_point['entities']]
-        }, override_cache=override_cache)
+    if classifier is None:
+        classifier = qh.Q_PURPOSE_CLASSIFICATION
+
+    queries = _compose_classification_queries(purpose_entities, phrase_memo)
 
     if batch:
-        for x in tqdm(deepcopy(purpose_entities), leave=False, desc="Composing batch jobs for classifying purpose entities"):
-            x_dict = to_dict(x)
-            qh.Q_PURPOSE_CLASSIFICATION.enqueue_batch_query({
-                'segment': x_dict['segment'],
-                'phrases': [entity['text'] for entity in x_dict['entities']]
-            }, override_cache=override_cache)
-        qh.Q_PURPOSE_CLASSIFICATION.execute_batch_queries()
-        await qh.Q_PURPOSE_CLASSIFICATION.wait_and_handle_batch_queries()
-
-    purpose_entities = deepcopy(purpose_entities)
+        for _, query in tqdm(queries, leave=False, desc="Composing batch jobs for classifying purpose entities"):
+            if query is not None:
+                classifier.enqueue_batch_query(query, override_cache=override_cache)
+        classifier.execute_batch_queries()
+        await classifier.wait_and_handle_batch_queries()
+    elif hasattr(classifier, 'prefetch'):
+        classifier.prefetch([phrase for _, query in queries if query is not None for phrase in query['phrases']])
+
     classified_purpose_entities = []
     errs = []
-    for x in tqdm(purpose_entities, leave=False, desc="Classifying purpose entities"):
-        x_dict = to_dict(obj_or_list=x)
-        categories = call_llm_for_data_point(x_dict)
-        classified_entities = []
-        if len(categories) != len(x_dict["entities"]):
-            errs.append((x, categories))
-            if handle_incorrect_llm:
-                categories = [S_PURPOSE_CATEGORY_GENERAL] * len(x_dict["entities"])
-            else:
+    batch_categories = {}
+    for x, (known, query) in tqdm(list(zip(purpose_entities, queries)), leave=False, desc="Classifying purpose entities"):
+        phrases = [entity.text for entity in x.entities]
+        llm_categories = await classifier.arun_query(query, override_cache=override_cache) if query is not None else None
+        categories = _merge_classification_result(phrases, known, query, llm_categories, classifier, phrase_memo, batch_categories)
+        if categories is None:
+            errs.append((x, llm_categories))
+            if not handle_incorrect_llm:
                 raise ValueError("The number of categories does not match the number of entities")
-        for i, entity in enumerate(x_dict["entities"]):
-            classified_entities.append(ClassifiedPurposeEntity(**{
-                "category": map_purpose_to_level(categories[i], level=PURPOSE_MAPPING_LEVEL),
-                **entity
+            categories = _merge_classification_result(phrases, known, None, None, classifier, phrase_memo, batch_categories)
+        categories = [category if category is not None else S_PURPOSE_CATEGORY_GENERAL for category in categories]
+        classified_entities = [
+            ClassifiedPurposeEntity.model_construct(text=entity.text, span=entity.span, category=map_purpose_to_level(category, level=PURPOSE_MAPPING_LEVEL))
+            for entity, category in zip(x.entities, categories)
+        ]
+        classified_purpose_entities.append(SWClassifiedPurposeEntities.model_construct(segment=x.segment, entities=classified_entities))
+    return classified_purpose_entities, errs
+
+
+async def identify_classified_data_entities(pp_text: str, segments: list[str], override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False) -> tuple[list[SWClassifiedDataEntities], list]:
+    """
+    Call LLM to obtain data entities together with their formal categories (as in DPV), in one query per segment.
+    This is the combined counterpart of identify_data_entities followed by classify_data_categories.
+
+    @param segments: list of pp segments, obtained from, e.g., convert_into_segments
+    @return: list of data entities with categories, in the same form as classify_data_categories, and the list of errors
+    """
+    errs = []
+
+    async def call_llm_for_segment(segment_text):
+        return await qh.Q_DATA_ENTITY_WITH_CATEGORY.arun_query({"segment": segment_text}, override_cache=override_cache, batch=batch)
+
+    if batch:
+        for segment in tqdm(segments, leave=False, desc="Composing batch jobs for identifying classified data entities"):
+            qh.Q_DATA_ENTITY_WITH_CATEGORY.enqueue_batch_query({"segment": segment}, override_cache=override_cache)
+        qh.Q_DATA_ENTITY_WITH_CATEGORY.execute_batch_queries()
+        await qh.Q_DATA_ENTITY_WITH_CATEGORY.wait_and_handle_batch_queries()
+
+    parsed_model_outputs = []
+    for segment in tqdm(segments, leave=False, desc="Identifying classified data entities"):
+        parsed_model_outputs.append(await call_llm_for_segment(segment))
+    spans = resolve_spans_batch(segments, [[entity["text"] for entity in output] for output in parsed_model_outputs])
+
+    res = []
+    for segment, parsed_model_output, segment_spans in zip(segments, parsed_model_outputs, spans):
+        entities = []
+        for entity, span in zip(parsed_model_output, segment_spans):
+            category = entity["category"]
+            if not category:
+                errs.append((segment, entity))
+                category = S_DATA_CATEGORY_GENERAL
+            entities.append(ClassifiedDataEntity(**{
+                "text": entity["text"],
+                "span": span,
+                "category": map_data_category_to_level(category, level=DATA_CATEGORY_MAPPING_LEVEL),
             }))
-        classified_purpose_entities.append(SWClassifiedPurposeEntities(**{"segment": x_dict["segment"], "entities": classified_entities}))
+        res.append(SWClassifiedDataEntities(**{"segment": segment, "entities": entities}))
+    return res, errs
 
-    return classified_purpose_entities, errs
+
+async def identify_classified_purpose_entities(pp_text: str, segments: list[str], override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False) -> tuple[list[SWClassifiedPurposeEntities], list]:
+    """
+    Call LLM to obtain purpose entities together with their formal categories (as in DPV), in one query per segment.
+    This is the combined counterpart of identity_purpose_entities followed by classify_purpose_categories.
+
+    @param segments: list of pp segments, obtained from, e.g., convert_into_segments
+    @return: list of purpose entities with categories, in the same form as classify_purpose_categories, and the list of errors
+    """
+    errs = []
+
+    async def call_llm_for_segment(segment_text):
+        return await qh.Q_PURPOSE_ENTITY_WITH_CATEGORY.arun_query({"segment": segment_text}, override_cache=override_cache, batch=batch)
+
+    if batch:
+        for segment in tqdm(segments, leave=False, desc="Composing batch jobs for identifying classified purpose entities"):
+            qh.Q_PURPOSE_ENTITY_WITH_CATEGORY.enqueue_batch_query({"segment": segment}, override_cache=override_cache)
+        qh.Q_PURPOSE_ENTITY_WITH_CATEGORY.execute_batch_queries()
+        await qh.Q_PURPOSE_ENTITY_WITH_CATEGORY.wait_and_handle_batch_queries()
+
+    parsed_model_outputs = []
+    for segment in tqdm(segments, leave=False, desc="Identifying classified purpose entities"):
+        parsed_model_outputs.append(await call_llm_for_segment(segment))
+    spans = resolve_spans_batch(segments, [[entity["text"] for entity in output] for output in parsed_model_outputs])
+
+    res = []
+    for segment, parsed_model_output, segment_spans in zip(segments, parsed_model_outputs, spans):
+        entities = []
+        for entity, span in zip(parsed_model_output, segment_spans):
+            category = entity["category"]
+            if not category:
+                errs.append((segment, entity))
+                category = S_PURPOSE_CATEGORY_GENERAL
+            entities.append(ClassifiedPurposeEntity(**{
+                "text": entity["text"],
+                "span": span,
+                "category": map_purpose_to_level(category, level=PURPOSE_MAPPING_LEVEL),
+            }))
+        res.append(SWClassifiedPurposeEntities(**{"segment": segment, "entities": entities}))
+    return res, errs
 
 
 async def identify_parties(pp_text: str, segments: list[str], override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False) -> list[SWPartyEntities]:
@@ -246,8 +370,8 @@ async def identify_parties(pp_text: str, segments: list[str], override_cache: PA
         }
     ]
     """
-    def call_llm_for_segment(segment_text):
-        ret = qh.Q_PARTY_RECOGNITION.run_query({"segment": segment_text}, override_cache=override_cache)
+    async def call_llm_for_segment(segment_text):
+        ret = await qh.Q_PARTY_RECOGNITION.arun_query({"segment": segment_text}, override_cache=override_cache)
         if not ret:
             ret = []
         return ret
@@ -260,7 +384,7 @@ async def identify_parties(pp_text: str, segments: list[str], override_cache: PA
 
     res = []
     for segment in tqdm(segments, leave=False, desc="Identifying parties"):
-        entities = call_llm_for_segment(segment)
+        entities = await call_llm_for_segment(segment)
         res.append(SWPartyEntities(**{"segment": segment, "entities": entities}))
     return res
 
@@ -294,19 +418,8 @@ async def identify_data_practices(pp_text: str, segments: list[str], override_ca
         }
     ]
     """
-    def call_llm_for_segment(segment_text):
-        parsed_model_output = qh.Q_ACTION_RECOGNITION.run_query({"segment": segment_text}, override_cache=override_cache)
-        res = []
-        for segment_action in parsed_model_output:
-            practice = {
-                "type": segment_action["action_type"],
-                "text": segment_action["text"],
-            }
-            start_pos = segment_text.find(segment_action["text"])
-            end_pos = start_pos + len(segment_action["text"])
-            practice["span"] = (start_pos, end_pos)
-            res.append(practice)
-        return res
+    async def call_llm_for_segment(segment_text):
+        return await qh.Q_ACTION_RECOGNITION.arun_query({"segment": segment_text}, override_cache=override_cache)
 
     if batch:
         for segment in tqdm(segments, leave=False, desc="Composing batch jobs for identifying data practices"):
@@ -314,18 +427,30 @@ async def identify_data_practices(pp_text: str, segments: list[str], override_ca
         qh.Q_ACTION_RECOGNITION.execute_batch_queries()
         await qh.Q_ACTION_RECOGNITION.wait_and_handle_batch_queries()
 
-    res = []
+    parsed_model_outputs = []
     for segment in tqdm(segments, leave=False, desc="Identifying data practices"):
-        practices = call_llm_for_segment(segment)
+        parsed_model_outputs.append(await call_llm_for_segment(segment))
+    spans = resolve_spans_batch(segments, [[segment_action["text"] for segment_action in output] for output in parsed_model_outputs])
+
+    res = []
+    for segment, parsed_model_output, segment_spans in zip(segments, parsed_model_outputs, spans):
+        practices = [{
+            "type": segment_action["action_type"],
+            "text": segment_action["text"],
+            "span": span,
+        } for segment_action, span in zip(parsed_model_output, segment_spans)]
         res.append(SWDataPractices(**{"segment": segment, "practices": practices}))
     return res
 
 
-async def identify_relations(relation_query, override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False) -> list[Relation]:
+async def identify_relations(relation_query, override_cache: PARAM_OVERRIDE_CACHE = None, batch: bool = False, max_query_tokens: int | None = RELATION_QUERY_MAX_TOKENS) -> list[Relation]:
     """
     Identify relations between data practice actions and entities in the privacy policy, through LLM
+    A query whose estimated size exceeds max_query_tokens is split into sub-queries (see split_relation_query), which are sent concurrently and whose relations are merged, with the IDs mapped back to the original ones.
+    If the LLM output of a (sub-)query cannot be parsed (e.g. the LLM answers "I can't analyze, due to too long..."), the (sub-)query is halved and retried, up to RELATION_QUERY_MAX_SPLIT_DEPTH times; a (sub-)query that cannot be split any further, or is already halved that many times, is recorded as an error and skipped.
 
     @param relation_query: a query data for the LLM, which are elements from convert_grouped_practices_to_query_data
+    @param max_query_tokens: the bound of the estimated number of tokens of each query sent to the LLM; None to never split queries in advance
     @return: list of identified relations, in the following form (as a list of Relation):
     [
         {
@@ -337,33 +462,64 @@ async def identify_relations(relation_query, override_cache: PARAM_OVERRIDE_CACH
     """
     errors = []
 
-    def call_llm_for_segment(relation_query):
-        parsed_relations = []
-        relations = qh.Q_RELATION_RECOGNITION.run_query(relation_query, override_cache=override_cache)
-        for relation in relations:
-            try:
-                parsed_relations.append(Relation(**relation))
-            except Exception as e:
-                # The only currently identified cause of is when the relation_query is too long (but not exceeding context window limit), and the LLM returns something like "I can't analyze, due to too long..."
-                # Only happens a handful of times, so logging and skipping them for now
-                # This may need to be better handled in the future
+    def get_sub_queries(relation_query) -> list[tuple[dict, dict[str, str] | None]]:
+        # A query within the bound is sent as is (keeping it identical to the unsplit query); sub-queries are renumbered
+        sub_queries = split_relation_query(relation_query, max_query_tokens) if max_query_tokens is not None else [relation_query]
+        if len(sub_queries) == 1:
+            return [(relation_query, None)]
+        return [renumber_relation_query(sub_query) for sub_query in sub_queries]
+
+    def merge_relations(relations_list: list[list[Relation]]) -> list[Relation]:
+        return list(dict.fromkeys(relation for relations in relations_list for relation in relations))
+
+    async def call_llm_for_query(relation_query, id_map, depth: int = 0):
+        relations = await qh.Q_RELATION_RECOGNITION.arun_query(relation_query, override_cache=override_cache)
+        try:
+            parsed_relations = [Relation(**relation) for relation in relations]
+        except Exception as e:
+            # The only currently identified cause of is when the relation_query is too long (but not exceeding context window limit), and the LLM returns something like "I can't analyze, due to too long..."
+            # So retry with the halves of the query, and only log and skip it when it cannot be split any further (or is split too many times already, as the failure may not be due to the length)
+            halves = halve_relation_query(relation_query) if depth < RELATION_QUERY_MAX_SPLIT_DEPTH else []
+            if not halves:
                 errors.append((e, relations, relation_query))
                 return []
+            parsed_relations = merge_relations(await asyncio.gather(*(
+                call_llm_for_query(*renumber_relation_query(half), depth=depth + 1) for half in halves
+            )))
+        if id_map is not None:
+            remapped_relations = []
+            for relation in parsed_relations:
+                # An ID not in the sub-query would otherwise be mistaken for an ID of the original query
+                if relation.action_id not in id_map or relation.entity_id not in id_map:
+                    errors.append((ValueError(f"Unknown ID in relation {relation}"), parsed_relations, relation_query))
+                    continue
+                remapped_relations.append(relation.model_copy(update={
+                    "action_id": id_map[relation.action_id],
+                    "entity_id": id_map[relation.entity_id],
+                }))
+            parsed_relations = remapped_relations
         return parsed_relations
 
+    async def call_llm_for_segment(relation_query):
+        sub_queries = get_sub_queries(relation_query)
+        return merge_relations(await asyncio.gather(*(
+            call_llm_for_query(sub_query, id_map) for sub_query, id_map in sub_queries
+        )))
+
     is_list = isinstance(relation_query, list)
     if not is_list:
         relation_query = [relation_query]
 
     if batch:
         for i_relation_query in tqdm(relation_query, leave=False, desc="Composing batch jobs for identifying relations"):
-            qh.Q_RELATION_RECOGNITION.enqueue_batch_query(i_relation_query, override_cache=override_cache)
+            for sub_query, _ in get_sub_queries(i_relation_query):
+                qh.Q_RELATION_RECOGNITION.enqueue_batch_query(sub_query, override_cache=override_cache)
         qh.Q_RELATION_RECOGNITION.execute_batch_queries()
         await qh.Q_RELATION_RECOGNITION.wait_and_handle_batch_queries()
 
     res = []
     for i_relation_query in tqdm(relation_query, leave=False, desc="Identifying relations"):
-        ret = call_llm_for_segment(i_relation_query)
+        ret = await call_llm_for_segment(i_relation_query)
         res.append(ret)
 
     if not is_list:
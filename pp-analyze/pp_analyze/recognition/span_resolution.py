@@ -0,0 +1,181 @@
+'''
+Resolution of the spans of strings returned by the LLM (entities, practices) in their segments.
+
+All strings returned for a segment are located in one pass over the segment with an Aho-Corasick automaton; for a whole stage (`resolve_spans_batch`), one automaton is built over the strings of all segments.
+Repeated mentions of the same string are mapped to its occurrences in order (the k-th mention to the k-th occurrence), which matches the order the LLM is asked to return them in.
+Strings that do not occur verbatim (e.g. different case or whitespace, or slightly paraphrased output) are aligned to the segment fuzzily; unresolved strings get the span UNRESOLVED_SPAN.
+'''
+
+from collections import deque
+from difflib import SequenceMatcher
+import re
+
+
+UNRESOLVED_SPAN = (-1, -1)
+
+# Minimum similarity between a string and the span of the segment it is aligned to, for a fuzzy match
+FUZZY_MATCH_THRESHOLD = 0.9
+
+
+class AhoCorasick:
+    '''
+    Aho-Corasick automaton over a fixed set of patterns, finding all (possibly overlapping) occurrences of all patterns in one pass over the text.
+    '''
+
+    def __init__(self, patterns: list[str]):
+        self.patterns = patterns
+        self._goto: list[dict[str, int]] = [{}]
+        self._fail: list[int] = [0]
+        self._output: list[list[int]] = [[]]
+        for i, pattern in enumerate(patterns):
+            self._add(pattern, i)
+        self._build_failure_links()
+
+    def _add(self, pattern: str, index: int):
+        state = 0
+        for c in pattern:
+            next_state = self._goto[state].get(c)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][c] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append(index)
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and c not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(c, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+
+    def find_occurrences(self, text: str) -> dict[int, list[int]]:
+        '''
+        Find all occurrences of the patterns in the text.
+        Returns the sorted list of start positions of the occurrences of each pattern occurring in the text, by the index of the pattern.
+        '''
+        res: dict[int, list[int]] = {}
+        state = 0
+        for pos, c in enumerate(text):
+            while state and c not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(c, 0)
+            for index in self._output[state]:
+                res.setdefault(index, []).append(pos - len(self.patterns[index]) + 1)
+        return res
+
+    def find_all(self, text: str) -> list[list[int]]:
+        '''
+        Find all occurrences of the patterns in the text.
+        Returns, for each pattern (in the same order as the patterns), the sorted list of start positions of its occurrences.
+        '''
+        occurrences = self.find_occurrences(text)
+        return [occurrences.get(index, []) for index in range(len(self.patterns))]
+
+
+def _find_loosely(segment: str, string: str) -> tuple[int, int] | None:
+    '''
+    Find the first occurrence of the string in the segment, ignoring case and differences in whitespace.
+    '''
+    tokens = string.split()
+    if not tokens:
+        return None
+    m = re.search(r"\s+".join(re.escape(token) for token in tokens), segment, flags=re.IGNORECASE)
+    if m is None:
+        return None
+    return (m.start(), m.end())
+
+
+def _align_fuzzily(segment: str, string: str) -> tuple[int, int] | None:
+    '''
+    Align the string to the segment with difflib, and return the span of the segment covered by the aligned characters if it is similar enough to the string.
+    '''
+    matcher = SequenceMatcher(None, segment.lower(), string.lower(), autojunk=False)
+    blocks = [block for block in matcher.get_matching_blocks() if block.size > 0]
+    if not blocks:
+        return None
+    # Only keep the blocks around the longest one, so that scattered single characters do not stretch the span
+    longest = max(blocks, key=lambda block: block.size)
+    start, end = longest.a, longest.a + longest.size
+    matched = longest.size
+    for block in blocks:
+        if block is longest:
+            continue
+        if block.a + block.size <= start and start - (block.a + block.size) <= len(string):
+            start = block.a
+            matched += block.size
+        elif block.a >= end and block.a - end <= len(string):
+            end = block.a + block.size
+            matched += block.size
+    # Similarity of the string and the span, as in SequenceMatcher.ratio
+    if 2 * matched / (len(string) + end - start) < FUZZY_MATCH_THRESHOLD:
+        return None
+    return (start, end)
+
+
+def _get_patterns(strings: list[str]) -> list[str]:
+    return list(dict.fromkeys(string for string in strings if string))
+
+
+def _find_occurrences(automaton: AhoCorasick, segment: str) -> dict[str, list[int]]:
+    return {automaton.patterns[index]: starts for index, starts in automaton.find_occurrences(segment).items()}
+
+
+def resolve_spans(segment: str, strings: list[str]) -> list[tuple[int, int]]:
+    '''
+    Resolve the spans of the strings (in the order returned by the LLM) in the segment.
+
+    @param segment: the segment text
+    @param strings: the strings returned for the segment, possibly with repetitions
+    @return: the span (START, END) of each string, in the same order; UNRESOLVED_SPAN if the string cannot be located
+    '''
+    patterns = _get_patterns(strings)
+    occurrences = _find_occurrences(AhoCorasick(patterns), segment) if patterns else {}
+    return _resolve_spans_with_occurrences(segment, strings, occurrences)
+
+
+def _resolve_spans_with_occurrences(segment: str, strings: list[str], occurrences: dict[str, list[int]]) -> list[tuple[int, int]]:
+    '''
+    Resolve the spans of the strings in the segment, given the exact occurrences (start positions) of (at least) the strings in the segment.
+    '''
+    num_mentions: dict[str, int] = {}
+    res = []
+    for string in strings:
+        starts = occurrences.get(string)
+        if starts:
+            k = num_mentions.get(string, 0)
+            num_mentions[string] = k + 1
+            # More mentions than occurrences: the LLM repeated the string, so point to the first occurrence
+            start = starts[k] if k < len(starts) else starts[0]
+            res.append((start, start + len(string)))
+            continue
+        span = None
+        if string:
+            span = _find_loosely(segment, string) or _align_fuzzily(segment, string)
+        res.append(span or UNRESOLVED_SPAN)
+    return res
+
+
+def resolve_spans_batch(segments: list[str], strings_per_segment: list[list[str]]) -> list[list[tuple[int, int]]]:
+    '''
+    Resolve the spans of the strings returned for each segment of a stage, see `resolve_spans`.
+    A single automaton is built over the strings of all segments, and each segment is scanned once.
+
+    @param segments: the segment texts
+    @param strings_per_segment: for each segment, the strings returned for it
+    @return: for each segment, the spans of its strings
+    '''
+    patterns = _get_patterns([string for strings in strings_per_segment for string in strings])
+    automaton = AhoCorasick(patterns) if patterns else None
+    res = []
+    for segment, strings in zip(segments, strings_per_segment):
+        occurrences = _find_occurrences(automaton, segment) if automaton is not None and strings else {}
+        res.append(_resolve_spans_with_occurrences(segment, strings, occurrences))
+    return res
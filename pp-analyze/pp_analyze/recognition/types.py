@@ -8,6 +8,31 @@ class QueryCategory(Enum):
     PARTY_RECOGNITION = "party_recognition"
     DATA_PRACTICE = "data_practice_action"
     RELATION_RECOGNITION = "relation_recognition"
+    DATA_ENTITY_WITH_CATEGORY = "data_entity_with_category"
+    PURPOSE_ENTITY_WITH_CATEGORY = "purpose_entity_with_category"
+
+
+class ClassifierBackend(Enum):
+    '''
+    Backend for classifying data and purpose entities into categories:
+    - LLM: the (fine-tuned) LLM classifiers
+    - EMBEDDING: local nearest-neighbour classification of phrase embeddings, falling back to the LLM for low-confidence phrases
+    '''
+    LLM = "llm"
+    EMBEDDING = "embedding"
+
+
+class EntityAttachment(Enum):
+    '''
+    Which data and purpose entities of a segment are attached to each data practice of the segment (and thus offered to the LLM when identifying relations):
+    - ALL: all entities of the segment
+    - OVERLAP: entities whose span overlaps the span of the practice
+    - NEARBY: entities within a window (in characters) around the span of the practice
+    Parties (which have no span), and entities or practices whose span could not be resolved, are attached regardless.
+    '''
+    ALL = "all"
+    OVERLAP = "overlap"
+    NEARBY = "nearby"
 
 
 T_OVERRIDE_CACHE = set[QueryCategory]
@@ -0,0 +1,145 @@
+'''
+Scheduler of many concurrent jobs (e.g. reasoning jobs of personas × websites), as one flat queue with a bounded number of workers.
+
+- The default number of workers is sized from the machine (see `default_concurrency`): at most one per available CPU core, and no more than the available memory allows for the per-worker memory (REASONER_MEMORY_PER_WORKER_MB, 1024 by default).
+- Jobs are grouped (e.g. by persona), and taken from the groups in turn, so that all groups progress evenly.
+- The run can be stopped with `JobScheduler.cancel`, in which case the results of the finished jobs are still returned. If the task running it is cancelled, the running jobs are cancelled and the cancellation propagates; the results of the finished jobs are still kept in `JobScheduler.results`.
+'''
+
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+from dotenv import load_dotenv
+from itertools import zip_longest
+import logging
+import os
+
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+REASONER_MEMORY_PER_WORKER_MB = int(os.getenv("REASONER_MEMORY_PER_WORKER_MB", "1024"))
+
+_SENTINEL = object()
+
+
+def _available_cpus() -> int:
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _available_memory() -> int | None:
+    '''
+    Available memory in bytes, or None if it cannot be told.
+    '''
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+def default_concurrency(memory_per_worker_mb: int = REASONER_MEMORY_PER_WORKER_MB) -> int:
+    '''
+    The number of workers the machine can run: the number of available CPU cores, capped by the available memory divided by the memory of a worker.
+    '''
+    concurrency = _available_cpus()
+    memory = _available_memory()
+    if memory is not None and memory_per_worker_mb > 0:
+        concurrency = min(concurrency, memory // (memory_per_worker_mb * 1024 * 1024))
+    return max(1, concurrency)
+
+
+def fair_order(jobs: list[tuple[Hashable, Hashable, Callable[[], Awaitable]]]) -> list[tuple[Hashable, Hashable, Callable[[], Awaitable]]]:
+    '''
+    Order the jobs by taking one job of each group in turn (keeping the order within a group).
+    '''
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job[0], []).append(job)
+    return [job for jobs_of_round in zip_longest(*groups.values(), fillvalue=_SENTINEL) for job in jobs_of_round if job is not _SENTINEL]
+
+
+class JobScheduler:
+    '''
+    Usage:
+    scheduler = JobScheduler(on_progress=lambda done, total, key: ...)
+    results, errors = await scheduler.run([(GROUP, KEY, lambda: coroutine()), ...])
+
+    The results (and errors) of finished jobs are also kept in `scheduler.results` (and `scheduler.errors`), so they are available even if the task running it is cancelled.
+    '''
+
+    def __init__(self, max_concurrency: int | None = None, on_progress: Callable[[int, int, Hashable], None] | None = None):
+        '''
+        @param max_concurrency: the maximum number of jobs running at the same time; see `default_concurrency` if None
+        @param on_progress: called after each job finishes, with the number of finished jobs, the total number of jobs, and the key of the job
+        '''
+        self.max_concurrency = max_concurrency or default_concurrency()
+        self.on_progress = on_progress
+        self.results: dict[Hashable, object] = {}
+        self.errors: dict[Hashable, BaseException] = {}
+        self.interrupted = False
+        self._cancelled = asyncio.Event()
+
+    def cancel(self):
+        '''
+        Stop the run: no new job is started, and the running jobs are cancelled.
+        '''
+        self._cancelled.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    async def run(self, jobs: list[tuple[Hashable, Hashable, Callable[[], Awaitable]]]) -> tuple[dict[Hashable, object], dict[Hashable, BaseException]]:
+        '''
+        Run the jobs, in fair order (see `fair_order`).
+
+        @param jobs: the (group, key, job) of each job, where the job is a function returning an awaitable
+        @return: the results of the finished jobs, and the exceptions of the failed jobs, by key
+        @raise asyncio.CancelledError: if the task running it is cancelled, after the running jobs are cancelled; `interrupted`, `results` and `errors` are set as for `cancel`
+        '''
+        queue = asyncio.Queue()
+        for job in fair_order(jobs):
+            queue.put_nowait(job)
+        total = len(jobs)
+
+        async def worker():
+            while not self.cancelled:
+                try:
+                    _, key, job = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    self.results[key] = await job()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Job {key} failed: {e!r}")
+                    self.errors[key] = e
+                if self.on_progress is not None:
+                    self.on_progress(len(self.results) + len(self.errors), total, key)
+
+        async def watch_cancellation():
+            await self._cancelled.wait()
+
+        workers = asyncio.gather(*(worker() for _ in range(min(self.max_concurrency, total))))
+        watcher = asyncio.create_task(watch_cancellation())
+        try:
+            await asyncio.wait([workers, watcher], return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            self._cancelled.set()
+            raise
+        finally:
+            workers.cancel()
+            watcher.cancel()
+            await asyncio.gather(workers, watcher, return_exceptions=True)
+            self.interrupted = self.cancelled and len(self.results) + len(self.errors) < total
+        return self.results, self.errors
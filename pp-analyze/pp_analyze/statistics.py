@@ -13,6 +13,7 @@ from .data_model import (
     Duration,
     SecurityThreat,
     ProtectionMethod,
+    model_class_of,
 )
 from . import hierarchy_helper as hh
 
@@ -46,7 +47,7 @@ def calc_practice_field_count(segmented_practices: list[SegmentedDataPractice]):
 
     for segmented_practice in segmented_practices:
         for practice in segmented_practice.practices:
-            tgt = field_count[practice.__class__]
+            tgt = field_count[model_class_of(practice)]
             for field in fields:
                 if hasattr(practice, field):
                     tgt[field].append(len(getattr(practice, field, [])))
@@ -94,8 +95,8 @@ def calc_practice_entity_count(segmented_practices: list[SegmentedDataPractice])
                     field_v = getattr(practice, field)
                     if isinstance(field_v, list):
                         for entity in getattr(practice, field):
-                            internal_count = entity_count[entity.__class__]
-                            if isinstance(entity, (DataEntity, PurposeEntity, PartyEntity)):
+                            internal_count = entity_count[model_class_of(entity)]
+                            if issubclass(model_class_of(entity), (DataEntity, PurposeEntity, PartyEntity)):
                                 internal_count[entity.category] += 1
                             else:
                                 internal_count[entity.text] += 1
@@ -114,10 +115,10 @@ def calc_data_and_purpose_entity_count_with_hierarchy(segmented_practices: list[
                     field_v = getattr(practice, field)
                     if isinstance(field_v, list):
                         for entity in field_v:
-                            if isinstance(entity, (DataEntity)):
+                            if issubclass(model_class_of(entity), DataEntity):
                                 path = hh.get_path_to_data_category(entity.category)
                                 entity_path_list[DataEntity].append(path)
-                            elif isinstance(entity, (PurposeEntity)):
+                            elif issubclass(model_class_of(entity), PurposeEntity):
                                 path = hh.get_path_to_purpose(entity.category)
                                 entity_path_list[PurposeEntity].append(path)
     node_with_count = {}
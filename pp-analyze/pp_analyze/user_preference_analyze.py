@@ -1,6 +1,8 @@
 import asyncio
 from asyncio import subprocess
 from asyncio.subprocess import PIPE
+from collections import OrderedDict
+from collections.abc import Iterator
 from datetime import datetime
 from dotenv import load_dotenv
 import json
@@ -11,6 +13,8 @@ import tempfile
 from .pp_analyze import bulk_analyze_pp, analyze_pp_from_website_name
 from . import kg, dtou
 from .dtou import NS_DTOU, NS_EX
+from .reasoner import EyeReasonerPool, get_reasoner_exec, run_process
+from .reasoning_cache import get_reasoning_cache, get_reasoning_key, get_rule_set_version
 from .utils import dict_equal, dict_hash
 
 
@@ -19,15 +23,11 @@ load_dotenv()
 
 _DTOU_LANG_DIR = Path(os.getenv("DTOU_LANG_DIR")) if os.getenv("DTOU_LANG_DIR") else (Path(os.path.realpath(__file__)).parent.parent / 'third_party' / 'dtou-lang')
 
-_CACHE_DIR_NAME = 'eye-result-cache'
-cache_dir = os.getenv("QUERY_CACHE_DIR")
-cache_dir_path = Path(cache_dir) / _CACHE_DIR_NAME if cache_dir else None
-if cache_dir_path and not cache_dir_path.exists():
-    cache_dir_path.mkdir(parents=True)
-
-
 A = RDF.type
 
+# Variant of the reasoning cache keys of the (conflicts only) results of `run_batched_reasoning`
+BATCHED_REASONING_VARIANT = 'batched-conflicts'
+
 
 def get_user_persona(persona_dir: str|None = None):
     if not persona_dir:
@@ -42,84 +42,78 @@ def get_user_persona(persona_dir: str|None = None):
     return res
 
 
-def convert_practices_to_app_policy(data_practices: list, app_name, first_party_name):
+_persona_cache: dict[Path, tuple[tuple, str]] = {}
+
+
+def load_user_persona(persona_dir: str|None = None) -> str:
+    '''
+    The user persona of the directory (see `get_user_persona`), as a single document.
+    Memoised: the files are only re-read when they change (by name, modification time and size).
+    '''
+    if not persona_dir:
+        if os.getenv("USER_PERSONA_DIR") is None:
+            raise ValueError("USER_PERSONA_DIR not set in .env")
+        persona_dir = os.getenv("USER_PERSONA_DIR")
+    path_persona = Path(persona_dir).absolute()
+    stats = tuple((f.name, f.stat().st_mtime_ns, f.stat().st_size) for f in sorted(path_persona.glob("*.ttl")))
+    cached = _persona_cache.get(path_persona)
+    if cached is None or cached[0] != stats:
+        cached = _persona_cache[path_persona] = (stats, '\n'.join(get_user_persona(persona_dir=str(path_persona))))
+    return cached[1]
+
+
+# Number of app policies kept by `get_app_policy`
+APP_POLICY_CACHE_SIZE = 4096
+_app_policy_cache: OrderedDict[tuple[str, ...], tuple[dtou.AppPolicy, str, URIRef]] = OrderedDict()
+
+
+def get_app_policy(data_practices: list, app_name, first_party_name) -> tuple[dtou.AppPolicy, str, URIRef]:
+    '''
+    The app policy of the data practices, its (Turtle) document and its policy node.
+    Memoised by the full content of the practices (see `kg.policy_content`), so that each website is converted and serialized once, however many personas it is checked against.
+    '''
+    key = kg.policy_content(data_practices, app_name, first_party_name)
+    if key in _app_policy_cache:
+        _app_policy_cache.move_to_end(key)
+        return _app_policy_cache[key]
     app_policy = dtou.convert_to_app_policy(data_practices, app_name, first_party_name)
     app_policy_graph = app_policy.to_rdf()
     policy_node = app_policy_graph.value(None, A, NS_DTOU['AppPolicy'])
     app_policy_turtle = app_policy_graph.serialize()
+    _app_policy_cache[key] = (app_policy, app_policy_turtle, policy_node)
+    if len(_app_policy_cache) > APP_POLICY_CACHE_SIZE:
+        _app_policy_cache.popitem(last=False)
+    return _app_policy_cache[key]
+
+
+def convert_practices_to_app_policy(data_practices: list, app_name, first_party_name):
+    _, app_policy_turtle, policy_node = get_app_policy(data_practices, app_name, first_party_name)
     return app_policy_turtle, policy_node
 
 
-def get_dummy_context(app_policy_node: URIRef):
+def get_dummy_context(app_policy_node: URIRef, node_prefix: str = ''):
+    '''
+    The usage context of the app policy for the reasoning. The node_prefix is prepended to the name of the context node and the blank node labels, as in `dtou.AppPolicy.to_rdf`.
+    '''
     g = Graph()
     g.bind('dtou', NS_DTOU)
     g.bind('ex', NS_EX)
-    g.add((NS_EX['usageContext1'], A, NS_DTOU['UsageContext']))
-    g.add((NS_EX['usageContext1'], NS_DTOU['user'], NS_EX['someone']))
+    n_context = NS_EX[f'{node_prefix}usageContext1']
+    g.add((n_context, A, NS_DTOU['UsageContext']))
+    g.add((n_context, NS_DTOU['user'], NS_EX['someone']))
     g.add((NS_EX['someone'], A, NS_DTOU['User']))
-    n_app_info = BNode()
-    g.add((NS_EX['usageContext1'], NS_DTOU['app'], n_app_info))
+    n_app_info = BNode(f'{node_prefix}appInfo')
+    g.add((n_context, NS_DTOU['app'], n_app_info))
     g.add((n_app_info, A, NS_DTOU['AppInfo']))
     g.add((n_app_info, NS_DTOU['policy'], app_policy_node))
-    g.add((NS_EX['usageContext1'], NS_DTOU['time'], Literal(datetime.now().strftime("%Y%m%d"))))
+    g.add((n_context, NS_DTOU['time'], Literal(datetime.now().strftime("%Y%m%d"))))
     return g.serialize(format='turtle')
 
-_sem_dir_creation = asyncio.Semaphore(1)
-
-async def guarantee_cache_dir(website_url: str):
-    if cache_dir_path:
-        website_cache_dir = cache_dir_path / website_url
-        if not website_cache_dir.exists():
-            async with _sem_dir_creation:
-                if not website_cache_dir.exists():
-                    website_cache_dir.mkdir(parents=True)
-
 
-def get_cache_file(cache_dir_path: Path, query_content: dict, website: str):
-    query_hash = dict_hash(query_content)
-    return cache_dir_path / website / f"{query_hash}.json"
-
-
-async def get_cached_result(cache_dir_path: Path, query_content: dict, website: str):
-    file_path = get_cache_file(cache_dir_path, query_content, website)
-    if not file_path.exists():
-        raise FileNotFoundError(f"Cache file not found: {file_path}")
-    with open(file_path, 'r') as f:
-        content = json.load(f)
-        return content['reasoning_result'], content['reasoning_errors']
-
-
-async def is_cached(cache_dir_path: Path, query_content: dict, website: str):
-    try:
-        content = await get_cached_result(cache_dir_path, query_content, website)
-        # if dict_equal(content['query_content'], query_content):
-        #     return True
-        return True
-    except FileNotFoundError:
-        pass
-    return False
-
-
-async def insert_to_cache(cache_dir_path: Path, query_content: dict, website: str, reasoning_result: str, reasoning_errors: str):
-    content = {
-        'query_content': query_content,
-        'reasoning_result': reasoning_result,
-        'reasoning_errors': reasoning_errors,
-    }
-    await guarantee_cache_dir(website)
-    with open(get_cache_file(cache_dir_path, query_content, website), 'w') as f:
-        json.dump(content, f)
-
-
-async def run_reasoning(user_persona, app_policy, app_policy_node, website_url, override_cache = False) -> tuple[str, str]:
+def get_reasoning_files() -> tuple[list[str], list[str], Path]:
     '''
-    Call external eye reasoner to perform the reasoning, and return the result (stdout) of the reasoner.
-    Internally, it uses subprocess to call the external reasoner.
+    Get the files of the reasoning: the DToU reasoner (rule) files, the additional rule files (from ADDITIONAL_REASONING_RULES), and the query file.
     '''
-
-    reasoner_exec = os.getenv("EYE_REASONER_EXEC")
-    if reasoner_exec is None:
-        reasoner_exec = "eye"
     dtou_reasoner_files = list(map(str, [
         _DTOU_LANG_DIR / 'dtou-lang-reasoning.n3',
     ]))
@@ -131,20 +125,53 @@ async def run_reasoning(user_persona, app_policy, app_policy_node, website_url,
         for f in Path(additional_rules_dir).iterdir():
             if f.is_file():
                 additional_rules.append(str(f))
+    return dtou_reasoner_files, additional_rules, query_file
+
+
+def get_reasoning_cache_key(user_persona: str, app_policy: str, variant: str | None = None) -> tuple[str, str]:
+    '''
+    The key of a reasoning job in the reasoning cache, derived from the contents of the user persona, the app policy, the rule and query files, and the reasoner version (see `reasoning_cache`).
+    @param variant: the kind of result, if not that of `run_reasoning` (see `reasoning_cache.get_reasoning_key`)
+    @return: the key, and the rule set version
+    '''
+    dtou_reasoner_files, additional_rules, query_file = get_reasoning_files()
+    rule_set_version = get_rule_set_version(dtou_reasoner_files + additional_rules, str(query_file), get_reasoner_exec())
+    return get_reasoning_key(user_persona, app_policy, rule_set_version, variant), rule_set_version
+
+
+def create_reasoner_pool(max_workers: int | None = None, use_image: bool = True) -> EyeReasonerPool:
+    '''
+    Create a reasoner pool with the DToU rules and additional rules preloaded, to be passed to `run_reasoning` (and the functions calling it).
+    '''
+    dtou_reasoner_files, additional_rules, query_file = get_reasoning_files()
+    return EyeReasonerPool(dtou_reasoner_files + additional_rules, str(query_file), max_workers=max_workers, use_image=use_image)
+
+
+async def run_reasoning(user_persona, app_policy, app_policy_node, website_url, override_cache = False, pool: EyeReasonerPool | None = None) -> tuple[str, str]:
+    '''
+    Call external eye reasoner to perform the reasoning, and return the result (stdout) of the reasoner.
+    Internally, it uses subprocess to call the external reasoner; with a pool (see `create_reasoner_pool`), the job is run by the pool instead.
+    Results are cached by the content of the inputs (user persona, app policy, reasoning rules and query, and reasoner version, see `get_reasoning_cache_key`), so they are reused across runs as long as the inputs are unchanged.
+    '''
+
+    reasoner_exec = get_reasoner_exec()
+    dtou_reasoner_files, additional_rules, query_file = get_reasoning_files()
 
     dummy_context = get_dummy_context(app_policy_node)
 
-    query_content = {
-        'user_persona': user_persona,
-        'website_url': website_url,
-        'dtou_reasoner_files': sorted(dtou_reasoner_files),
-        'additional_rules': sorted(additional_rules),
-        'query_file': str(query_file),
-    }
+    cache = get_reasoning_cache()
+    cache_key, rule_set_version = get_reasoning_cache_key(user_persona, app_policy)
+
+    if not override_cache and cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-    if not override_cache:
-        if cache_dir_path and await is_cached(cache_dir_path, query_content, website_url):
-            return await get_cached_result(cache_dir_path, query_content, website_url)
+    if pool is not None:
+        out_d, err_d = await pool.run([user_persona, app_policy, dummy_context])
+        if cache is not None:
+            cache.put(cache_key, rule_set_version, website_url, out_d, err_d)
+        return out_d, err_d
 
     with tempfile.NamedTemporaryFile('w', suffix='.ttl') as user_persona_file, tempfile.NamedTemporaryFile('w', suffix='.ttl') as app_policy_file, tempfile.NamedTemporaryFile('w', suffix='.ttl') as context_file:
         user_persona_file.write(user_persona)
@@ -153,29 +180,182 @@ async def run_reasoning(user_persona, app_policy, app_policy_node, website_url,
         app_policy_file.flush()
         context_file.write(dummy_context)
         context_file.flush()
-        p = await asyncio.create_subprocess_exec(reasoner_exec, '--quiet', '--nope', *dtou_reasoner_files, user_persona_file.name, app_policy_file.name, context_file.name, *additional_rules, '--query', query_file, stdout=PIPE, stderr=PIPE)
-        out, err = await p.communicate()
-        # p = subprocess.Popen([reasoner_exec, '--quiet', '--nope', *dtou_reasoner_files, user_persona_file.name, app_policy_file.name, context_file.name, *additional_rules, '--query', query_file], stdout=PIPE, stderr=PIPE)
-        # out, err = p.communicate()
+        out_d, err_d, _ = await run_process(reasoner_exec, '--quiet', '--nope', *dtou_reasoner_files, user_persona_file.name, app_policy_file.name, context_file.name, *additional_rules, '--query', query_file)
 
-        out_d = out.decode('utf-8')
-        err_d = err.decode('utf-8')
-
-        if cache_dir_path:
-            await insert_to_cache(cache_dir_path, query_content, website_url, out_d, err_d)
+        if cache is not None:
+            cache.put(cache_key, rule_set_version, website_url, out_d, err_d)
 
         return out_d, err_d
 
 
-async def analyze_pp_with_user_persona(website_url: str, website_name: str, data_practices: list|None = None, user_persona_dir: str|None = None, override_cache: bool = False):
-    user_persona_list = get_user_persona(persona_dir=user_persona_dir)
-    user_persona = '\n'.join(user_persona_list)
+async def analyze_pp_with_user_persona(website_url: str, website_name: str, data_practices: list|None = None, user_persona_dir: str|None = None, override_cache: bool = False, pool: EyeReasonerPool | None = None):
+    user_persona = load_user_persona(persona_dir=user_persona_dir)
     if not data_practices:
         data_practices, errs = analyze_pp_from_website_name(website_url)
     if not data_practices:
         raise ValueError(f"No data practices found for {website_url}")
     app_policy, app_policy_node = convert_practices_to_app_policy(data_practices, website_url, website_name)
-    reasoning_result, err = await run_reasoning(user_persona, app_policy, app_policy_node, website_url, override_cache=override_cache)
+    reasoning_result, err = await run_reasoning(user_persona, app_policy, app_policy_node, website_url, override_cache=override_cache, pool=pool)
     g = Graph()
     g.parse(data=reasoning_result, format='turtle')
     return g, err
+
+
+def _conflict_closure(graph: Graph, n_conflict) -> tuple[list, set]:
+    '''
+    The triples describing a conflict (from the conflict node, following blank nodes), and the named nodes they refer to.
+    '''
+    triples = []
+    named_nodes = set()
+    visited = {n_conflict}
+    pending = [n_conflict]
+    while pending:
+        node = pending.pop()
+        for p, o in graph.predicate_objects(node):
+            triples.append((node, p, o))
+            if isinstance(o, BNode):
+                if o not in visited:
+                    visited.add(o)
+                    pending.append(o)
+            elif isinstance(o, URIRef):
+                named_nodes.add(o)
+    return triples, named_nodes
+
+
+def split_conflicts_by_website(graph: Graph, website_nodes: dict[str, set[URIRef]], website_texts: dict[str, set[str]]) -> tuple[dict[str, Graph], set[str]]:
+    '''
+    Split the result of a batched reasoning run (see `run_batched_reasoning`) into the results of each website.
+    A conflict belongs to the website whose (policy or usage context) nodes it refers to; or else, to the only website whose app policy has the text of the conflict.
+
+    @param website_nodes: the nodes specific to each website
+    @param website_texts: the texts of the app policy of each website
+    @return: the result graph of each website (only websites with conflicts), and the websites which some conflict may belong to but cannot be told apart
+    '''
+    res: dict[str, Graph] = {}
+    unresolved = set()
+    for n_conflict in set(graph.subjects(A, NS_DTOU['Conflict'])):
+        triples, named_nodes = _conflict_closure(graph, n_conflict)
+        candidates = [website for website, nodes in website_nodes.items() if nodes & named_nodes]
+        if not candidates:
+            texts = {o.toPython() for _, p, o in triples if p == kg.NS['text']}
+            candidates = [website for website, website_text in website_texts.items() if website_text & texts]
+        if len(candidates) != 1:
+            unresolved.update(candidates or website_nodes.keys())
+            continue
+        website = candidates[0]
+        if website not in res:
+            res[website] = Graph()
+            res[website].namespace_manager = graph.namespace_manager
+        for triple in triples:
+            res[website].add(triple)
+    return res, unresolved
+
+
+def remove_node_prefix(graph: Graph, node_prefix: str) -> Graph:
+    '''
+    The graph with the node_prefix removed from the names of the nodes in NS_EX (as given by `dtou.AppPolicy.to_rdf` and `get_dummy_context`), so that the result does not depend on the position of the website in its batch.
+    '''
+    prefix = f'{NS_EX}{node_prefix}'
+
+    def rename(node):
+        if isinstance(node, URIRef) and node.startswith(prefix):
+            return NS_EX[node[len(prefix):]]
+        return node
+
+    res = Graph()
+    for triple in graph:
+        res.add(tuple(map(rename, triple)))
+    return res
+
+
+async def run_batched_reasoning(user_persona: str, websites: list[tuple[str, str, list]], override_cache: bool = False, pool: EyeReasonerPool | None = None, batch_size: int = 20) -> tuple[dict[str, tuple[Graph, str]], list[tuple[list[str], str]]]:
+    '''
+    Run the reasoning of one user persona against many app policies, packing up to batch_size app policies (each with its own usage context, and nodes kept apart by a prefix) into one reasoner run, which amortises loading the rules and starting the reasoner.
+    The conflicts are split back per website (see `split_conflicts_by_website`), with the nodes named as in an individual run (see `remove_node_prefix`); websites whose conflicts cannot be told apart are reasoned about individually.
+    Only the conflicts of a website are kept from a batched run, unlike the full result of `run_reasoning`, so they are cached per website under keys of their own (see `BATCHED_REASONING_VARIANT`).
+    The errors (stderr) of a batched run cannot be told apart by website, so they are returned separately from the results, and not cached; the errors of a website are only those of its own runs (from the cache, or when reasoned about individually).
+
+    @param websites: the (website URL, website name, data practices) of each website
+    @return: the result graph and the errors of the reasoner for each website, and the errors of each batched run with errors, with the websites of the batch
+    '''
+    res = {}
+    batch_errors = []
+    jobs = []
+    for website_url, website_name, data_practices in websites:
+        app_policy, app_policy_turtle, _ = get_app_policy(data_practices, website_url, website_name)
+        jobs.append((website_url, app_policy, app_policy_turtle, get_reasoning_cache_key(user_persona, app_policy_turtle, BATCHED_REASONING_VARIANT)))
+
+    cache = get_reasoning_cache()
+    cached = cache.get_many([cache_key for *_, (cache_key, _) in jobs]) if cache is not None and not override_cache else {}
+    pending = []
+    for job in jobs:
+        website_url, _, _, (cache_key, _) = job
+        if cache_key in cached:
+            reasoning_result, err = cached[cache_key]
+            g = Graph()
+            g.parse(data=reasoning_result, format='turtle')
+            res[website_url] = (g, err)
+        else:
+            pending.append(job)
+
+    if pending and pool is None:
+        dtou_reasoner_files, additional_rules, query_file = get_reasoning_files()
+        job_pool = EyeReasonerPool(dtou_reasoner_files + additional_rules, str(query_file), max_workers=1, use_image=False)
+    else:
+        job_pool = pool
+
+    async def run_batch(batch):
+        documents = [user_persona]
+        website_nodes = {}
+        website_texts = {}
+        for i, (website_url, app_policy, _, _) in enumerate(batch):
+            node_prefix = f"w{i}_"
+            app_policy_graph = app_policy.to_rdf(node_prefix=node_prefix)
+            app_policy_node = app_policy_graph.value(None, A, NS_DTOU['AppPolicy'])
+            documents.append(app_policy_graph.serialize())
+            documents.append(get_dummy_context(app_policy_node, node_prefix=node_prefix))
+            website_nodes[website_url] = {app_policy_node, NS_EX[f'{node_prefix}usageContext1']}
+            website_texts[website_url] = {input_spec.text for input_spec in app_policy.input_spec} | {downstream.text for input_spec in app_policy.input_spec for downstream in input_spec.downstream}
+        out, err = await job_pool.run(documents)
+        if err:
+            batch_errors.append(([website_url for website_url, *_ in batch], err))
+        g = Graph()
+        g.parse(data=out, format='turtle')
+        split, unresolved = split_conflicts_by_website(g, website_nodes, website_texts)
+        records = []
+        for i, (website_url, app_policy, app_policy_turtle, (cache_key, rule_set_version)) in enumerate(batch):
+            if website_url in unresolved:
+                app_policy_node = NS_EX['policy1']
+                reasoning_result, website_err = await run_reasoning(user_persona, app_policy_turtle, app_policy_node, website_url, override_cache=True, pool=pool)
+                website_g = Graph()
+                website_g.parse(data=reasoning_result, format='turtle')
+            else:
+                website_g = remove_node_prefix(split.get(website_url, Graph()), f"w{i}_")
+                website_err = ''
+                records.append((cache_key, rule_set_version, website_url, website_g.serialize(format='turtle'), website_err))
+            res[website_url] = (website_g, website_err)
+        if cache is not None:
+            cache.put_many(records)
+
+    try:
+        await asyncio.gather(*(run_batch(pending[i:i+batch_size]) for i in range(0, len(pending), batch_size)))
+    finally:
+        if job_pool is not pool:
+            await job_pool.close()
+    return res, batch_errors
+
+
+def generate_reasoning_jobs(personas: list[str], websites: list[tuple[str, str, list]]) -> Iterator[tuple[str, str, str, str, URIRef]]:
+    '''
+    The cross product of personas and websites, as reasoning jobs ready for `run_reasoning`.
+    Each persona is loaded and each app policy is built once (see `load_user_persona` and `get_app_policy`), before any job is produced.
+
+    @param personas: the persona directories
+    @param websites: the (website URL, website name, data practices) of each website
+    @return: the (persona directory, user persona, website URL, app policy, app policy node) of each job, by persona then by website
+    '''
+    user_personas = {persona: load_user_persona(persona_dir=persona) for persona in personas}
+    app_policies = {website_url: convert_practices_to_app_policy(data_practices, website_url, website_name) for website_url, website_name, data_practices in websites}
+    for persona, user_persona in user_personas.items():
+        for website_url, (app_policy, app_policy_node) in app_policies.items():
+            yield persona, user_persona, website_url, app_policy, app_policy_node
@@ -1,18 +1,25 @@
-import asyncio
-from asyncio import Semaphore
 from collections import defaultdict
+from collections.abc import Callable, Hashable
+from functools import partial
+import logging
 from pathlib import Path
+import pandas as pd
 from rdflib import Graph, RDF
 from tqdm.auto import tqdm
 import pp_analyze
 from pp_analyze import user_preference_analyze as upa
 from pp_analyze.data_model import DataEntity, PurposeEntity, SegmentedDataPractice
 from .dtou import NS_DTOU
+from .fingerprint import get_fingerprint_index
 from .kg import NS
-from .pp_analyze import get_relative_file_path_for_pp
+from .corpus import count_policy_segments, get_policy_version, load_policy
+from .scheduler import JobScheduler
 from . import policy_text_utils as ptu
 
 
+logger = logging.getLogger(__name__)
+
+
 def get_pesonas_under_dir(persona_base_dir) -> list[str]:
     simple_persona_dir = Path(persona_base_dir)
     personas = []
@@ -56,10 +63,15 @@ def get_number_of_conflicting_practices(graph: Graph, practices: list[SegmentedD
     return num
 
 
-async def analyze_personas(personas, practices, max_concurrency=5) -> tuple[dict[str, dict[str, Graph]], dict[str, dict[str, str]]]:
+async def analyze_personas(personas, practices, max_concurrency: int | None = None, pool: upa.EyeReasonerPool | None = None, batch_size: int | None = None, on_progress: Callable[[int, int, Hashable], None] | None = None, scheduler: JobScheduler | None = None) -> tuple[dict[str, dict[str, Graph]], dict[str, dict[str, str]]]:
     '''
     Run compliance reasoning over personas and practices.
     This function is async, for running multiple compliance reasoning tasks concurrently.
+    All (persona, website) reasoning jobs go into one queue, run by a `scheduler.JobScheduler`, taking the jobs of the personas in turn; at most max_concurrency jobs run at the same time (sized from the CPU cores and available memory if None, see `scheduler.default_concurrency`).
+    With a reasoner pool (see `user_preference_analyze.create_reasoner_pool`), the reasoning jobs are run by the pool, which should allow at least max_concurrency workers.
+    With batch_size, the app policies of up to batch_size websites are checked against a persona in one reasoner run (see `user_preference_analyze.run_batched_reasoning`); each batch is then one job. The errors of a batched run, which cannot be told apart by website, are logged rather than reported for the websites of the batch.
+    on_progress is called after each job with the number of finished jobs, the total number of jobs, and the key of the job (a progress bar is shown if None).
+    The run can be stopped with `scheduler.cancel()` (on a scheduler passed in), in which case the results of the finished jobs are returned. If the task is cancelled, the cancellation propagates; the results of the finished jobs are left in the scheduler passed in, and `collect_job_results(scheduler.results, scheduler.errors)` gives them. Failed jobs are reported in all_errors.
     Result is a tuple of two dictionaries: conflicts and all_errors.
     The conflicts dictionary has the following structure:
     {
@@ -68,108 +80,242 @@ async def analyze_personas(personas, practices, max_concurrency=5) -> tuple[dict
         }
     }
     '''
+    websites = []
+    for website_choice, website_practices in practices.items():
+        if not website_practices:
+            raise ValueError(f"No data practices found for {website_choice}")
+        websites.append((website_choice, website_choice, website_practices))
+
+    persona_dirs = []
+    for persona in personas:
+        user_persona_dir = Path(persona)
+        if not any(user_persona_dir.iterdir()):
+            print(f"Nothing in user persona at {persona}")
+            continue
+        persona_dirs.append(str(user_persona_dir.absolute()))
+
+    async def analyze_batch(user_persona, batch) -> dict[str, tuple[Graph, str]]:
+        results, batch_errors = await upa.run_batched_reasoning(user_persona, batch, pool=pool, batch_size=batch_size)
+        for batch_websites, err in batch_errors:
+            logger.warning(f"Reasoner errors in the batch of {', '.join(batch_websites)}: {err}")
+        return results
+
+    async def analyze_website(user_persona, website_choice, app_policy, app_policy_node) -> dict[str, tuple[Graph, str]]:
+        reasoning_result, err = await upa.run_reasoning(user_persona, app_policy, app_policy_node, website_choice, pool=pool)
+        res = Graph()
+        res.parse(data=reasoning_result, format='turtle')
+        return {website_choice: (res, err)}
+
+    # Jobs are (group, key, job); the group is the persona, so that the scheduler takes the jobs of the personas in turn
+    jobs = []
+    if batch_size:
+        for persona_dir in persona_dirs:
+            user_persona = upa.load_user_persona(persona_dir=persona_dir)
+            for i in range(0, len(websites), batch_size):
+                batch = websites[i:i+batch_size]
+                jobs.append((persona_dir, (persona_dir, tuple(website_choice for website_choice, _, _ in batch)), partial(analyze_batch, user_persona, batch)))
+    else:
+        # The personas are loaded once, and the app policies are built once for all personas (see `user_preference_analyze.generate_reasoning_jobs`)
+        for persona_dir, user_persona, website_choice, app_policy, app_policy_node in upa.generate_reasoning_jobs(persona_dirs, websites):
+            jobs.append((persona_dir, (persona_dir, website_choice), partial(analyze_website, user_persona, website_choice, app_policy, app_policy_node)))
+
+    progress_bar = None
+    if on_progress is None:
+        progress_bar = tqdm(total=len(jobs), desc="Analyzing personas for websites", leave=True)
+        on_progress = lambda done, total, key: progress_bar.update(1)
+    if scheduler is None:
+        scheduler = JobScheduler(max_concurrency=max_concurrency)
+    scheduler.on_progress = on_progress
+    try:
+        job_results, job_errors = await scheduler.run(jobs)
+    finally:
+        if progress_bar is not None:
+            progress_bar.close()
+    if scheduler.interrupted:
+        logger.warning(f"Interrupted: {len(job_results) + len(job_errors)} of {len(jobs)} jobs finished")
+
+    return collect_job_results(job_results, job_errors)
+
+
+def collect_job_results(job_results: dict[tuple, dict[str, tuple[Graph, str]]], job_errors: dict[tuple, BaseException]) -> tuple[dict[str, dict[str, Graph]], dict[str, dict[str, str]]]:
+    '''
+    The conflicts and all_errors (as returned by `analyze_personas`) of the results and errors of its jobs (by job key: the persona and the website, or the websites of a batch), e.g. those of a cancelled run from `scheduler.results` and `scheduler.errors`.
+    '''
     conflicts: dict[str, dict[str, Graph]] = {}
     all_errors = {}
+    for (persona_dir, _), results in job_results.items():
+        for website_choice, (res, err) in results.items():
+            if res.serialize().strip():
+                conflicts.setdefault(persona_dir, {})[website_choice] = res
+            if err:
+                all_errors.setdefault(persona_dir, {})[website_choice] = err
+    for (persona_dir, job_websites), e in job_errors.items():
+        if not isinstance(job_websites, tuple):
+            job_websites = (job_websites,)
+        for website_choice in job_websites:
+            all_errors.setdefault(persona_dir, {})[website_choice] = repr(e)
+    return conflicts, all_errors
 
-    sem_max_personas = Semaphore(3)
-    sem_max_jobs = Semaphore(max_concurrency)
 
-    async def analyze_for_persona(persona: str) -> tuple[dict[str, Graph], dict[str, str]]:
-        results: dict[str, Graph] = {}
-        errors: dict[str, str] = {}
+CONFLICT_TABLE_COLUMNS = ['persona', 'website', 'segment', 'segment_id', 'conflict']
 
-        user_persona_dir = Path(persona)
-        subs = list(user_persona_dir.iterdir())
-        if not subs:
-            print(f"Nothing in user persona at {persona}")
-            return
 
-        async def analyze_website(website_choice):
-            async with sem_max_jobs:
-                res, err = await upa.analyze_pp_with_user_persona(website_choice, website_choice, data_practices=practices[website_choice],
-                                                            user_persona_dir=str(user_persona_dir.absolute()))
-            if res.serialize().strip():
-                results[website_choice] = res
-            if err:
-                errors[website_choice] = err
-
-        c_analyze = []
-        for website_choice in practices.keys():
-            c = analyze_website(website_choice)
-            c_analyze.append(c)
-        for f in tqdm(asyncio.as_completed(c_analyze), total=len(c_analyze), desc=f"Analyzing {user_persona_dir.name}, for websites", leave=False):
-            await f
-
-        return results, errors
-
-    async def run_process_for_persona(persona):
-        async with sem_max_personas:
-            results, errors = await analyze_for_persona(persona)
-        persona_name = str(Path(persona).absolute())
-        if results:
-            conflicts[persona_name] = results
-        if errors:
-            all_errors[persona_name] = errors
-
-    c_list = []
-    for persona in personas:
-        c = run_process_for_persona(persona)
-        c_list.append(c)
-    for f in tqdm(asyncio.as_completed(c_list), total=len(c_list), desc="Looping personas for analysis", leave=True):
-        await f
+class _SegmentIds:
+    '''
+    The segment IDs (see `policy_text_utils.Policy`) of segment texts in the policies of the websites, each policy being loaded once (see `corpus.load_policy`).
+    A segment which is not in the policy of its website (e.g. from the results of another version of the policy), or of a website without a policy, gets a negative ID derived from its `policy_text_utils.segment_hash`, so that it is still told apart from other segments.
+    '''
 
-    return conflicts, all_errors
+    def __init__(self):
+        self._policies: dict[str, ptu.Policy | None] = {}
 
+    def _get_policy(self, website: str) -> ptu.Policy | None:
+        if website not in self._policies:
+            try:
+                self._policies[website] = load_policy(website)
+            except ValueError:
+                # No policy source configured
+                self._policies[website] = None
+        return self._policies[website]
 
-def to_websites_by_num_conflicts(conflicts, websites_of_interest) -> dict[int, list[str]]:
+    def get(self, website: str, segment: str) -> int:
+        policy = self._get_policy(website)
+        segment_id = policy.find_segment(segment) if policy is not None else None
+        if segment_id is None:
+            segment_id = -1 - int(ptu.segment_hash(segment), 16) % (1 << 62)
+        return segment_id
+
+
+def build_conflict_table(conflicts: dict[str, dict[str, Graph]]) -> pd.DataFrame:
     '''
-    Convert the conflicts dictionary to a dictionary of websites by number of conflicts (as key).
-    "Conflict" here means the number of conflicting personal profiles.
-    This indicates which websites have the same number of conflicts.
+    Convert the conflicts dictionary (as from `analyze_personas`) into a table, in one pass over the graphs, with one row per conflict: persona, website, segment (the text of the conflicting segment), segment_id (its ID in the policy of the website, by which segments are compared, see `_SegmentIds`) and conflict (the conflict node).
+    A (persona, website) pair whose graph has no conflict gets one row without segment and conflict, so that the table still tells which pairs have results.
+    The statistics below accept this table (as `conflict_table`), so that the graphs are only walked once.
     '''
-    num_persona_conflicts_per_website = {}
-    for ws in websites_of_interest:
-        num_persona_conflicts_per_website[ws] = 0
+    segment_ids = _SegmentIds()
+    rows = []
     for persona, results in conflicts.items():
         for ws, res in results.items():
-            if ws in websites_of_interest:
-                num_persona_conflicts_per_website[ws] += 1
+            conflict_nodes = list(res.subjects(RDF.type, NS_DTOU['Conflict']))
+            if not conflict_nodes:
+                rows.append((persona, ws, None, None, None))
+            for node in conflict_nodes:
+                text = res.value(node, NS['text'])
+                segment = text.toPython() if text is not None else None
+                rows.append((persona, ws, segment, segment_ids.get(ws, segment) if segment is not None else None, str(node)))
+    # Built from objects, so that the IDs do not go through floats (for the rows without segment)
+    return pd.DataFrame(rows, columns=CONFLICT_TABLE_COLUMNS, dtype=object).astype({'segment_id': 'Int64'})
+
+
+def build_practice_table(practices: dict[str, list[SegmentedDataPractice]], websites=None) -> pd.DataFrame:
+    '''
+    Convert the data practices of the websites (all websites if None) into a table, with one row per (segmented) data practice: website and segment_id (as in `build_conflict_table`).
+    '''
+    websites = practices.keys() if websites is None else websites
+    segment_ids = _SegmentIds()
+    rows = [(ws, segment_ids.get(ws, practice.segment)) for ws in websites for practice in practices[ws]]
+    return pd.DataFrame.from_records(rows, columns=['website', 'segment_id']).astype({'segment_id': 'Int64'})
 
-    websites_by_conflicts = defaultdict(list)
-    for ws, num_conflicts in num_persona_conflicts_per_website.items():
-        websites_by_conflicts[num_conflicts].append(ws)
-    websites_by_conflicts = dict(websites_by_conflicts)
 
-    return websites_by_conflicts
+# Number of segments of each policy, with the version of the policy when counted (see `corpus.get_policy_version`)
+_segment_counts: dict[str, tuple[tuple[int, int], int]] = {}
 
 
-def to_personas_by_num_conflicts(conflicts, personas, websites_of_interest=None) -> dict[int, list[str]]:
+def get_segment_count_table(websites) -> pd.DataFrame:
+    '''
+    The number of segments (column `n_segments`) of the privacy policy of each website (as index).
+    The counts are cached, and only recomputed when the policy changes; with a packed policy corpus (see `corpus`), they are read from its index.
+    '''
+    websites = list(dict.fromkeys(websites))
+    counts = []
+    for ws in websites:
+        version = get_policy_version(ws)
+        if version is None:
+            raise FileNotFoundError(f"No privacy policy for {ws}")
+        cached = _segment_counts.get(ws)
+        if cached is None or cached[0] != version:
+            cached = (version, count_policy_segments(ws))
+            _segment_counts[ws] = cached
+        counts.append(cached[1])
+    return pd.DataFrame({'n_segments': counts}, index=pd.Index(websites, name='website'))
+
+
+def _get_conflict_table(conflicts, conflict_table: pd.DataFrame | None, websites_of_interest=None) -> pd.DataFrame:
+    table = conflict_table if conflict_table is not None else build_conflict_table(conflicts)
+    if websites_of_interest is not None:
+        table = table[table['website'].isin(list(websites_of_interest))]
+    return table
+
+
+def _persona_website_pairs(table: pd.DataFrame) -> pd.DataFrame:
+    return table[['persona', 'website']].drop_duplicates()
+
+
+def _distinct_conflicting_segments(table: pd.DataFrame) -> pd.DataFrame:
+    '''
+    The distinct (persona, website, segment_id) of the conflicts.
+    '''
+    return table.dropna(subset=['segment_id']).drop_duplicates(['persona', 'website', 'segment_id'])[['persona', 'website', 'segment_id']]
+
+
+def _count_by_website(series: pd.Series, websites: list[str]) -> pd.Series:
+    return series.reindex(websites, fill_value=0).astype(int)
+
+
+def get_conflict_counts(conflict_table: pd.DataFrame, practices: dict[str, list[SegmentedDataPractice]] | None = None) -> pd.DataFrame:
+    '''
+    The number of conflicts (`n_conflicts`, as `get_number_of_conflicts`) and of conflicting segments (`n_conflicting_segments`, as `get_number_of_conflicting_segments`) of each (persona, website) of the conflict table (see `build_conflict_table`).
+    With practices, also the number of conflicting practices (`n_conflicting_practices`, as `get_number_of_conflicting_practices`).
+    '''
+    keys = ['persona', 'website']
+    res = pd.DataFrame(index=pd.MultiIndex.from_frame(_persona_website_pairs(conflict_table)))
+    res['n_conflicts'] = conflict_table.groupby(keys)['conflict'].count()
+    segments = _distinct_conflicting_segments(conflict_table)
+    res['n_conflicting_segments'] = segments.groupby(keys).size()
+    if practices is not None:
+        practice_table = build_practice_table(practices, conflict_table['website'].unique())
+        res['n_conflicting_practices'] = segments.merge(practice_table, on=['website', 'segment_id']).groupby(keys).size()
+    return res.fillna(0).astype(int)
+
+
+def to_websites_by_num_conflicts(conflicts, websites_of_interest, conflict_table: pd.DataFrame | None = None) -> dict[int, list[str]]:
+    '''
+    Convert the conflicts dictionary to a dictionary of websites by number of conflicts (as key).
+    "Conflict" here means the number of conflicting personal profiles.
+    This indicates which websites have the same number of conflicts.
+    The conflict table (see `build_conflict_table`) is built from conflicts if not given.
+    '''
+    websites = list(dict.fromkeys(websites_of_interest))
+    table = _get_conflict_table(conflicts, conflict_table, websites)
+    num_persona_conflicts_per_website = _count_by_website(_persona_website_pairs(table)['website'].value_counts(), websites)
+    groups = num_persona_conflicts_per_website.groupby(num_persona_conflicts_per_website, sort=False).groups
+    return {int(num_conflicts): list(ws_list) for num_conflicts, ws_list in groups.items()}
+
+
+def to_personas_by_num_conflicts(conflicts, personas, websites_of_interest=None, conflict_table: pd.DataFrame | None = None) -> dict[int, list[str]]:
     '''
     Convert the conflicts dictionary to a dictionary of personas by number of conflicts (as key).
     "Conflict" here means the number of conflicting personal profiles.
     This indicates which persona has the same number of conflicting websites.
+    The conflict table (see `build_conflict_table`) is built from conflicts if not given.
     '''
-    num_conflicts_per_persona = {}
-    for persona in personas:
-        num_conflicts_per_persona[persona] = 0
-    for persona, results in conflicts.items():
-        num = 0
-        for ws, res in results.items():
-            if websites_of_interest is None or ws in websites_of_interest:
-                num += 1
-        num_conflicts_per_persona[persona] = num
+    table = _get_conflict_table(conflicts, conflict_table)
+    all_personas = list(dict.fromkeys([*personas, *table['persona'].unique()]))
+    if websites_of_interest is not None:
+        table = table[table['website'].isin(list(websites_of_interest))]
+    num_conflicts_per_persona = _persona_website_pairs(table)['persona'].value_counts().reindex(all_personas, fill_value=0)
 
     personas_by_conflicts = defaultdict(list)
     for persona, num_conflicts in num_conflicts_per_persona.items():
         if isinstance(persona, Path):
             persona = persona.name
-        personas_by_conflicts[num_conflicts].append(persona)
+        personas_by_conflicts[int(num_conflicts)].append(persona)
     personas_by_conflicts = dict(personas_by_conflicts)
 
     return personas_by_conflicts
 
 
-def get_segment_conflict_info(conflicts, websites_of_interest, practices: dict[str, list[SegmentedDataPractice]]) -> dict[str, tuple[int, int, int, int]]:
+def get_segment_conflict_info(conflicts, websites_of_interest, practices: dict[str, list[SegmentedDataPractice]], conflict_table: pd.DataFrame | None = None) -> dict[str, tuple[int, int, int, int]]:
     '''
     Compute several information about the number of conflicting profiles to the number of segments.
     Returns a dictionary, key is websites, and value is a tuple of target information:
@@ -180,42 +326,27 @@ def get_segment_conflict_info(conflicts, websites_of_interest, practices: dict[s
     - Number of data practices
     - Number of segments (in privacy policy)
     - Number of conflicts
+    The conflict table (see `build_conflict_table`) is built from conflicts if not given.
     '''
-    nums_dict = defaultdict(lambda: [0, 0, 0, 0, 0, 0, 0])
-
-    for ws in websites_of_interest:
-        fp = get_relative_file_path_for_pp(ws)
-        n_segments = len(ptu.convert_into_segments(fp.read_text()))
-        nums_dict[ws][5] = n_segments
-        practice_of_website = practices[ws]
-        nums_dict[ws][4] = len(practice_of_website)
-        distinct_segments = set()
-        for practice in practice_of_website:
-            distinct_segments.add(practice.segment)
-        nums_dict[ws][3] = len(distinct_segments)
-
-    conflicting_segments_by_ws = {}
-    for persona, results in conflicts.items():
-        for ws, res in results.items():
-            if ws in websites_of_interest:
-                nums_dict[ws][0] += 1
-                n_segments_conflict = get_number_of_conflicting_segments(res)
-                nums_dict[ws][1] += n_segments_conflict
-                conflicting_segments = get_conflicting_segments(res)
-                if ws not in conflicting_segments_by_ws:
-                    conflicting_segments_by_ws[ws] = set()
-                conflicting_segments_by_ws[ws].update(conflicting_segments)
+    websites = list(dict.fromkeys(websites_of_interest))
+    table = _get_conflict_table(conflicts, conflict_table, websites)
+    segments = _distinct_conflicting_segments(table)
+    practice_table = build_practice_table(practices, websites)
 
-                number_of_conflicts = get_number_of_conflicts(res)
-                nums_dict[ws][6] += number_of_conflicts
+    info = pd.DataFrame({
+        'n_conflicting_profiles': _count_by_website(_persona_website_pairs(table)['website'].value_counts(), websites),
+        'n_conflicting_segments': _count_by_website(segments['website'].value_counts(), websites),
+        'n_distinct_conflicting_segments': _count_by_website(segments.groupby('website')['segment_id'].nunique(), websites),
+        'n_practice_segments': _count_by_website(practice_table.groupby('website')['segment_id'].nunique(), websites),
+        'n_practices': _count_by_website(practice_table['website'].value_counts(), websites),
+        'n_segments': get_segment_count_table(websites)['n_segments'],
+        'n_conflicts': _count_by_website(table.groupby('website')['conflict'].count(), websites),
+    }, index=pd.Index(websites, name='website'))
 
-    for ws, segments in conflicting_segments_by_ws.items():
-        nums_dict[ws][2] = len(segments)
+    return dict(zip(info.index, info.values.tolist()))
 
-    return dict(nums_dict)
 
-
-def calc_average_conflict_rate_by_segment_of_websites(conflicts, websites_of_interest, segment_mode: int = 0, practices: dict[str, list[SegmentedDataPractice]]|None =None) -> dict[int, list[str]]:
+def calc_average_conflict_rate_by_segment_of_websites(conflicts, websites_of_interest, segment_mode: int = 0, practices: dict[str, list[SegmentedDataPractice]]|None =None, conflict_table: pd.DataFrame | None = None) -> dict[int, list[str]]:
     '''
     Calculate the average conflict rate of each website, in terms of the number of conflicting profiles per segment.
     In other words, it is the ratio of the number of conflicting profiles to the number of segments (as the denominator).
@@ -228,68 +359,39 @@ def calc_average_conflict_rate_by_segment_of_websites(conflicts, websites_of_int
         This estimates the average number of conflicting profiles each valid segment creates.
     - 4: Same as 3, but do not count the same segment multiple times.
     - 5: Same as 0, but the numerator is 1 if there is a conflict, 0 otherwise.
+    The conflict table (see `build_conflict_table`) is built from conflicts if not given.
     '''
-    num_persona_conflicts_per_website = {}
-    for ws in websites_of_interest:
-        num_persona_conflicts_per_website[ws] = 0
-    for persona, results in conflicts.items():
-        for ws, res in results.items():
-            if ws in websites_of_interest:
-                if segment_mode == 5:
-                    num_persona_conflicts_per_website[ws] = 1
-                else:
-                    num_persona_conflicts_per_website[ws] += 1
-
-    ret = {}
-    for ws, num_conflicts in num_persona_conflicts_per_website.items():
-        if segment_mode == 0 or segment_mode == 5:
-            fp = get_relative_file_path_for_pp(ws)
-            n_segments = len(ptu.convert_into_segments(fp.read_text()))
-        elif segment_mode == 1:
-            n_segments = 0
-            for persona, results in conflicts.items():
-                if ws in results:
-                    n_segments += get_number_of_conflicting_segments(results[ws])
-        elif segment_mode == 2:
-            conflicting_segments = set()
-            for persona, results in conflicts.items():
-                if ws in results:
-                    conflicting_segments.update(get_conflicting_segments(results[ws]))
-            n_segments = len(conflicting_segments)
-        elif segment_mode == 3:
-            practice_of_website = practices[ws]
-            n_segments = 0
-            for practice in practice_of_website:
-                n_segments += 1
-        elif segment_mode == 4:
-            practice_of_website = practices[ws]
-            valid_segments = set()
-            for practice in practice_of_website:
-                valid_segments.add(practice.segment)
-            n_segments = len(valid_segments)
-        else:
-            raise ValueError("Invalid segment_mode")
-        if num_conflicts == 0:
-            ret[ws] = 0
-        else:
-            ret[ws] = num_conflicts / n_segments
-
-    return ret
-
-
-def websites_with_same_pp(website_list):
-    pp_dict = {}
-    for ws in website_list:
-        p = get_relative_file_path_for_pp(ws)
-        content = Path(p).read_text().strip()
-        content = content.split('\n', 1)[1]
-        if content in pp_dict:
-            pp_dict[content].append(ws)
-        else:
-            pp_dict[content] = [ws]
-
-    res = []
-    for pp, ws_list in pp_dict.items():
-        if len(ws_list) > 1:
-            res.append(ws_list)
-    return res
+    if segment_mode not in range(6):
+        raise ValueError("Invalid segment_mode")
+    websites = list(dict.fromkeys(websites_of_interest))
+    table = _get_conflict_table(conflicts, conflict_table, websites)
+
+    num_persona_conflicts_per_website = _count_by_website(_persona_website_pairs(table)['website'].value_counts(), websites)
+    if segment_mode == 5:
+        num_persona_conflicts_per_website = num_persona_conflicts_per_website.clip(upper=1)
+    # Only the websites with conflicts need the number of segments
+    conflicting_websites = num_persona_conflicts_per_website.index[num_persona_conflicts_per_website > 0]
+
+    if segment_mode == 0 or segment_mode == 5:
+        n_segments = get_segment_count_table(conflicting_websites)['n_segments']
+    elif segment_mode == 1:
+        n_segments = _distinct_conflicting_segments(table)['website'].value_counts()
+    elif segment_mode == 2:
+        n_segments = _distinct_conflicting_segments(table).groupby('website')['segment_id'].nunique()
+    elif segment_mode == 3:
+        n_segments = build_practice_table(practices, conflicting_websites)['website'].value_counts()
+    else:
+        n_segments = build_practice_table(practices, conflicting_websites).groupby('website')['segment_id'].nunique()
+
+    rate = num_persona_conflicts_per_website / _count_by_website(n_segments, websites)
+    rate = rate.where(num_persona_conflicts_per_website > 0, 0)
+    return rate.to_dict()
+
+
+def websites_with_same_pp(website_list, threshold: float | None = None) -> list[list[str]]:
+    '''
+    Group the websites whose privacy policies are the same (ignoring the first line of the policy files), or near duplicates of at least the threshold estimated similarity if given.
+    The policies are compared by their fingerprints (see `fingerprint.FingerprintIndex.find_duplicates`), which are only computed for new or changed policies.
+    Returns the groups of more than one website.
+    '''
+    return get_fingerprint_index().find_duplicates(list(dict.fromkeys(website_list)), threshold=threshold)
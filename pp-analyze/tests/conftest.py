@@ -0,0 +1,101 @@
+import pytest
+from pp_analyze.data_model import (
+    SegmentedDataPractice,
+    DataCollectionUse,
+    DataSharingDisclosure,
+    DataStorageRetention,
+    DataSecurityProtection,
+)
+
+
+# Small category hierarchies, in the format of `ppa_commons.get_entity_category_hierarchy`; `Email` has two parents
+DATA_CATEGORY_HIERARCHY = '''Data-general
+	Contact
+		Email
+		Phone
+	Location
+		Precise-location
+Identifier
+	Device-identifier
+	Email
+'''
+
+PURPOSE_HIERARCHY = '''Purpose-general
+	Advertising
+		Targeted-advertising
+	Service-provision
+		Personalisation
+		Security
+'''
+
+
+@pytest.fixture
+def hierarchies(tmp_path, monkeypatch):
+    '''
+    Use the small hierarchies above as the data category and purpose hierarchies.
+    '''
+    data_category_file = tmp_path / 'data_category_hierarchy.txt'
+    data_category_file.write_text(DATA_CATEGORY_HIERARCHY)
+    purpose_file = tmp_path / 'purpose_hierarchy.txt'
+    purpose_file.write_text(PURPOSE_HIERARCHY)
+    monkeypatch.setenv('DATA_CATEGORY_HIERARCHY', str(data_category_file))
+    monkeypatch.setenv('PURPOSE_CATEGORY_HIERARCHY', str(purpose_file))
+
+
+def _entity(text, category):
+    return {'text': text, 'category': category}
+
+
+def make_results() -> dict[str, list[SegmentedDataPractice]]:
+    '''
+    Analysis results of two websites (as from `bulk_analyze_pp`), covering all practice classes.
+    '''
+    return {
+        'example.com': [
+            SegmentedDataPractice(segment='We collect your email address and phone number for advertising.', practices=[
+                DataCollectionUse(**{
+                    'text': 'We collect your email address and phone number',
+                    'Data-Collector': [_entity('We', 'First-party-entity')],
+                    'Data-Provider': [_entity('you', 'User')],
+                    'Data-Collected': [_entity('email address', 'Email'), _entity('phone number', 'Phone')],
+                    'Purpose-Argument': [_entity('advertising', 'Targeted-advertising')],
+                }),
+            ]),
+            SegmentedDataPractice(segment='We share your location with partners, and keep it for a year.', practices=[
+                DataSharingDisclosure(**{
+                    'text': 'We share your location with partners',
+                    'Data-Receiver': [_entity('partners', 'Third-party-entity')],
+                    'Data-Sharer': [_entity('We', 'First-party-entity')],
+                    'Data-Shared': [_entity('location', 'Precise-location')],
+                    'Purpose-Argument': [_entity('personalise', 'Personalisation')],
+                }),
+                DataStorageRetention(**{
+                    'text': 'keep it for a year',
+                    'Data-Retained': [_entity('location', 'Precise-location')],
+                    'Storage-Place': [{'text': 'our servers'}],
+                    'Retention-Period': [{'text': 'a year'}],
+                }),
+            ]),
+            SegmentedDataPractice(segment='Nothing to see here.', practices=[]),
+        ],
+        'example.org': [
+            SegmentedDataPractice(segment='Your device ID is encrypted against attacks.', practices=[
+                DataSecurityProtection(**{
+                    'text': 'Your device ID is encrypted',
+                    'Data-Protected': [_entity('device ID', 'Device-identifier')],
+                    'protect-against': [{'text': 'attacks'}],
+                    'method': [{'text': 'encryption'}],
+                }),
+                DataCollectionUse(**{
+                    'text': 'device ID',
+                    'Data-Collected': [_entity('device ID', 'Device-identifier'), _entity('email', 'Email')],
+                    'Purpose-Argument': [_entity('security', 'Security'), _entity('ads', 'Advertising')],
+                }),
+            ]),
+        ],
+    }
+
+
+@pytest.fixture
+def results() -> dict[str, list[SegmentedDataPractice]]:
+    return make_results()
@@ -0,0 +1,53 @@
+import pytest
+from pp_analyze.archive import ResultArchive, ResultArchiveWriter, save_results, load_results
+from pp_analyze.columnar import to_columnar
+
+
+def dump(results) -> dict:
+    return {website: [segment.model_dump() for segment in segments] for website, segments in results.items()}
+
+
+def test_round_trip(tmp_path, results):
+    path = tmp_path / 'results.ppar'
+    save_results(results, path)
+    loaded = load_results(path)
+    assert list(loaded) == list(results)
+    assert loaded == results
+    assert dump(loaded) == dump(results)
+
+
+def test_load_some_websites(tmp_path, results):
+    path = tmp_path / 'results.ppar'
+    save_results(results, path)
+    assert load_results(path, ['example.org']) == {'example.org': results['example.org']}
+    with ResultArchive(path) as archive:
+        assert len(archive) == 2
+        assert 'example.com' in archive
+        assert archive['example.com'] == results['example.com']
+        assert archive.get('example.net') is None
+
+
+def test_columnar_views_are_saved_as_models(tmp_path, results):
+    path = tmp_path / 'results.ppar'
+    save_results(to_columnar(results), path)
+    assert load_results(path) == results
+
+
+def test_failed_write_keeps_old_archive(tmp_path, results):
+    path = tmp_path / 'results.ppar'
+    save_results({'example.org': results['example.org']}, path)
+    with pytest.raises(ValueError):
+        with ResultArchiveWriter(path) as writer:
+            writer.write('example.com', results['example.com'])
+            writer.write('example.com', results['example.com'])
+    assert load_results(path) == {'example.org': results['example.org']}
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_failed_first_write_leaves_no_file(tmp_path, results):
+    path = tmp_path / 'results.ppar'
+    with pytest.raises(RuntimeError):
+        with ResultArchiveWriter(path) as writer:
+            writer.write_all(results)
+            raise RuntimeError()
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,63 @@
+import pytest
+from pp_analyze import statistics
+from pp_analyze.columnar import ColumnarResultSet, to_columnar, from_columnar
+from pp_analyze.data_model import SegmentedDataPractice, DataCollectionUse, PartyEntity, model_class_of
+
+
+def test_round_trip(results):
+    store = to_columnar(results)
+    assert list(store) == list(results)
+    assert from_columnar(store) == results
+    assert {website: [segment.model_dump() for segment in segments] for website, segments in store.to_results().items()} == \
+        {website: [segment.model_dump() for segment in segments] for website, segments in results.items()}
+
+
+def test_views_read_like_models(results):
+    store = to_columnar(results)
+    for website, segments in results.items():
+        views = store[website]
+        assert len(views) == len(segments)
+        for view, segment in zip(views, segments):
+            assert model_class_of(view) is SegmentedDataPractice
+            assert view.segment == segment.segment
+            for practice_view, practice in zip(view.practices, segment.practices, strict=True):
+                assert model_class_of(practice_view) is model_class_of(practice)
+                assert practice_view.text == practice.text
+                for field in practice.model_fields:
+                    if field == 'text':
+                        continue
+                    entity_views = getattr(practice_view, field)
+                    entities = getattr(practice, field)
+                    assert [model_class_of(entity) for entity in entity_views] == [model_class_of(entity) for entity in entities]
+                    assert [entity.to_model() for entity in entity_views] == entities
+
+
+def test_statistics_on_views(hierarchies, results):
+    store = to_columnar(results)
+    for website, segments in results.items():
+        views = store[website]
+        assert statistics.calc_practice_field_count(views) == statistics.calc_practice_field_count(segments)
+        assert statistics.calc_practice_entity_count(views) == statistics.calc_practice_entity_count(segments)
+        assert statistics.calc_data_and_purpose_entity_count_with_hierarchy(views) == statistics.calc_data_and_purpose_entity_count_with_hierarchy(segments)
+
+
+def test_extend(results):
+    store = ColumnarResultSet()
+    store.extend({'example.com': results['example.com']})
+    store.extend({'example.org': results['example.org']})
+    assert store.to_results() == results
+
+
+def test_failed_extend_keeps_store(results):
+    store = to_columnar({'example.com': results['example.com']})
+    before = store.to_results()
+    with pytest.raises(ValueError):
+        store.extend({'example.org': results['example.org'], 'example.com': results['example.com']})
+    # An entity of an unknown class fails the conversion half way
+    bad_practice = DataCollectionUse.model_construct(text='bad', data_collector=[PartyEntity(text='We', category='first_party')], data_provider=[], data_collected=[object()], purpose=[])
+    with pytest.raises(KeyError):
+        store.extend({'example.org': results['example.org'], 'example.net': [SegmentedDataPractice.model_construct(segment='bad', practices=[bad_practice])]})
+    assert list(store) == ['example.com']
+    assert store.to_results() == before
+    store.extend({'example.org': results['example.org']})
+    assert store.to_results() == results
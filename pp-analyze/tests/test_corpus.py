@@ -0,0 +1,47 @@
+import hashlib
+import pytest
+from pp_analyze import policy_text_utils as ptu
+from pp_analyze.corpus import PolicyCorpus, PolicyCorpusWriter, _segment_spans
+
+
+POLICIES = {
+    'example.com': 'Privacy Policy of example.com\n\nWe collect your email.\n   We share it with partners.  \n\n\tThat is all.\n',
+    'example.org': '  Ünïcödé policy — “quoted” text  \r\nSecond line\r\n\n',
+    'example.net': '',
+    'example.edu': '\n \n\t\n',
+}
+
+
+def test_segment_spans_match_convert_into_segments():
+    for pp_text in POLICIES.values():
+        data = pp_text.encode('utf-8')
+        segments = [str(data[start:end], 'utf-8') for start, end in _segment_spans(pp_text)]
+        assert segments == ptu.convert_into_segments(pp_text)
+
+
+def test_corpus_round_trip(tmp_path):
+    path = tmp_path / 'policies.ppco'
+    with PolicyCorpusWriter(path) as writer:
+        for domain, pp_text in POLICIES.items():
+            writer.write(domain, pp_text)
+    with PolicyCorpus(path) as corpus:
+        assert corpus.keys() == list(POLICIES)
+        for domain, pp_text in POLICIES.items():
+            assert corpus[domain] == pp_text
+            assert corpus.get_digest(domain) == hashlib.sha256(pp_text.encode('utf-8')).hexdigest()
+            assert corpus.get_segments(domain) == ptu.convert_into_segments(pp_text)
+            assert corpus.get_segment_count(domain) == len(ptu.convert_into_segments(pp_text))
+        assert corpus.get('example.info') is None
+
+
+def test_failed_write_keeps_old_corpus(tmp_path):
+    path = tmp_path / 'policies.ppco'
+    with PolicyCorpusWriter(path) as writer:
+        writer.write('example.com', POLICIES['example.com'])
+    with pytest.raises(ValueError):
+        with PolicyCorpusWriter(path) as writer:
+            writer.write('example.org', POLICIES['example.org'])
+            writer.write('example.org', POLICIES['example.org'])
+    with PolicyCorpus(path) as corpus:
+        assert corpus.keys() == ['example.com']
+    assert list(tmp_path.iterdir()) == [path]
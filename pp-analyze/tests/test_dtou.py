@@ -0,0 +1,69 @@
+from pp_analyze import dtou
+from pp_analyze.data_model import SegmentedDataPractice, DataCollectionUse, DataSharingDisclosure
+
+
+def normalize(app_policy: dtou.AppPolicy):
+    '''
+    The app policy, without the order of the input specs and their lists.
+    '''
+    return app_policy.app_name, sorted(
+        (
+            input_spec.text, str(input_spec.data), input_spec.user, input_spec.action,
+            sorted(map(str, input_spec.purpose)),
+            sorted((downstream.text, downstream.user, downstream.app_name, sorted(map(str, downstream.purpose))) for downstream in input_spec.downstream),
+        )
+        for input_spec in app_policy.input_spec
+    )
+
+
+def more_practices() -> list[SegmentedDataPractice]:
+    '''
+    Collections without a collector, and data shared with several parties (in several segments).
+    '''
+    return [
+        SegmentedDataPractice(segment='Your email is collected, and shared with Acme and Foo for analytics.', practices=[
+            DataCollectionUse(**{
+                'text': 'Your email is collected',
+                'Data-Collected': [{'text': 'email', 'category': 'Email'}],
+                'Purpose-Argument': [{'text': 'analytics', 'category': 'Personalisation'}],
+            }),
+            DataSharingDisclosure(**{
+                'text': 'shared with Acme and Foo',
+                'Data-Receiver': [{'text': 'Acme', 'category': 'Third-party-entity'}, {'text': 'Foo', 'category': 'Third-party-entity'}],
+                'Data-Shared': [{'text': 'email', 'category': 'Email'}],
+                'Purpose-Argument': [{'text': 'analytics', 'category': 'Personalisation'}],
+            }),
+        ]),
+        SegmentedDataPractice(segment='Acme collects your email for ads, and we share your email with Bar.', practices=[
+            DataCollectionUse(**{
+                'text': 'Acme collects your email',
+                'Data-Collector': [{'text': 'Acme', 'category': 'Third-party-entity'}],
+                'Data-Collected': [{'text': 'email', 'category': 'Email'}],
+                'Purpose-Argument': [{'text': 'ads', 'category': 'Advertising'}],
+            }),
+            DataSharingDisclosure(**{
+                'text': 'we share your email with Bar',
+                'Data-Sharer': [{'text': 'we', 'category': 'First-party-entity'}],
+                'Data-Receiver': [{'text': 'Bar', 'category': 'Third-party-entity'}],
+                'Data-Shared': [{'text': 'email', 'category': 'Email'}],
+            }),
+            DataSharingDisclosure(**{
+                'text': 'share for security',
+                'Purpose-Argument': [{'text': 'security', 'category': 'Security'}],
+            }),
+        ]),
+    ]
+
+
+def test_matches_reference(results):
+    cases = [(website, segments) for website, segments in results.items()]
+    cases.append(('example.net', more_practices()))
+    cases.append(('example.info', results['example.com'] + more_practices()))
+    for website, segments in cases:
+        app_policy = dtou.convert_to_app_policy(segments, website, 'Example')
+        assert normalize(app_policy) == normalize(dtou.convert_to_app_policy_from_kg(segments, website, 'Example'))
+    assert app_policy.input_spec
+
+
+def test_empty():
+    assert dtou.convert_to_app_policy([], 'example.com', 'Example') == dtou.AppPolicy(app_name='example.com')
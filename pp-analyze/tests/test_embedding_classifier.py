@@ -0,0 +1,59 @@
+import asyncio
+import numpy as np
+from pp_analyze.recognition.embedding_classifier import EmbeddingClassifier
+from pp_analyze.recognition.types import QueryCategory
+
+
+VECTORS = {
+    'Email: email address': [1, 0, 0],
+    'Location: where you are': [0, 1, 0],
+    'e-mail': [0.9, 0.1, 0],
+    'gps': [0.1, 0.9, 0],
+    'stuff': [0.3, 0.3, 0.9],
+}
+
+
+class FakeEmbeddingClassifier(EmbeddingClassifier):
+    def _embed(self, texts):
+        vectors = np.array([VECTORS[text] for text in texts], dtype=np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class FakeFallback:
+    llm_model = 'fake-llm'
+
+    def __init__(self, categories):
+        self.categories = categories
+
+    def run_query(self, data, override_cache=None, batch=False):
+        return self.categories[:len(data['phrases'])]
+
+    async def arun_query(self, data, override_cache=None, batch=False):
+        return self.run_query(data, override_cache, batch)
+
+
+def make_classifier(fallback_categories):
+    return FakeEmbeddingClassifier(QueryCategory.DATA_CLASSIFICATION, {'Email': 'email address', 'Location': 'where you are'}, fallback=FakeFallback(fallback_categories))
+
+
+def test_fallback_provenance():
+    classifier = make_classifier(['Email', 'Location', 'Other'])
+    phrases = ['e-mail', 'gps', 'stuff']
+    assert asyncio.run(classifier.arun_query({'segment': 'text', 'phrases': phrases})) == ['Email', 'Location', 'Other']
+    confidences, provenances = classifier.get_confidences_and_provenances(phrases)
+    assert provenances == [classifier.llm_model, classifier.llm_model, 'fake-llm']
+    assert confidences[0] > 0.9 and confidences[2] is None
+    usage = classifier.get_usage()
+    assert (usage['queries'], usage['local_hits'], usage['fallback_phrases'], usage['fallback_queries']) == (1, 2, 1, 1)
+
+
+def test_rejected_fallback_provenance():
+    # The fallback output does not have a category for each phrase, so the local classification is kept
+    classifier = make_classifier(['Email'])
+    phrases = ['e-mail', 'stuff']
+    assert classifier.run_query({'segment': 'text', 'phrases': phrases}) == ['Email', classifier.classify_phrases(['stuff'])[0][0]]
+    confidences, provenances = classifier.get_confidences_and_provenances(phrases)
+    assert provenances == [classifier.llm_model, classifier.llm_model]
+    assert all(confidence is not None for confidence in confidences)
+    usage = classifier.get_usage()
+    assert (usage['local_hits'], usage['fallback_phrases'], usage['fallback_queries']) == (2, 0, 1)
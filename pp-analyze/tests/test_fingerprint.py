@@ -0,0 +1,114 @@
+import itertools
+import numpy as np
+import pytest
+from pp_analyze import corpus
+from pp_analyze.corpus import get_relative_file_path_for_pp
+from pp_analyze.fingerprint import FingerprintIndex, compute_fingerprint, estimate_similarity, _UnionFind, NUM_PERM, LSH_BANDS
+
+
+BASE_SEGMENTS = [f"Paragraph {i} of the policy, about how we handle your data in case {i}." for i in range(40)]
+
+POLICIES = {
+    'a.com': ['Policy of a.com'] + BASE_SEGMENTS,
+    # Same text as a.com
+    'b.com': ['Policy of b.com'] + BASE_SEGMENTS,
+    # Two of the 40 segments changed, and different whitespace and case
+    'c.com': ['Policy of c.com'] + [segment.upper() for segment in BASE_SEGMENTS[:20]] + ['Another paragraph.', 'And another one.'] + BASE_SEGMENTS[22:],
+    # Half of the segments changed
+    'd.com': ['Policy of d.com'] + BASE_SEGMENTS[:20] + [f"Something else {i}." for i in range(20)],
+    'e.com': ['Policy of e.com'] + [f"Unrelated paragraph {i}." for i in range(40)],
+    'f.com': ['Policy of f.com'] + [f"Unrelated paragraph {i}." for i in range(40)],
+}
+
+
+def baseline_clusters(policies: list[str], fingerprints: dict, threshold: float | None) -> list[list[str]]:
+    '''
+    Cluster by comparing all pairs of policies, with a union-find over dictionaries.
+    '''
+    parent = {policy: policy for policy in policies}
+
+    def find(policy):
+        while parent[policy] != policy:
+            policy = parent[policy]
+        return policy
+
+    for policy1, policy2 in itertools.combinations(policies, 2):
+        digest1, signature1 = fingerprints[policy1]
+        digest2, signature2 = fingerprints[policy2]
+        if digest1 == digest2 or (threshold is not None and estimate_similarity(signature1, signature2) >= threshold):
+            root1, root2 = find(policy1), find(policy2)
+            if root1 != root2:
+                parent[max(root1, root2, key=policies.index)] = min(root1, root2, key=policies.index)
+    clusters = {}
+    for policy in policies:
+        clusters.setdefault(find(policy), []).append(policy)
+    return [cluster for cluster in clusters.values() if len(cluster) > 1]
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    policy_dir = tmp_path / 'policies'
+    monkeypatch.setenv('PP_POLICY_DIR', str(policy_dir))
+    monkeypatch.delenv('PP_POLICY_CORPUS', raising=False)
+    monkeypatch.setattr(corpus, '_policy_corpus', None)
+    for domain, lines in POLICIES.items():
+        pp_file = get_relative_file_path_for_pp(domain)
+        pp_file.parent.mkdir(parents=True, exist_ok=True)
+        pp_file.write_text('\n'.join(lines) + '\n')
+    return FingerprintIndex(tmp_path / 'fingerprints.sqlite')
+
+
+def test_union_find():
+    uf = _UnionFind(6)
+    uf.union(4, 2)
+    uf.union(2, 5)
+    uf.union(1, 3)
+    assert [uf.find(i) for i in range(6)] == [0, 1, 2, 1, 2, 2]
+
+
+def test_fingerprints():
+    digest_a, signature_a = compute_fingerprint('\n'.join(POLICIES['a.com']))
+    digest_b, signature_b = compute_fingerprint('\n'.join(POLICIES['b.com']))
+    _, signature_c = compute_fingerprint('\n'.join(POLICIES['c.com']))
+    _, signature_e = compute_fingerprint('\n'.join(POLICIES['e.com']))
+    # The header line is not part of the fingerprint
+    assert digest_a == digest_b
+    assert estimate_similarity(signature_a, signature_b) == 1.0
+    # Jaccard similarity of c.com to a.com: 38 / 42
+    assert estimate_similarity(signature_a, signature_c) == pytest.approx(38 / 42, abs=0.15)
+    assert estimate_similarity(signature_a, signature_e) < 0.1
+
+
+def test_find_duplicates_matches_pairwise(index):
+    policies = list(POLICIES)
+    assert index.update(policies) == len(policies)
+    assert index.update(policies) == 0
+    fingerprints = index.get_many(policies)
+    for threshold in [None, 0.99, 0.8]:
+        assert index.find_duplicates(policies, threshold=threshold) == baseline_clusters(policies, fingerprints, threshold)
+    assert index.find_duplicates(policies) == [['a.com', 'b.com'], ['e.com', 'f.com']]
+    assert index.find_duplicates(policies, threshold=0.8) == [['a.com', 'b.com', 'c.com'], ['e.com', 'f.com']]
+
+
+def test_pairs_within_bucket(index, monkeypatch):
+    rows = NUM_PERM // LSH_BANDS
+    # The three policies only share the first band; y and z are near duplicates, x is unrelated to both (and first in the bucket)
+    x = np.arange(NUM_PERM, dtype=np.uint32) + 1000
+    x[:rows] = 0
+    y = np.arange(NUM_PERM, dtype=np.uint32)
+    y[:rows] = 0
+    z = y.copy()
+    z[rows::rows] += 500
+    fingerprints = {'x.com': ('x', x), 'y.com': ('y', y), 'z.com': ('z', z)}
+    assert estimate_similarity(y, z) > 0.85 and estimate_similarity(x, y) < 0.1
+    monkeypatch.setattr(index, 'get_many', lambda policies: fingerprints)
+    policies = list(fingerprints)
+    assert index.find_duplicates(policies, threshold=0.85, update=False) == [['y.com', 'z.com']]
+    assert index.find_duplicates(policies, threshold=0.85, update=False) == baseline_clusters(policies, fingerprints, 0.85)
+
+
+def test_invalidate(index):
+    index.update(list(POLICIES))
+    assert index.invalidate(['a.com']) == 1
+    assert 'a.com' not in index.get_many(list(POLICIES))
+    assert index.invalidate() == len(POLICIES) - 1
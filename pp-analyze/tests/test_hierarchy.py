@@ -0,0 +1,97 @@
+from ppa_commons import CompiledHierarchy, compile_hierarchy
+from pp_analyze import hierarchy_helper as hh
+
+
+def baseline_longest_path(category: str, hierarchy: dict) -> list[str]:
+    longest_path = []
+    for path in hh.get_path_to_node(category, hierarchy):
+        if len(path) > len(longest_path):
+            longest_path = path
+    return longest_path
+
+
+def baseline_map_to_level(category: str, hierarchy: dict, level: int) -> str:
+    '''
+    `map_entity_category_to_level` before the hierarchy was compiled.
+    '''
+    if level == -1:
+        return category
+    longest_path = baseline_longest_path(category, hierarchy)
+    if len(longest_path) > level:
+        return longest_path[level]
+    return longest_path[-1]
+
+
+def baseline_lift(category: str, targets: list[str], hierarchy: dict) -> str:
+    '''
+    `lift_category_to_target` before the hierarchy was compiled.
+    '''
+    for elem in reversed(baseline_longest_path(category, hierarchy)):
+        if elem in targets:
+            return elem
+    return category
+
+
+def load_hierarchies() -> list[dict]:
+    return [hh.get_data_category_hierarchy(), hh.get_purpose_hierarchy()]
+
+
+def all_nodes(hierarchy: dict) -> list[str]:
+    nodes = []
+    for parent, children in hierarchy.items():
+        nodes.append(parent)
+        nodes.extend(all_nodes(children))
+    return list(dict.fromkeys(nodes))
+
+
+def test_paths_match_walking(hierarchies):
+    for hierarchy in load_hierarchies():
+        compiled = CompiledHierarchy(hierarchy)
+        for node in all_nodes(hierarchy) + ['Unknown']:
+            assert compiled.paths(node) == hh.get_path_to_node(node, hierarchy)
+            assert compiled.paths(node, allow_non_exist=False) == hh.get_path_to_node(node, hierarchy, allow_non_exist=False)
+            assert compiled.longest_path(node) == baseline_longest_path(node, hierarchy)
+
+
+def test_map_to_level_matches_baseline(hierarchies):
+    for hierarchy in load_hierarchies():
+        compiled = CompiledHierarchy(hierarchy)
+        for node in all_nodes(hierarchy) + ['Unknown']:
+            for level in [-1, 0, 1, 2, 5]:
+                assert compiled.map_to_level(node, level) == baseline_map_to_level(node, hierarchy, level)
+                assert hh.map_entity_category_to_level(node, hierarchy, level) == baseline_map_to_level(node, hierarchy, level)
+
+
+def test_lift_matches_baseline(hierarchies):
+    data_hierarchy, purpose_hierarchy = load_hierarchies()
+    targets_list = [
+        [],
+        ['Contact'],
+        ['Identifier'],
+        ['Data-general', 'Contact'],
+        ['Email', 'Location', 'Advertising'],
+        ['Purpose-general', 'Service-provision', 'Unknown'],
+    ]
+    for hierarchy in [data_hierarchy, purpose_hierarchy]:
+        compiled = CompiledHierarchy(hierarchy)
+        for targets in targets_list:
+            for node in all_nodes(hierarchy) + ['Unknown']:
+                assert compiled.lift(node, targets) == baseline_lift(node, targets, hierarchy)
+                assert hh.lift_category_to_target(node, targets, hierarchy) == baseline_lift(node, targets, hierarchy)
+
+
+def test_is_subclass_and_depth(hierarchies):
+    data_hierarchy, _ = load_hierarchies()
+    compiled = CompiledHierarchy(data_hierarchy)
+    for node in all_nodes(data_hierarchy):
+        paths = hh.get_path_to_node(node, data_hierarchy)
+        ancestors = {elem for path in paths for elem in path}
+        for other in all_nodes(data_hierarchy):
+            assert compiled.is_subclass(node, other) == (other in ancestors)
+        assert compiled.depth(node) == len(baseline_longest_path(node, data_hierarchy)) - 1
+
+
+def test_compile_hierarchy_is_cached(hierarchies):
+    data_hierarchy, purpose_hierarchy = load_hierarchies()
+    assert compile_hierarchy(data_hierarchy) is compile_hierarchy(data_hierarchy)
+    assert compile_hierarchy(data_hierarchy) is not compile_hierarchy(purpose_hierarchy)
@@ -0,0 +1,38 @@
+from pp_analyze.kg import convert_to_kg, policy_digest, NS, NS_POLICY, A
+
+
+def test_convert_twice_gives_same_graph(results):
+    for website, segments in results.items():
+        g1 = convert_to_kg(segments, website, 'Example')
+        g2 = convert_to_kg(segments, website, 'Example')
+        assert len(g1) > 0
+        assert set(g1) == set(g2)
+
+
+def test_policy_node_from_content(results):
+    segments = results['example.com']
+    g = convert_to_kg(segments, 'example.com', 'Example')
+    assert list(g.subjects(A, NS['PrivacyPolicy'])) == [NS_POLICY[policy_digest(segments, 'example.com', 'Example')]]
+    # Other practices, or the same practices of another website, give another policy node
+    assert policy_digest(segments[:1], 'example.com', 'Example') != policy_digest(segments, 'example.com', 'Example')
+    assert policy_digest(segments, 'example.org', 'Example') != policy_digest(segments, 'example.com', 'Example')
+
+
+def test_structure(results):
+    segments = results['example.com']
+    g = convert_to_kg(segments, 'example.com', 'Example')
+    n_policy = g.value(None, A, NS['PrivacyPolicy'])
+    practices = list(g.objects(n_policy, NS['hasDataPractice']))
+    assert len(practices) == sum(len(segment.practices) for segment in segments)
+    # One node per distinct segment text and party
+    assert len(set(g.subjects(A, NS['Text']))) == 2
+    assert len(set(g.subjects(A, NS['FirstParty']))) == 1
+
+
+def test_policy_digest_covers_practice_fields(results):
+    segments = results['example.com']
+    changed = [segment.model_copy(deep=True) for segment in segments]
+    # Only a field of the practice class changes (not its text, nor the segment)
+    changed[0].practices[0].data_collected[1].category = 'Email'
+    assert policy_digest(changed, 'example.com', 'Example') != policy_digest(segments, 'example.com', 'Example')
+    assert set(convert_to_kg(changed, 'example.com', 'Example')) != set(convert_to_kg(segments, 'example.com', 'Example'))
@@ -0,0 +1,44 @@
+import io
+from rdflib import Dataset, Graph, Literal, URIRef
+from rdflib.compare import isomorphic
+from rdflib.namespace import XSD
+from pp_analyze.kg import build_kg_triples
+from pp_analyze.kg_export import export_nquads, website_graph_uri, _nt_term
+
+
+def parse_nquads(text: str) -> Dataset:
+    dataset = Dataset()
+    dataset.parse(data=text, format='nquads')
+    return dataset
+
+
+def test_round_trip(results):
+    out = io.StringIO()
+    export_nquads(results, out)
+    dataset = parse_nquads(out.getvalue())
+    for website, segments in results.items():
+        expected = Graph()
+        for triple in build_kg_triples(segments, website, website):
+            expected.add(triple)
+        exported = Graph()
+        for triple in dataset.graph(website_graph_uri(website)):
+            exported.add(triple)
+        assert len(exported) == len(expected) > 0
+        assert isomorphic(exported, expected)
+
+
+def test_literals_round_trip():
+    literals = [
+        Literal('plain "quoted" \\ text\nwith a line break'),
+        Literal('tagged', lang='en'),
+        Literal(3),
+        Literal('2024-01-01', datatype=XSD.date),
+        Literal('x', datatype=URIRef('urn:example:type with space')),
+    ]
+    subject = URIRef('urn:example:s')
+    graph = URIRef('urn:example:g')
+    text = ''.join(f'{_nt_term(subject)} <urn:example:p{i}> {_nt_term(literal)} {_nt_term(graph)} .\n' for i, literal in enumerate(literals))
+    dataset = parse_nquads(text)
+    parsed = [dataset.graph(graph).value(subject, URIRef(f'urn:example:p{i}')) for i in range(len(literals))]
+    assert parsed[:4] == literals[:4]
+    assert parsed[4].datatype == URIRef('urn:example:type%20with%20space')
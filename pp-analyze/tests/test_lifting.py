@@ -0,0 +1,38 @@
+import copy
+from pp_analyze.lifting import bulk_lift, lift_segments
+
+
+TARGETS_LIST = [
+    [],
+    ['Contact'],
+    ['Identifier', 'Advertising'],
+    ['Data-general', 'Location', 'Service-provision'],
+    ['Email', 'Purpose-general'],
+]
+
+
+def test_lift_segments_matches_per_segment_lift(hierarchies, results):
+    segments = [segment for segments in results.values() for segment in segments]
+    for targets in TARGETS_LIST:
+        expected_segments = copy.deepcopy(segments)
+        expected_changes = [segment.lift(targets) for segment in expected_segments]
+        lifted_segments = copy.deepcopy(segments)
+        changes = lift_segments(lifted_segments, targets)
+        assert changes == [change or False for change in expected_changes]
+        assert lifted_segments == expected_segments
+
+
+def test_bulk_lift_keeps_shape(hierarchies, results):
+    targets = ['Contact', 'Advertising']
+    expected = copy.deepcopy(results)
+    expected_changes = {website: [segment.lift(targets) or False for segment in segments] for website, segments in expected.items()}
+    changes = bulk_lift(results, targets)
+    assert changes == expected_changes
+    assert results == expected
+
+    segments = copy.deepcopy(expected['example.com'])
+    assert bulk_lift(segments, ['Data-general']) == lift_segments(copy.deepcopy(expected['example.com']), ['Data-general'])
+
+
+def test_nothing_to_lift(hierarchies):
+    assert lift_segments([], ['Contact']) == []
@@ -0,0 +1,28 @@
+from pp_analyze import policy_text_utils as ptu
+
+
+PP_TEXT = 'Privacy Policy\n\n  We collect your email.  \nWe share it.\n\tWe collect your email.\nÜnïcödé “text”\n'
+
+
+def test_policy_segments():
+    policy = ptu.Policy(PP_TEXT)
+    assert list(policy.segments) == ptu.convert_into_segments(PP_TEXT)
+    assert len(policy) == 5 and list(policy.segment_ids) == [0, 1, 2, 3, 4]
+    assert [PP_TEXT[start:end] for start, end in policy.offsets] == list(policy.segments)
+    assert list(policy.segment_hashes) == [ptu.segment_hash(segment) for segment in policy.segments]
+    assert policy.digest == ptu.text_digest(PP_TEXT)
+
+
+def test_find_segment():
+    policy = ptu.Policy(PP_TEXT)
+    # Repeated segments are found at their first occurrence
+    assert policy.find_segment('We collect your email.') == 1
+    assert policy.find_segment('Ünïcödé “text”') == 4
+    assert policy.find_segment('We share') is None
+    assert policy.segment_key(1) != ptu.Policy(PP_TEXT + 'More.').segment_key(1)
+
+
+def test_get_policy_cached():
+    policy = ptu.get_policy(PP_TEXT)
+    assert ptu.get_policy(PP_TEXT) is policy
+    assert ptu.get_cached_policy(policy.digest) is policy
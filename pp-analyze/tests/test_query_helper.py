@@ -0,0 +1,47 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from sqlmodel import SQLModel, Session, create_engine, select
+from pp_analyze.recognition import db, query_helper
+from pp_analyze.recognition.query_helper import QueryHelper
+from pp_analyze.recognition.types import QueryCategory
+
+
+class FakeCompletions:
+    def create(self, messages, **kwargs):
+        time.sleep(0.01)
+        message = SimpleNamespace(content=f'["{messages[-1]["content"]}"]')
+        usage = {'prompt_tokens': 2, 'completion_tokens': 1}
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def make_helper(monkeypatch, tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "cache.sqlite"}')
+    SQLModel.metadata.create_all(engine)
+    monkeypatch.setattr(db, 'engine', engine)
+    monkeypatch.setattr(query_helper, 'client', SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions())))
+    return QueryHelper(
+        cache_category=QueryCategory.DATA_ENTITY,
+        system_message='system',
+        user_message_template='{segment} {extra}',
+        llm_model='fake-model',
+        user_message_fn=lambda data: {'extra': data['segment'].upper()},
+    )
+
+
+def test_concurrent_queries(monkeypatch, tmp_path):
+    helper = make_helper(monkeypatch, tmp_path)
+    data = [{'segment': f's{i % 20}'} for i in range(40)]
+
+    async def main():
+        await asyncio.gather(*(helper.arun_query(d) for d in data[:20]))
+        return await asyncio.gather(*(helper.arun_query(d) for d in data))
+
+    results = asyncio.run(main())
+    assert results == [[f's{i % 20} S{i % 20}'] for i in range(40)]
+    # The caller's data is not modified
+    assert data == [{'segment': f's{i % 20}'} for i in range(40)]
+    usage = helper.get_usage()
+    assert (usage['queries'], usage['cache_hits'], usage['llm_calls'], usage['prompt_tokens'], usage['completion_tokens']) == (60, 40, 20, 40, 20)
+    with Session(db.engine) as session:
+        assert len(session.exec(select(db.QueryRecord)).all()) == 20
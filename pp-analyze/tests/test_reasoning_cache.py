@@ -0,0 +1,61 @@
+from pp_analyze.reasoning_cache import ReasoningCache, get_reasoning_key, get_rule_set_version
+
+
+def test_reasoning_key():
+    key = get_reasoning_key('persona', 'policy', 'v1')
+    assert key == get_reasoning_key('persona', 'policy', 'v1')
+    assert len({key, get_reasoning_key('persona', 'policy', 'v2'), get_reasoning_key('persona', 'other policy', 'v1'), get_reasoning_key('personapolicy', '', 'v1')}) == 4
+    # Other kinds of results for the same inputs have other keys
+    assert get_reasoning_key('persona', 'policy', 'v1', 'batched') not in {key, get_reasoning_key('persona', 'policy', 'v1', 'other')}
+
+
+def test_rule_set_version(tmp_path):
+    rule_file = tmp_path / 'rules.n3'
+    query_file = tmp_path / 'query.n3'
+    rule_file.write_text('rules')
+    query_file.write_text('query')
+    version = get_rule_set_version([str(rule_file)], str(query_file), 'no-such-reasoner')
+    rule_file.write_text('changed rules')
+    assert get_rule_set_version([str(rule_file)], str(query_file), 'no-such-reasoner') != version
+
+
+def test_get_put_many(tmp_path):
+    cache = ReasoningCache(tmp_path / 'cache.sqlite')
+    assert cache.get_many(['k1', 'k2']) == {}
+    cache.put_many([
+        ('k1', 'v1', 'a.com', 'result 1', ''),
+        ('k2', 'v1', 'b.com', 'result 2', 'error 2'),
+        ('k1', 'v1', 'a.com', 'result 1 again', ''),
+    ])
+    assert cache.get_many(['k1', 'k2', 'k3']) == {'k1': ('result 1 again', ''), 'k2': ('result 2', 'error 2')}
+    cache.put('k2', 'v2', 'b.com', 'new result 2', '')
+    assert cache.get('k2') == ('new result 2', '')
+    assert cache.get('k3') is None
+    stats = cache.get_stats()
+    assert (stats['lookups'], stats['hits'], stats['stored']) == (7, 3, 3)
+
+    # Persisted in the database
+    assert ReasoningCache(tmp_path / 'cache.sqlite').get_many(['k1', 'k2']) == {'k1': ('result 1 again', ''), 'k2': ('new result 2', '')}
+
+
+def test_many_keys(tmp_path):
+    cache = ReasoningCache(tmp_path / 'cache.sqlite')
+    records = [(f'k{i}', 'v1', f'{i}.com', f'result {i}', '') for i in range(1200)]
+    cache.put_many(records)
+    assert cache.get_many([record[0] for record in records]) == {key: (result, err) for key, _, _, result, err in records}
+
+
+def test_invalidate(tmp_path):
+    cache = ReasoningCache(tmp_path / 'cache.sqlite')
+    cache.put_many([
+        ('k1', 'v1', 'a.com', 'result 1', ''),
+        ('k2', 'v2', 'a.com', 'result 2', ''),
+        ('k3', 'v3', 'a.com', 'result 3', ''),
+        ('k4', 'v3', 'b.com', 'result 4', ''),
+    ])
+    assert cache.invalidate('v1') == 1
+    assert list(cache.get_many(['k1', 'k2', 'k3', 'k4'])) == ['k2', 'k3', 'k4']
+    assert cache.invalidate(keep='v3') == 1
+    assert sorted(cache.get_many(['k1', 'k2', 'k3', 'k4'])) == ['k3', 'k4']
+    assert cache.invalidate() == 2
+    assert cache.get_many(['k3', 'k4']) == {}
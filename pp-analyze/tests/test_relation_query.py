@@ -0,0 +1,65 @@
+from pp_analyze.recognition.aux_utils import estimate_query_tokens, halve_relation_query, split_relation_query, renumber_relation_query
+
+
+def make_query(num_action_contexts: int, num_entities: int) -> dict:
+    '''
+    A relation query of the form of `convert_grouped_practices_to_query_data`.
+    '''
+    return {
+        "segment": "We collect and share your data with partners. " * 4,
+        "targets": {
+            "action_contexts": [{"id": f"C{i+1}", "action": f"collect {i}", "context": f"context of action {i} " * 3} for i in range(num_action_contexts)],
+            "entities": [{"id": f"D{i+1}", "text": f"entity {i}", "type": "Data"} for i in range(num_entities)],
+        },
+    }
+
+
+def pairs(query_data: dict) -> list[tuple[str, str]]:
+    return [(action_context['id'], entity['id']) for action_context in query_data['targets']['action_contexts'] for entity in query_data['targets']['entities']]
+
+
+def test_halve_covers_each_pair_once():
+    for num_action_contexts, num_entities in [(1, 2), (2, 1), (5, 3), (3, 5), (4, 4), (7, 1)]:
+        query = make_query(num_action_contexts, num_entities)
+        halves = halve_relation_query(query)
+        assert len(halves) == 2
+        assert sorted(pair for half in halves for pair in pairs(half)) == sorted(pairs(query))
+        for half in halves:
+            assert half['segment'] == query['segment']
+            # IDs (and the items) are kept unchanged
+            for key in ['action_contexts', 'entities']:
+                assert all(item in query['targets'][key] for item in half['targets'][key])
+
+
+def test_halve_single_pair():
+    assert halve_relation_query(make_query(1, 1)) == []
+    assert halve_relation_query(make_query(1, 0)) == []
+
+
+def test_split_within_bound():
+    query = make_query(3, 2)
+    assert split_relation_query(query, estimate_query_tokens(query)) == [query]
+
+    query = make_query(12, 9)
+    # The segment is in every sub-query, so the bound must allow at least a small sub-query
+    max_tokens = estimate_query_tokens(make_query(2, 2))
+    sub_queries = split_relation_query(query, max_tokens)
+    assert len(sub_queries) > 1
+    assert all(estimate_query_tokens(sub_query) <= max_tokens for sub_query in sub_queries)
+    assert sorted(pair for sub_query in sub_queries for pair in pairs(sub_query)) == sorted(pairs(query))
+
+
+def test_split_keeps_unsplittable_query():
+    query = make_query(1, 1)
+    assert split_relation_query(query, 1) == [query]
+    sub_queries = split_relation_query(make_query(2, 2), 1)
+    assert [len(pairs(sub_query)) for sub_query in sub_queries] == [1, 1, 1, 1]
+
+
+def test_renumber():
+    query = make_query(4, 3)
+    half = halve_relation_query(query)[1]
+    renumbered, id_map = renumber_relation_query(half)
+    assert [action_context['id'] for action_context in renumbered['targets']['action_contexts']] == ['C1', 'C2']
+    assert [entity['id'] for entity in renumbered['targets']['entities']] == ['D1', 'D2', 'D3']
+    assert [(id_map[action_id], id_map[entity_id]) for action_id, entity_id in pairs(renumbered)] == pairs(half)
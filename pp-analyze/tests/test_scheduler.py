@@ -0,0 +1,82 @@
+import asyncio
+from pp_analyze.scheduler import JobScheduler, fair_order
+
+
+def make_jobs(started: list, groups: dict[str, int], delay: float = 0):
+    async def job(key):
+        started.append(key)
+        await asyncio.sleep(delay)
+        if key == ('b', 1):
+            raise ValueError(key)
+        return key
+    return [(group, (group, i), lambda key=(group, i): job(key)) for group, n in groups.items() for i in range(n)]
+
+
+def test_fair_order():
+    jobs = make_jobs([], {'a': 3, 'b': 1, 'c': 2})
+    assert [key for _, key, _ in fair_order(jobs)] == [('a', 0), ('b', 0), ('c', 0), ('a', 1), ('c', 1), ('a', 2)]
+
+
+def test_run_in_fair_order():
+    started = []
+    progress = []
+    scheduler = JobScheduler(max_concurrency=1, on_progress=lambda done, total, key: progress.append((done, total, key)))
+    results, errors = asyncio.run(scheduler.run(make_jobs(started, {'a': 2, 'b': 2})))
+    assert started == [('a', 0), ('b', 0), ('a', 1), ('b', 1)]
+    assert results == {('a', 0): ('a', 0), ('b', 0): ('b', 0), ('a', 1): ('a', 1)}
+    assert list(errors) == [('b', 1)] and isinstance(errors[('b', 1)], ValueError)
+    assert progress == [(i + 1, 4, key) for i, key in enumerate(started)]
+    assert not scheduler.interrupted
+
+
+def test_concurrency():
+    running = 0
+    max_running = 0
+
+    async def job():
+        nonlocal running, max_running
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    results, _ = asyncio.run(JobScheduler(max_concurrency=3).run([('a', i, job) for i in range(10)]))
+    assert len(results) == 10
+    assert max_running == 3
+
+
+def test_cancel_keeps_partial_results():
+    started = []
+    scheduler = JobScheduler(max_concurrency=2)
+
+    def on_progress(done, total, key):
+        if done == 3:
+            scheduler.cancel()
+
+    scheduler.on_progress = on_progress
+    results, errors = asyncio.run(scheduler.run(make_jobs(started, {'a': 5, 'c': 5}, delay=0.01)))
+    assert scheduler.cancelled and scheduler.interrupted
+    assert 3 <= len(results) + len(errors) < 10
+    assert all(results[key] == key for key in results)
+    # No job is started after the cancellation, beyond those already running
+    assert len(started) <= len(results) + len(errors) + 2
+
+
+def test_task_cancellation_propagates():
+    started = []
+    scheduler = JobScheduler(max_concurrency=2)
+
+    async def main():
+        task = asyncio.create_task(scheduler.run(make_jobs(started, {'a': 5, 'c': 5}, delay=0.01)))
+        while len(scheduler.results) + len(scheduler.errors) < 3:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(main())
+    assert scheduler.cancelled and scheduler.interrupted
+    assert 3 <= len(scheduler.results) + len(scheduler.errors) < 10
@@ -0,0 +1,64 @@
+from pp_analyze.recognition.span_resolution import AhoCorasick, resolve_spans, resolve_spans_batch, UNRESOLVED_SPAN
+
+
+SEGMENT = 'We collect your email address, and we share your email address with partners for advertising.'
+
+
+def find_all_occurrences(text: str, pattern: str) -> list[int]:
+    '''
+    All (possibly overlapping) start positions of the pattern, with str.find.
+    '''
+    res = []
+    start = text.find(pattern)
+    while start != -1:
+        res.append(start)
+        start = text.find(pattern, start + 1)
+    return res
+
+
+def baseline_span(segment: str, string: str) -> tuple[int, int]:
+    '''
+    The span as located before span resolution (the first occurrence, by str.find).
+    '''
+    start = segment.find(string)
+    return (start, start + len(string))
+
+
+def test_aho_corasick_matches_str_find():
+    patterns = ['email', 'email address', 'mail', 'your', 'partners', 'a', 'aa', 'not there']
+    texts = [SEGMENT, 'aaaa', '', 'emailemail address']
+    for text in texts:
+        occurrences = AhoCorasick(patterns).find_all(text)
+        assert occurrences == [find_all_occurrences(text, pattern) for pattern in patterns]
+
+
+def test_single_mentions_match_baseline():
+    strings = ['your email address', 'partners', 'advertising', 'We collect']
+    assert resolve_spans(SEGMENT, strings) == [baseline_span(SEGMENT, string) for string in strings]
+
+
+def test_repeated_mentions_map_to_occurrences_in_order():
+    spans = resolve_spans(SEGMENT, ['your email address', 'partners', 'your email address', 'your email address'])
+    first, second = find_all_occurrences(SEGMENT, 'your email address')
+    length = len('your email address')
+    # The third mention has no occurrence left, and falls back to the first one
+    assert spans == [(first, first + length), baseline_span(SEGMENT, 'partners'), (second, second + length), (first, first + length)]
+
+
+def test_loose_and_fuzzy_matches():
+    start = SEGMENT.find('your email address')
+    assert resolve_spans(SEGMENT, ['Your  Email address']) == [(start, start + len('your email address'))]
+    start = SEGMENT.find('advertising')
+    assert resolve_spans(SEGMENT, ['advertsing']) == [(start, start + len('advertising'))]
+
+
+def test_unresolved():
+    assert resolve_spans(SEGMENT, ['browsing history', '']) == [UNRESOLVED_SPAN, UNRESOLVED_SPAN]
+
+
+def test_batch():
+    segments = [SEGMENT, 'Nothing here.', 'Your email address is here.', '']
+    # The strings of one segment may occur in another one (e.g. 'email' in the first segment, and 'here' in the third one)
+    strings_per_segment = [['partners', 'your email address', 'your email address', 'advertsing'], ['here', 'email'], ['email address', 'here', ''], []]
+    assert resolve_spans_batch(segments, strings_per_segment) == [resolve_spans(segment, strings) for segment, strings in zip(segments, strings_per_segment)]
+    assert resolve_spans_batch(['a', 'b'], [[], ['']]) == [[], [UNRESOLVED_SPAN]]
@@ -0,0 +1,71 @@
+from rdflib import Graph, BNode, Literal
+from pp_analyze.dtou import NS_DTOU, NS_EX
+from pp_analyze.kg import NS
+from pp_analyze.user_preference_analyze import A, remove_node_prefix, split_conflicts_by_website
+
+
+def add_conflict(graph: Graph, label: str, policy_node=None, text: str | None = None) -> BNode:
+    n_conflict = BNode(f'{label}conflict')
+    n_detail = BNode(f'{label}detail')
+    graph.add((n_conflict, A, NS_DTOU['Conflict']))
+    graph.add((n_conflict, NS_DTOU['detail'], n_detail))
+    graph.add((n_detail, NS_DTOU['reason'], Literal(f'reason of {label}')))
+    if policy_node is not None:
+        graph.add((n_detail, NS_DTOU['policy'], policy_node))
+    if text is not None:
+        graph.add((n_detail, NS['text'], Literal(text)))
+    return n_conflict
+
+
+def test_split_conflicts_by_website():
+    graph = Graph()
+    # By the policy node (referred to from a nested blank node)
+    add_conflict(graph, 'a', policy_node=NS_EX['w0_policy1'])
+    add_conflict(graph, 'b', policy_node=NS_EX['w1_policy1'])
+    add_conflict(graph, 'c', policy_node=NS_EX['w1_usageContext1'])
+    # By the text, which only one website has
+    add_conflict(graph, 'd', text='Only in a.com.')
+    # By the text, which both websites have
+    add_conflict(graph, 'e', text='In both.')
+    # Not a conflict
+    graph.add((BNode('other'), NS['text'], Literal('Only in a.com.')))
+
+    website_nodes = {
+        'a.com': {NS_EX['w0_policy1'], NS_EX['w0_usageContext1']},
+        'b.com': {NS_EX['w1_policy1'], NS_EX['w1_usageContext1']},
+        'c.com': {NS_EX['w2_policy1'], NS_EX['w2_usageContext1']},
+    }
+    website_texts = {
+        'a.com': {'Only in a.com.', 'In both.'},
+        'b.com': {'In both.'},
+        'c.com': set(),
+    }
+    split, unresolved = split_conflicts_by_website(graph, website_nodes, website_texts)
+    assert unresolved == {'a.com', 'b.com'}
+    assert sorted(split) == ['a.com', 'b.com']
+    assert set(split['a.com'].subjects(A, NS_DTOU['Conflict'])) == {BNode('aconflict'), BNode('dconflict')}
+    assert set(split['b.com'].subjects(A, NS_DTOU['Conflict'])) == {BNode('bconflict'), BNode('cconflict')}
+    # The whole conflict is kept, and nothing else
+    assert (BNode('adetail'), NS_DTOU['reason'], Literal('reason of a')) in split['a.com']
+    assert len(split['a.com']) == 8
+    assert (BNode('other'), None, None) not in split['a.com']
+
+
+def test_unresolved_without_texts():
+    graph = Graph()
+    add_conflict(graph, 'a')
+    split, unresolved = split_conflicts_by_website(graph, {'a.com': {NS_EX['w0_policy1']}, 'b.com': {NS_EX['w1_policy1']}}, {'a.com': set(), 'b.com': set()})
+    assert split == {}
+    assert unresolved == {'a.com', 'b.com'}
+
+
+def test_remove_node_prefix():
+    graph = Graph()
+    n_conflict = add_conflict(graph, 'a', policy_node=NS_EX['w3_policy1'])
+    graph.add((n_conflict, NS_DTOU['context'], NS_EX['w3_usageContext1']))
+    graph.add((n_conflict, NS_DTOU['other'], NS_EX['w13_policy1']))
+    renamed = remove_node_prefix(graph, 'w3_')
+    assert len(renamed) == len(graph)
+    assert (BNode('adetail'), NS_DTOU['policy'], NS_EX['policy1']) in renamed
+    assert (n_conflict, NS_DTOU['context'], NS_EX['usageContext1']) in renamed
+    assert (n_conflict, NS_DTOU['other'], NS_EX['w13_policy1']) in renamed
@@ -0,0 +1,65 @@
+import pytest
+from rdflib import BNode, Graph, Literal, RDF
+from pp_analyze import corpus
+from pp_analyze.corpus import get_relative_file_path_for_pp
+from pp_analyze.data_model import SegmentedDataPractice
+from pp_analyze.dtou import NS_DTOU
+from pp_analyze.kg import NS
+from pp_analyze import policy_text_utils as ptu
+from pp_analyze.website_compliance_evaluation import build_conflict_table, build_practice_table, get_conflict_counts
+
+
+POLICIES = {
+    'a.com': 'Policy of a.com\nWe collect your email.\nWe share it.\nWe collect your email.\n',
+    'b.com': 'Policy of b.com\nWe share it.\n',
+}
+
+
+@pytest.fixture
+def policy_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('PP_POLICY_DIR', str(tmp_path / 'policies'))
+    monkeypatch.delenv('PP_POLICY_CORPUS', raising=False)
+    monkeypatch.setattr(corpus, '_policy_corpus', None)
+    for domain, pp_text in POLICIES.items():
+        pp_file = get_relative_file_path_for_pp(domain)
+        pp_file.parent.mkdir(parents=True, exist_ok=True)
+        pp_file.write_text(pp_text)
+
+
+def conflict_graph(*segments: str) -> Graph:
+    graph = Graph()
+    for i, segment in enumerate(segments):
+        graph.add((BNode(f'c{i}'), RDF.type, NS_DTOU['Conflict']))
+        graph.add((BNode(f'c{i}'), NS['text'], Literal(segment)))
+    return graph
+
+
+def test_tables_use_segment_ids(policy_dir):
+    conflicts = {
+        'p1': {'a.com': conflict_graph('We collect your email.', 'We share it.', 'We share it.'), 'b.com': Graph()},
+        'p2': {'b.com': conflict_graph('We share it.', 'Not in the policy.')},
+    }
+    table = build_conflict_table(conflicts)
+    policy_a = ptu.get_policy(POLICIES['a.com'])
+    assert table[table['persona'] == 'p1']['segment_id'].tolist()[:3] == [policy_a.find_segment('We collect your email.'), 2, 2]
+    ids_b = table[table['persona'] == 'p2']['segment_id'].tolist()
+    assert ids_b[0] == 1 and ids_b[1] < 0
+
+    practices = {
+        'a.com': [SegmentedDataPractice(segment='We collect your email.', practices=[]), SegmentedDataPractice(segment='We share it.', practices=[])],
+        'b.com': [SegmentedDataPractice(segment='We share it.', practices=[]), SegmentedDataPractice(segment='Not in the policy.', practices=[])],
+    }
+    assert build_practice_table(practices)['segment_id'].tolist() == [1, 2, 1, ids_b[1]]
+    counts = get_conflict_counts(table, practices)
+    assert counts.loc[('p1', 'a.com')].tolist() == [3, 2, 2]
+    assert counts.loc[('p1', 'b.com')].tolist() == [0, 0, 0]
+    assert counts.loc[('p2', 'b.com')].tolist() == [2, 2, 2]
+
+
+def test_tables_without_policies(monkeypatch):
+    monkeypatch.delenv('PP_POLICY_DIR', raising=False)
+    monkeypatch.delenv('PP_POLICY_CORPUS', raising=False)
+    monkeypatch.setattr(corpus, '_policy_corpus', None)
+    table = build_conflict_table({'p1': {'a.com': conflict_graph('One.', 'Two.', 'One.')}})
+    ids = table['segment_id'].tolist()
+    assert ids[0] == ids[2] != ids[1]
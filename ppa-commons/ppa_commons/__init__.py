@@ -2,10 +2,15 @@ from .llm_result_handler import (
     DataType,
     heuristic_extract_entities,
 )
-from . import external, env_helper, llm_result_handler
+from . import external, env_helper, hierarchy, llm_result_handler
 from .external import json_parse
 from .external.json_parse import try_parse_json_object
 from .env_helper import (
     get_entity_category_hierarchy,
     get_entity_category_definitions,
+)
+from .hierarchy import (
+    CompiledHierarchy,
+    compile_hierarchy,
+    get_compiled_entity_category_hierarchy,
 )
\ No newline at end of file
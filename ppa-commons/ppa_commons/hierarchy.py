@@ -0,0 +1,155 @@
+'''
+Compiled form of an entity category hierarchy (see `get_entity_category_hierarchy`), for answering path, level-mapping and lifting queries without walking the nested dictionary.
+'''
+
+from .env_helper import get_entity_category_hierarchy
+
+
+class CompiledHierarchy:
+    '''
+    An entity category hierarchy with interned nodes (integer IDs), all root-to-node paths, the depth and the ancestor bitset of each node.
+
+    The paths of a node are in the same order as found by a depth-first walk over the nested dictionary, and the longest path is the first one of maximal length, so that the results are the same as walking the hierarchy.
+    Nodes not in the hierarchy are treated as roots without children (their only path is the node itself).
+    '''
+
+    def __init__(self, hierarchy: dict):
+        self.nodes: list[str] = []
+        self.node_ids: dict[str, int] = {}
+        self._paths: list[list[tuple[int, ...]]] = []
+        self._walk(hierarchy, ())
+        self._longest_paths: list[tuple[int, ...]] = []
+        self._ancestors: list[int] = []
+        for paths in self._paths:
+            longest_path = paths[0]
+            ancestors = 0
+            for path in paths:
+                if len(path) > len(longest_path):
+                    longest_path = path
+                for node_id in path:
+                    ancestors |= 1 << node_id
+            self._longest_paths.append(longest_path)
+            self._ancestors.append(ancestors)
+        self._target_masks: dict[frozenset[str], int] = {}
+        self._lift_cache: dict[tuple[frozenset[str], str], str] = {}
+
+    def _intern(self, node: str) -> int:
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            node_id = len(self.nodes)
+            self.node_ids[node] = node_id
+            self.nodes.append(node)
+            self._paths.append([])
+        return node_id
+
+    def _walk(self, hierarchy: dict, prefix: tuple[int, ...]):
+        for parent, children in hierarchy.items():
+            path = prefix + (self._intern(parent),)
+            self._paths[path[-1]].append(path)
+            self._walk(children, path)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self.node_ids
+
+    def _names(self, path: tuple[int, ...]) -> list[str]:
+        return [self.nodes[node_id] for node_id in path]
+
+    def paths(self, node: str, allow_non_exist: bool = True) -> list[list[str]]:
+        '''
+        Get the path(s) from the root(s) to the node. If the node is not in the hierarchy, return [[node]] if `allow_non_exist`, otherwise [].
+        '''
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            return [[node]] if allow_non_exist else []
+        return [self._names(path) for path in self._paths[node_id]]
+
+    def longest_path(self, node: str) -> list[str]:
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            return [node]
+        return self._names(self._longest_paths[node_id])
+
+    def depth(self, node: str) -> int:
+        '''
+        Depth of the node on its longest path (0 for top level nodes and nodes not in the hierarchy).
+        '''
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            return 0
+        return len(self._longest_paths[node_id]) - 1
+
+    def is_subclass(self, node: str, ancestor: str) -> bool:
+        '''
+        Whether `ancestor` is on any path to `node` (including `node` itself).
+        '''
+        if node == ancestor:
+            return True
+        node_id = self.node_ids.get(node)
+        ancestor_id = self.node_ids.get(ancestor)
+        if node_id is None or ancestor_id is None:
+            return False
+        return bool(self._ancestors[node_id] >> ancestor_id & 1)
+
+    def map_to_level(self, node: str, level: int = 1) -> str:
+        '''
+        Map the node to its ancestor at `level` on its longest path (the node itself if the path is not that long, or `level` is -1).
+        '''
+        if level == -1:
+            return node
+        node_id = self.node_ids.get(node)
+        if node_id is None:
+            return node
+        longest_path = self._longest_paths[node_id]
+        return self.nodes[longest_path[level] if len(longest_path) > level else longest_path[-1]]
+
+    def _target_mask(self, targets: frozenset[str]) -> int:
+        mask = self._target_masks.get(targets)
+        if mask is None:
+            mask = 0
+            for target in targets:
+                node_id = self.node_ids.get(target)
+                if node_id is not None:
+                    mask |= 1 << node_id
+            self._target_masks[targets] = mask
+        return mask
+
+    def lift(self, node: str, targets) -> str:
+        '''
+        Lift the node to the deepest of the target nodes on its longest path; the node itself if none of them is.
+        '''
+        targets = frozenset(targets)
+        key = (targets, node)
+        res = self._lift_cache.get(key)
+        if res is None:
+            res = node
+            node_id = self.node_ids.get(node)
+            if node_id is not None:
+                mask = self._target_mask(targets)
+                if self._ancestors[node_id] & mask:
+                    for ancestor_id in reversed(self._longest_paths[node_id]):
+                        if mask >> ancestor_id & 1:
+                            res = self.nodes[ancestor_id]
+                            break
+            self._lift_cache[key] = res
+        return node if res == node else res
+
+
+_compiled_hierarchies: dict[int, tuple[dict, CompiledHierarchy]] = {}
+
+
+def compile_hierarchy(hierarchy: dict) -> CompiledHierarchy:
+    '''
+    Get the compiled form of the hierarchy. The result is cached for the hierarchy object, which therefore must not be modified afterwards (as is the case for those from `get_entity_category_hierarchy`).
+    '''
+    cached = _compiled_hierarchies.get(id(hierarchy))
+    if cached is None or cached[0] is not hierarchy:
+        cached = (hierarchy, CompiledHierarchy(hierarchy))
+        _compiled_hierarchies[id(hierarchy)] = cached
+    return cached[1]
+
+
+def get_compiled_entity_category_hierarchy(entity_category_hierarchy_file) -> CompiledHierarchy:
+    '''
+    Get the compiled form of the hierarchy in the file, see `get_entity_category_hierarchy`.
+    '''
+    return compile_hierarchy(get_entity_category_hierarchy(entity_category_hierarchy_file))
@@ -9,12 +9,40 @@ class DataType(Enum):
     RELATION = 'relation'
     SUBSUMPTION = 'subsumption'
     RETENTION_DETAILS = 'retention_details'
+    CLASSIFIED_ENTITY = 'classified_entity'
+
+
+_ENTITY_TYPE_KEYS = ['context_type', 'context', 'type', 'contextType']
+_ENTITY_TEXT_KEYS = ['data_entity', 'purpose', 'text', 'data', 'entity', 'dataEntity', 'data entity', 'purpose_text', 'purpose_entity']
+_ENTITY_CATEGORY_KEYS = ['category', 'data_category', 'purpose_category', 'dataCategory', 'purposeCategory', 'class']
+
+
+def _find_unique_key(obj: dict, keys: list[str]) -> str | None:
+    found = None
+    for key in keys:
+        if key in obj:
+            if found is not None:
+                raise ValueError(f"Multiple keys found in the same object: {found} and {key}")
+            found = key
+    return found
 
 
 def heuristic_extract_entities(parsed_model_output, data_type: DataType = DataType.ENTITY):
-    if data_type not in {DataType.ENTITY, DataType.RETENTION_DETAILS}:  # Not all data types should/can be heuristic-extracted
+    if data_type not in {DataType.ENTITY, DataType.RETENTION_DETAILS, DataType.CLASSIFIED_ENTITY}:  # Not all data types should/can be heuristic-extracted
         return parsed_model_output
     extracted_output = []
+    if data_type == DataType.CLASSIFIED_ENTITY:
+        # Entities extracted together with their categories, e.g. `{"text": ..., "category": ...}`; the category is None if the model omitted it
+        for obj in parsed_model_output:
+            if isinstance(obj, str):
+                extracted_output.append({'text': obj, 'category': None})
+                continue
+            text_key = _find_unique_key(obj, _ENTITY_TEXT_KEYS)
+            category_key = _find_unique_key(obj, _ENTITY_CATEGORY_KEYS)
+            if text_key is None:
+                continue
+            extracted_output.append({'text': obj[text_key], 'category': obj[category_key] if category_key else None})
+        return extracted_output
     if data_type == DataType.RETENTION_DETAILS:
         for obj in parsed_model_output:
             if 'retention-period' in obj and not obj['retention-period']:
@@ -27,20 +55,8 @@ def heuristic_extract_entities(parsed_model_output, data_type: DataType = DataTy
         if isinstance(obj, str):
             extracted_output.append(obj)
         else:
-            grp1 = ['context_type', 'context', 'type', 'contextType']
-            grp2 = ['data_entity', 'purpose', 'text', 'data', 'entity', 'dataEntity', 'data entity', 'purpose_text', 'purpose_entity']
-            grp1_exists = None
-            grp2_exists = None
-            for key in grp1:
-                if key in obj:
-                    if grp1_exists is not None:
-                        raise ValueError(f"Multiple keys found in the same object: {grp1_exists} and {key}")
-                    grp1_exists = key
-            for key in grp2:
-                if key in obj:
-                    if grp2_exists is not None:
-                        raise ValueError(f"Multiple keys found in the same object: {grp2_exists} and {key}")
-                    grp2_exists = key
+            grp1_exists = _find_unique_key(obj, _ENTITY_TYPE_KEYS)
+            grp2_exists = _find_unique_key(obj, _ENTITY_TEXT_KEYS)
             if grp2_exists:
                 extracted_output.append(obj[grp2_exists])
             # if 'context_type' in obj and 'data_entity' in obj:  # gpt-4o-mini-2024-07-18